@@ -3,11 +3,69 @@ from .stripe import (
     StripeException,
     StripeError,
     ParseError,
+    StripeTimeout,
     DeletionError,
 
     Charge,
     Customer,
     Card,
+    Refund,
+    Event,
+    LazyModel,
 
     Client,
+    RetryPolicy,
+    PoolConfig,
+    Pager,
+    Backfill,
+    EventStream,
+)
+from .ratelimit import (
+    TokenBucket,
+    RateLimiter,
+)
+from .bulk import (
+    Bulk,
+    BulkResult,
+)
+from .cache import ResponseCache
+from .columnar import (
+    CardBatch,
+    ChargeBatch,
+    RefundBatch,
+)
+from .reporting import (
+    ChargeReport,
+    ChargeSummary,
+    RefundReport,
+    RefundSummary,
+    charge_report,
+    refund_report,
+)
+from .checkpoint import (
+    Checkpoint,
+    MemoryCheckpoint,
+    FileCheckpoint,
+)
+from .mirror import (
+    MirrorCheckpoint,
+    MirrorSync,
+    SQLiteMirror,
+)
+from .instrument import (
+    CallTrace,
+    Hooks,
+    MetricsCollector,
+    RequestEvent,
+    phase_trace_config,
+)
+from .dedup import (
+    DedupStore,
+    MemoryDedupStore,
+    SQLiteDedupStore,
+)
+from .webhook import (
+    SignatureError,
+    WebhookReceiver,
+    webhook_handler,
 )
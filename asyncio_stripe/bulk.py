@@ -0,0 +1,167 @@
+import asyncio
+import collections
+
+import attr
+
+
+@attr.s(slots=True, frozen=True)
+class BulkResult(object):
+    '''
+    Outcome of a single call issued through Bulk.
+
+    @ivar index     - position of the call in the input iterable
+    @ivar value     - value returned by the call, None on failure
+    @ivar exception - exception raised by the call, None on success
+    '''
+    index = attr.ib()
+    value = attr.ib(default=None)
+    exception = attr.ib(default=None)
+
+    @property
+    def ok(self):
+        return self.exception is None
+
+
+class Bulk(object):
+    '''
+    Async iterator running calls with bounded concurrency.
+
+    Calls are taken lazily from the input iterable and a new one is started
+    as soon as one finishes, so `concurrency` of them are in flight at once
+    however slowly results are consumed.  Completed results wait in a buffer
+    until they are yielded, with `ordered` in input order, otherwise as they
+    complete.  No call is started while `buffer` results are waiting, e.g.
+    behind a slow call when ordered, which bounds memory however many calls
+    are queued.  A failing call is reported through its BulkResult and does
+    not affect the others.
+
+    Calls still in flight are cancelled by aclose(), when leaving an
+    `async with` block and when iterating fails, e.g. is cancelled:
+
+        async with client.bulk(calls) as results:
+            async for result in results:
+                ...
+    '''
+    def __init__(self, calls, concurrency=10, ordered=True, buffer=None):
+        '''
+        @param calls        - iterable of callables taking no arguments and
+                              returning an awaitable, e.g.
+                              functools.partial(client.retrieve_charge, id)
+        @param concurrency  - maximum number of calls in flight
+        @param ordered      - yield results in input order
+        @param buffer       - maximum number of completed results waiting to
+                              be yielded, defaults to 4 * concurrency
+        '''
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+        if buffer is None:
+            buffer = 4 * concurrency
+        if buffer < 1:
+            raise ValueError('buffer must be at least 1')
+
+        self._calls = enumerate(calls)
+        self._concurrency = concurrency
+        self._ordered = ordered
+        self._buffer = buffer
+        self._exhausted = False
+
+        # In flight tasks
+        self._pending = set()
+        # Completed results waiting to be yielded, by index when ordered and
+        # in completion order otherwise.
+        self._done = {} if ordered else collections.deque()
+        # Index of the next result to yield when ordered
+        self._next = 0
+        # Future the consumer waits on for the next completed call
+        self._waiter = None
+
+    def __aiter__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def __anext__(self):
+        self._schedule()
+
+        while True:
+            if self._ordered:
+                if self._next in self._done:
+                    result = self._done.pop(self._next)
+                    self._next += 1
+                    self._schedule()
+                    return result
+            elif self._done:
+                result = self._done.popleft()
+                self._schedule()
+                return result
+
+            if not self._pending:
+                raise StopAsyncIteration
+
+            self._waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self._waiter
+            except BaseException:
+                await self.aclose()
+                raise
+            finally:
+                self._waiter = None
+
+    def _schedule(self):
+        while not self._exhausted and \
+                len(self._pending) < self._concurrency and \
+                len(self._pending) + len(self._done) < self._buffer:
+            try:
+                index, call = next(self._calls)
+            except StopIteration:
+                self._exhausted = True
+                break
+
+            task = asyncio.ensure_future(self._run(index, call))
+            self._pending.add(task)
+            task.add_done_callback(self._finished)
+
+    def _finished(self, task):
+        if task not in self._pending:
+            # Cancelled by aclose()
+            return
+        self._pending.discard(task)
+
+        result = task.result()
+        if self._ordered:
+            self._done[result.index] = result
+        else:
+            self._done.append(result)
+        self._schedule()
+
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _run(self, index, call):
+        try:
+            return BulkResult(index, value=await call())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return BulkResult(index, exception=e)
+
+    async def aclose(self):
+        '''
+        Stop iterating, cancelling calls still in flight.  Calls not yet
+        started are never issued.
+        '''
+        self._exhausted = True
+        self._done.clear()
+        tasks = list(self._pending)
+        self._pending.clear()
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,94 @@
+import collections
+import time
+
+
+class ResponseCache(object):
+    '''
+    In-memory cache of retrieved Stripe objects.
+
+    Entries are keyed by Stripe object type (e.g. 'charge') and id, expire
+    after a per-type TTL and the least recently used entry is evicted once
+    `maxsize` is reached.  Models are frozen, so cached instances are handed
+    out as is.
+    '''
+    def __init__(self, maxsize=1024, ttl=None, default_ttl=30.0):
+        '''
+        @param maxsize      - maximum number of cached objects
+        @param ttl          - map of object type to seconds an entry stays
+                              valid, e.g. {'customer': 300}
+        @param default_ttl  - seconds an entry stays valid for types not in
+                              `ttl`
+        '''
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+
+        self.maxsize = maxsize
+        self.ttl = dict(ttl or {})
+        self.default_ttl = default_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, obj_id):
+        '''
+        @param kind     - Stripe object type
+        @param obj_id   - object identifier
+        @return         - cached object or None if missing or expired
+        '''
+        key = (kind, obj_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, obj = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return obj
+            del self._entries[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, kind, obj):
+        '''
+        Cache `obj`, replacing any previous entry with the same id.
+
+        @param kind     - Stripe object type
+        @param obj      - model instance with an `id`
+        '''
+        key = (kind, obj.id)
+        ttl = self.ttl.get(kind, self.default_ttl)
+        self._entries[key] = (time.monotonic() + ttl, obj)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, kind, obj_id):
+        '''
+        Drop the entry for the given object, if any.
+
+        @param kind     - Stripe object type
+        @param obj_id   - object identifier
+        '''
+        self._entries.pop((kind, obj_id), None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        '''
+        @return - dictionary of size, hits, misses and evictions
+        '''
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+
+
+class Checkpoint(object):
+    '''
+    Base class for somewhere to persist how far a stream has been consumed,
+    e.g. the id of the last event processed, so it can resume after a
+    restart.  Values are JSON compatible.
+    '''
+    async def load(self):
+        '''
+        @return - saved value, None if nothing was saved yet
+        '''
+        raise NotImplementedError()
+
+    async def save(self, value):
+        '''
+        @param value    - value to persist, replacing the previous one
+        '''
+        raise NotImplementedError()
+
+
+class MemoryCheckpoint(Checkpoint):
+    '''
+    Checkpoint kept in memory, for tests and processes that do not need to
+    resume.
+    '''
+    def __init__(self, value=None):
+        self.value = value
+
+    async def load(self):
+        return self.value
+
+    async def save(self, value):
+        self.value = value
+
+
+class FileCheckpoint(Checkpoint):
+    '''
+    Checkpoint stored as JSON in a file.  Saves write a temporary file and
+    rename it over the previous one so a crash never leaves a partial
+    checkpoint behind.  File access runs in the loop's default executor.
+    '''
+    def __init__(self, path):
+        '''
+        @param path - file to store the checkpoint in
+        '''
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, value):
+        tmp = '%s.tmp' % (self.path,)
+        with open(tmp, 'w') as f:
+            json.dump(value, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    async def load(self):
+        return await asyncio.get_event_loop().run_in_executor(
+                None, self._load)
+
+    async def save(self, value):
+        await asyncio.get_event_loop().run_in_executor(
+                None, self._save, value)
@@ -0,0 +1,413 @@
+import array
+import sys
+
+import attr
+
+from .stripe import Card, Charge, Refund, convert_json_response
+
+# Marks a key missing from a dictionary in a StructColumn
+_MISSING = object()
+_scalars = frozenset((str, int, float, bool, type(None)))
+
+
+class DictColumn(object):
+    '''
+    Dictionary encoded column for low cardinality values.  Each distinct
+    value is stored once in `values` and rows hold its index in `codes`, two
+    bytes per row until there are more than 65536 distinct values.
+    '''
+    def __init__(self):
+        self.values = []
+        self.codes = array.array('H')
+        self._index = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def append(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value)
+            if code == 65536:
+                self.codes = array.array('I', self.codes)
+        self.codes.append(code)
+
+    def nbytes(self):
+        return self.codes.itemsize * len(self.codes) + \
+            sum(sys.getsizeof(v) for v in self.values)
+
+
+class SparseColumn(object):
+    '''
+    Column of values that are usually empty, only rows holding something
+    other than the default are stored.
+    '''
+    def __init__(self, default=None):
+        '''
+        @param default  - None or a callable returning the empty value, e.g.
+                          dict
+        '''
+        self.values = {}
+        self._default = default
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._len
+        try:
+            return self.values[i]
+        except KeyError:
+            if not 0 <= i < self._len:
+                raise IndexError('column index out of range')
+            return self._default() if self._default is not None else None
+
+    def append(self, value):
+        if value is not None and (self._default is None or value):
+            self.values[self._len] = value
+        elif value is None and self._default is not None:
+            # Keep a None that differs from the empty default
+            self.values[self._len] = None
+        self._len += 1
+
+    def nbytes(self):
+        return sys.getsizeof(self.values)
+
+
+class StructColumn(object):
+    '''
+    Column of small dictionaries with known keys, e.g. a charge outcome.
+    Each key is dictionary encoded in `columns`, so rows repeating the same
+    few values take two bytes per key.  Rows that are not dictionaries, or
+    hold other keys or values that are not scalars, are kept as they are.
+    '''
+    def __init__(self, keys):
+        '''
+        @param keys - dictionary keys to encode
+        '''
+        self.keys = frozenset(keys)
+        self.columns = {key: DictColumn() for key in keys}
+        self.other = {}
+        self._appenders = tuple(
+            (key, column.append) for key, column in self.columns.items())
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError('column index out of range')
+        if i in self.other:
+            return self.other[i]
+
+        value = {}
+        for key, column in self.columns.items():
+            v = column[i]
+            if v is not _MISSING:
+                value[key] = v
+        return value
+
+    def append(self, value):
+        encode = value.__class__ is dict and self.keys.issuperset(value) and \
+            all(v.__class__ in _scalars for v in value.values())
+        if not encode:
+            self.other[self._len] = value
+            value = {}
+        get = value.get
+        for key, append in self._appenders:
+            append(get(key, _MISSING))
+        self._len += 1
+
+    def nbytes(self):
+        return sys.getsizeof(self.other) + \
+            sum(c.nbytes() for c in self.columns.values())
+
+
+class BatchColumn(object):
+    '''
+    Column of nested objects kept in a ColumnBatch of their own, e.g. the
+    source of a charge.  Rows hold the index of their object in `batch`, -1
+    for values of another type or None, which are kept as they are in
+    `other`.
+    '''
+    def __init__(self, batch_cls):
+        self.batch = batch_cls()
+        self.rows = array.array('i')
+        self.other = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        row = self.rows[i]
+        if row >= 0:
+            return self.batch[row]
+        if i < 0:
+            i += len(self.rows)
+        return self.other.get(i)
+
+    def append(self, value):
+        batch = self.batch
+        if value.__class__ is dict and \
+                value.get('object') == batch.object_type:
+            self.rows.append(len(batch))
+            batch.append_json(value)
+        elif isinstance(value, batch.model):
+            self.rows.append(len(batch))
+            batch.append(value)
+        else:
+            if value.__class__ is dict:
+                value = convert_json_response(value)
+            if value is not None:
+                self.other[len(self.rows)] = value
+            self.rows.append(-1)
+
+    def nbytes(self):
+        return self.rows.itemsize * len(self.rows) + \
+            sys.getsizeof(self.other) + self.batch.nbytes()
+
+
+class ColumnBatch(object):
+    '''
+    Base class for columnar containers of one model.  Subclasses name the
+    model, the Stripe object type and which fields go in which kind of
+    column; fields not named are kept in sparse columns.
+    '''
+    model = None
+    object_type = None
+    integers = ()
+    booleans = ()
+    encoded = ()
+    dense = ('id',)
+    # Fields holding small dictionaries, to the keys encoded in a
+    # StructColumn
+    structs = {}
+    # Fields holding nested objects, to the ColumnBatch they are kept in
+    batches = {}
+    # Fields whose empty value is a new instance of the given type
+    empty = {}
+
+    def __init__(self, drop=()):
+        '''
+        @param drop - names of fields not to store
+        '''
+        fields = attr.fields(self.model)
+        names = frozenset(f.name for f in fields)
+        unknown = set(drop) - names
+        if unknown:
+            raise ValueError('Unknown %s fields: %s' % (
+                self.model.__name__, ', '.join(sorted(unknown)),))
+        if 'id' in drop:
+            raise ValueError('id cannot be dropped')
+
+        self.columns = {}
+        for f in fields:
+            if f.name in drop:
+                continue
+            elif f.name in self.integers:
+                column = array.array('q')
+            elif f.name in self.booleans:
+                column = array.array('b')
+            elif f.name in self.encoded:
+                column = DictColumn()
+            elif f.name in self.structs:
+                column = StructColumn(self.structs[f.name])
+            elif f.name in self.batches:
+                column = BatchColumn(self.batches[f.name])
+            elif f.name in self.dense:
+                column = []
+            else:
+                column = SparseColumn(self.empty.get(f.name))
+            self.columns[f.name] = column
+
+        self._names = tuple(f.name for f in fields)
+        # Default for fields missing from a decoded object, e.g. transfer
+        self._defaults = {
+            f.name: f.default
+            for f in fields
+            if f.default is not attr.NOTHING}
+        self._appenders = tuple(
+            (name, column.append) for name, column in self.columns.items())
+        # Batch columns convert nested objects themselves
+        self._nested = frozenset(
+            f.name for f in fields
+            if (f.metadata.get('expandable') or f.metadata.get('nested')) and
+            f.name not in self.batches)
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        args = []
+        for name in self._names:
+            column = self.columns.get(name)
+            if column is None:
+                args.append(None)
+                continue
+
+            v = column[i]
+            if name in self.booleans:
+                v = bool(v)
+            args.append(v)
+        return self.model(*args)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, name):
+        '''
+        @param name - model field
+        @return     - the column holding `name`: an array.array, DictColumn,
+                      SparseColumn, StructColumn, BatchColumn or list,
+                      indexed by row
+        @raises KeyError if the field was dropped
+        '''
+        return self.columns[name]
+
+    def append_json(self, obj):
+        '''
+        Append an object as decoded from a Stripe response.
+
+        @param obj  - dictionary with 'object' set to object_type
+        '''
+        if obj.get('object') != self.object_type:
+            raise ValueError('Not a %s: %r' % (
+                self.object_type, obj.get('object')))
+
+        get = obj.get
+        defaults = self._defaults
+        nested = self._nested
+        for name, append in self._appenders:
+            v = get(name, defaults.get(name))
+            if name in nested and v.__class__ is dict:
+                # Slotted models are far smaller than the decoded JSON
+                v = convert_json_response(v)
+            append(v)
+
+    def append(self, obj):
+        '''
+        Append a model instance.
+        '''
+        for name, append in self._appenders:
+            append(getattr(obj, name))
+
+    def extend(self, objs):
+        '''
+        Append every object of an iterable of models or decoded objects,
+        e.g. a list page.
+        '''
+        for obj in objs:
+            if isinstance(obj, dict):
+                self.append_json(obj)
+            else:
+                self.append(obj)
+
+    async def fill(self, objs):
+        '''
+        Append every object yielded by an async iterator, e.g.
+        Client.iter_charges(raw=True), see also Client.charge_batch().
+
+        @return - self
+        '''
+        async for obj in objs:
+            self.extend((obj,))
+        return self
+
+    def nbytes(self):
+        '''
+        @return - approximate memory used by the columns themselves, not
+                  counting the per row objects of dense and sparse columns
+        '''
+        total = 0
+        for column in self.columns.values():
+            if isinstance(column, array.array):
+                total += column.itemsize * len(column)
+            elif isinstance(column, list):
+                total += sys.getsizeof(column)
+            else:
+                total += column.nbytes()
+        return total
+
+
+class CardBatch(ColumnBatch):
+    '''
+    Columnar container of cards, used for the sources of a ChargeBatch.
+    Charges paid with the same card repeat every field, so all of them but
+    metadata are dictionary encoded.
+    '''
+    model = Card
+    object_type = 'card'
+    encoded = (
+        'id', 'address_city', 'address_country', 'address_line1',
+        'address_line1_check', 'address_line2', 'address_state',
+        'address_zip', 'address_zip_check', 'brand', 'country', 'customer',
+        'cvc_check', 'dynamic_last4', 'exp_month', 'exp_year',
+        'fingerprint', 'funding', 'last4', 'name', 'tokenization_method')
+    empty = {
+        'metadata': dict,
+    }
+
+
+class ChargeBatch(ColumnBatch):
+    '''
+    Columnar container of charges, for result sets too large to keep as one
+    Charge per row.
+
+    amount, amount_refunded and created are stored in 8 byte integer arrays,
+    captured, livemode, paid and refunded in byte arrays, and currency,
+    status and failure_code dictionary encoded.  Card sources go in a
+    CardBatch and the keys of outcome in a StructColumn, so neither builds
+    an object per row.  Identifiers and the balance transaction are kept
+    per row, every other field only for rows where it is set.  Rows are
+    appended straight from decoded list pages so no Charge is built while
+    filling, batch[i] builds one, and its Card, on demand.
+
+    Fields named in `drop` are not stored at all and read back as None.
+    '''
+    model = Charge
+    object_type = 'charge'
+    integers = ('amount', 'amount_refunded', 'created')
+    booleans = ('captured', 'livemode', 'paid', 'refunded')
+    encoded = ('currency', 'status', 'failure_code')
+    dense = ('id', 'balance_transaction', 'customer')
+    structs = {
+        'outcome': (
+            'network_status', 'reason', 'risk_level', 'risk_score', 'rule',
+            'seller_message', 'type'),
+    }
+    batches = {
+        'source': CardBatch,
+    }
+    empty = {
+        'fraud_details': dict,
+        'metadata': dict,
+        'refunds': list,
+    }
+
+
+class RefundBatch(ColumnBatch):
+    '''
+    Columnar container of refunds, see ChargeBatch.  amount and created are
+    integer arrays, currency, reason and status dictionary encoded.
+    '''
+    model = Refund
+    object_type = 'refund'
+    integers = ('amount', 'created')
+    encoded = ('currency', 'reason', 'status')
+    dense = ('id', 'balance_transaction', 'charge')
+    empty = {
+        'metadata': dict,
+    }
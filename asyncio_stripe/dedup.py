@@ -0,0 +1,179 @@
+import asyncio
+import collections
+import concurrent.futures
+import sqlite3
+import time
+
+
+class DedupStore(object):
+    '''
+    Base class for stores remembering which webhook events were already
+    received, keyed by event id, so redeliveries are skipped.  Entries are
+    forgotten after `ttl` seconds, Stripe stops redelivering after three
+    days.
+    '''
+    async def claim(self, event_id):
+        '''
+        Record `event_id` unless it is already known.
+
+        @param event_id - Stripe event id
+        @return         - True if the event is new and should be handled,
+                          False if it is a duplicate
+        '''
+        raise NotImplementedError()
+
+    async def release(self, event_id):
+        '''
+        Forget `event_id` so a later delivery of it is handled, e.g. because
+        it was answered with a 5xx and Stripe will redeliver it.
+
+        @param event_id - Stripe event id
+        '''
+        raise NotImplementedError()
+
+    async def close(self):
+        pass
+
+
+class MemoryDedupStore(DedupStore):
+    '''
+    In-process store, bounded by both `ttl` and `maxsize`.  Entries are kept
+    in least recently seen order: a redelivered event is moved to the end
+    and remembered for another `ttl`, so order is also expiry order and
+    expired entries are dropped from the front in amortized O(1).  Once
+    `maxsize` is reached the least recently seen entry is evicted early.
+    '''
+    def __init__(self, maxsize=100000, ttl=259200.0):
+        '''
+        @param maxsize  - maximum number of remembered events
+        @param ttl      - seconds an event is remembered after it was last
+                          seen
+        '''
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries:
+            event_id, expires = next(iter(entries.items()))
+            if expires > now:
+                break
+            del entries[event_id]
+
+    async def claim(self, event_id):
+        now = time.monotonic()
+        self._expire(now)
+
+        if event_id in self._entries:
+            self._entries[event_id] = now + self.ttl
+            self._entries.move_to_end(event_id)
+            return False
+
+        self._entries[event_id] = now + self.ttl
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    async def release(self, event_id):
+        self._entries.pop(event_id, None)
+
+
+class SQLiteDedupStore(DedupStore):
+    '''
+    Store backed by a SQLite database, shared by every process pointing at
+    the same file.  Claims are a primary key insert, so two processes
+    receiving the same event concurrently cannot both claim it.
+
+    SQLite calls run on a dedicated thread so the event loop never blocks on
+    disk or on another process holding the database lock.  Expired rows are
+    purged every `purge_every` claims.
+    '''
+    def __init__(self, path, ttl=259200.0, purge_every=1000, timeout=5.0):
+        '''
+        @param path         - database file, created if missing
+        @param ttl          - seconds an event is remembered
+        @param purge_every  - claims between purges of expired rows
+        @param timeout      - seconds to wait for a lock held by another
+                              process
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._timeout = timeout
+        self._claims = 0
+        self._db = None
+        # A single thread owns the connection
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(
+                    self.path,
+                    timeout=self._timeout,
+                    isolation_level=None,
+                    check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS webhook_events ('
+                'id TEXT PRIMARY KEY, expires REAL NOT NULL)')
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS webhook_events_expires '
+                'ON webhook_events (expires)')
+            self._db = db
+        return self._db
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(
+                self._executor, fn, *args)
+
+    def _claim(self, event_id, now, purge):
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if purge:
+                db.execute(
+                    'DELETE FROM webhook_events WHERE expires <= ?', (now,))
+            else:
+                db.execute(
+                    'DELETE FROM webhook_events WHERE id = ? AND expires <= ?',
+                    (event_id, now))
+            cur = db.execute(
+                'INSERT OR IGNORE INTO webhook_events (id, expires) '
+                'VALUES (?, ?)',
+                (event_id, now + self.ttl))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return cur.rowcount == 1
+
+    def _release(self, event_id):
+        self._connect().execute(
+            'DELETE FROM webhook_events WHERE id = ?', (event_id,))
+
+    def _close(self):
+        if self._db is not None:
+            db, self._db = self._db, None
+            db.close()
+
+    async def claim(self, event_id):
+        self._claims += 1
+        purge = self._claims % self.purge_every == 0
+        return await self._run(self._claim, event_id, time.time(), purge)
+
+    async def release(self, event_id):
+        await self._run(self._release, event_id)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
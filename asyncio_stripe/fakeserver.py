@@ -0,0 +1,586 @@
+import asyncio
+import collections
+import copy
+import math
+import random
+import time
+import uuid
+
+import attr
+from aiohttp import web
+
+from . import fixtures
+
+
+def constant(seconds):
+    '''
+    @return - latency distribution always returning `seconds`
+    '''
+    return lambda rng: seconds
+
+
+def uniform(low, high):
+    '''
+    @return - latency distribution uniform between `low` and `high` seconds
+    '''
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median, sigma=0.5):
+    '''
+    Long tailed latency, the usual shape of real API response times.
+
+    @param median   - median latency in seconds
+    @param sigma    - standard deviation of the underlying normal
+                      distribution, larger values give a longer tail
+    @return         - latency distribution
+    '''
+    return lambda rng: median * math.exp(rng.gauss(0, sigma))
+
+
+@attr.s(slots=True, frozen=True)
+class Faults(object):
+    '''
+    Faults injected by FakeStripe into every request.
+
+    @ivar latency       - callable taking a random.Random and returning the
+                          seconds to delay each response, see constant(),
+                          uniform() and lognormal().  None for no delay.
+    @ivar rate_limit    - fraction of requests answered with a 429
+    @ivar server_error  - fraction of requests answered with a 500, 502 or
+                          503
+    @ivar reset         - fraction of requests whose connection is dropped
+                          without a response
+    '''
+    latency = attr.ib(default=None)
+    rate_limit = attr.ib(default=0.0)
+    server_error = attr.ib(default=0.0)
+    reset = attr.ib(default=0.0)
+
+
+def parse_form(pairs):
+    '''
+    Decode form or query parameters, the inverse of stripe.encode_params.
+    key[sub] becomes a nested dictionary, key[] a list and empty values None.
+
+    @param pairs    - iterable of (key, value) pairs
+    @return         - dictionary of parameters
+    '''
+    ret = {}
+    for key, value in pairs:
+        name, _, rest = key.partition('[')
+        path = [name] + (rest[:-1].split('][') if rest else [])
+
+        node = ret
+        for part, child in zip(path, path[1:]):
+            if isinstance(node, list):
+                node.append({})
+                node = node[-1]
+            else:
+                node = node.setdefault(part, [] if child == '' else {})
+
+        value = value if value != '' else None
+        if isinstance(node, list):
+            node.append(value)
+        else:
+            node[path[-1]] = value
+    return ret
+
+
+def error_response(status, kind, message, param=None):
+    '''
+    @return - web.Response carrying a Stripe error
+    '''
+    err = {'type': kind, 'message': message}
+    if param is not None:
+        err['param'] = param
+    return web.json_response({'error': err}, status=status)
+
+
+class FakeStripeError(Exception):
+    '''
+    Raised by request handlers to answer with a Stripe error.
+    '''
+    def __init__(self, status, kind, message, param=None):
+        super().__init__(message)
+        self.response = error_response(status, kind, message, param)
+
+
+def _missing(kind, obj_id):
+    return FakeStripeError(
+        404, 'invalid_request_error', 'No such %s: %s' % (kind, obj_id), 'id')
+
+
+def _integer(params, key, default=None):
+    value = params.get(key, default)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise FakeStripeError(
+            400, 'invalid_request_error',
+            'Invalid integer: %s' % (value,), key)
+
+
+def _list_envelope(data, url, has_more=False):
+    return {'object': 'list', 'data': data, 'has_more': has_more, 'url': url}
+
+
+class FakeStripe(object):
+    '''
+    In-memory stand-in for api.stripe.com serving the charge, customer, card
+    and refund endpoints used by Client, for load and failure testing
+    without network access.
+
+    Objects are built from the models in asyncio_stripe.fixtures.  Expansion
+    is not supported, related objects are always returned as ids.  POSTs
+    carrying an Idempotency-Key replay the first response, as Stripe does,
+    so retried creates are not duplicated.  Keys are forgotten after
+    `idempotency_ttl` seconds, 24 hours like Stripe, and the oldest are
+    evicted early beyond `idempotency_keys`, so long load tests do not grow
+    without bound.
+
+        server = FakeStripe(Faults(latency=lognormal(0.05), rate_limit=0.01))
+        url = await server.start()
+        client = Client(None, 'sk_test', url=url)
+    '''
+    def __init__(self, faults=None, seed=None, idempotency_ttl=86400.0,
+                 idempotency_keys=100000):
+        '''
+        @param faults           - Faults to inject, may be replaced at any
+                                  time
+        @param seed             - seed for fault injection and latencies
+        @param idempotency_ttl  - seconds a response is replayed for
+        @param idempotency_keys - maximum number of responses kept
+        '''
+        self.faults = Faults() if faults is None else faults
+        self.stats = collections.Counter()
+        self.url = None
+
+        self._rng = random.Random(seed)
+        self._objects = {
+            'charge': collections.OrderedDict(),
+            'customer': collections.OrderedDict(),
+            'refund': collections.OrderedDict(),
+        }
+        # Idempotency-Key -> (expiry, status, body), in expiry order
+        self._idempotent = collections.OrderedDict()
+        self._idempotency_ttl = idempotency_ttl
+        self._idempotency_keys = idempotency_keys
+        self._runner = None
+
+    def app(self):
+        '''
+        @return - web.Application serving the fake API below /v1
+        '''
+        app = web.Application(middlewares=[self._middleware])
+        router = app.router
+
+        router.add_post('/v1/charges', self._create_charge)
+        router.add_get('/v1/charges', self._lister('charge', 'customer'))
+        router.add_get('/v1/charges/{id}', self._retriever('charge'))
+        router.add_post('/v1/charges/{id}', self._updater(
+            'charge',
+            ('description', 'receipt_email', 'shipping', 'fraud_details',
+             'transfer_group')))
+        router.add_post('/v1/charges/{id}/capture', self._capture_charge)
+
+        router.add_post('/v1/customers', self._create_customer)
+        router.add_get('/v1/customers', self._lister('customer'))
+        router.add_get('/v1/customers/{id}', self._retriever('customer'))
+        router.add_post('/v1/customers/{id}', self._updater(
+            'customer',
+            ('account_balance', 'default_source', 'description', 'email',
+             'shipping')))
+        router.add_delete('/v1/customers/{id}', self._delete_customer)
+
+        router.add_post('/v1/customers/{id}/sources', self._create_card)
+        router.add_post(
+            '/v1/customers/{id}/sources/{card}', self._update_card)
+        router.add_delete(
+            '/v1/customers/{id}/sources/{card}', self._delete_card)
+
+        router.add_post('/v1/refunds', self._create_refund)
+        router.add_get('/v1/refunds', self._lister('refund', 'charge'))
+        router.add_get('/v1/refunds/{id}', self._retriever('refund'))
+        router.add_post('/v1/refunds/{id}', self._updater('refund', ()))
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        '''
+        Start serving.
+
+        @param host - address to listen on
+        @param port - port to listen on, 0 picks a free one
+        @return     - base API URL to pass as Client(url=...)
+        '''
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = 'http://%s:%d/v1' % (host, port)
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            runner, self._runner = self._runner, None
+            await runner.cleanup()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def add(self, kind, obj):
+        '''
+        Store an object directly, e.g. a fixture to retrieve later.
+
+        @param kind - 'charge', 'customer' or 'refund'
+        @param obj  - model instance or its Stripe JSON
+        @return     - stored Stripe JSON
+        '''
+        if not isinstance(obj, dict):
+            obj = fixtures.as_response(obj)
+        obj = copy.deepcopy(obj)
+        self._objects[kind][obj['id']] = obj
+        return obj
+
+    def get(self, kind, obj_id):
+        '''
+        @return - stored Stripe JSON of an object, None if missing
+        '''
+        return self._objects[kind].get(obj_id)
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        faults = self.faults
+        self.stats['requests'] += 1
+
+        if faults.latency is not None:
+            await asyncio.sleep(max(0.0, faults.latency(self._rng)))
+
+        roll = self._rng.random()
+        if roll < faults.reset:
+            self.stats['reset'] += 1
+            request.transport.abort()
+            raise asyncio.CancelledError()
+        roll -= faults.reset
+
+        if roll < faults.rate_limit:
+            self.stats[429] += 1
+            return error_response(
+                429, 'rate_limit_error', 'Too many requests')
+        roll -= faults.rate_limit
+
+        if roll < faults.server_error:
+            status = self._rng.choice((500, 502, 503))
+            self.stats[status] += 1
+            return error_response(status, 'api_error', 'Injected failure')
+
+        key = request.headers.get('Idempotency-Key')
+        if request.method == 'POST' and key is not None:
+            self._expire_idempotent()
+            if key in self._idempotent:
+                self.stats['replayed'] += 1
+                _, status, body = self._idempotent[key]
+                return web.Response(
+                    body=body, status=status, content_type='application/json')
+
+        try:
+            resp = await handler(request)
+        except FakeStripeError as e:
+            resp = e.response
+
+        if request.method == 'POST' and key is not None:
+            self._idempotent[key] = (
+                time.monotonic() + self._idempotency_ttl,
+                resp.status,
+                resp.body)
+            while len(self._idempotent) > self._idempotency_keys:
+                self._idempotent.popitem(last=False)
+        self.stats[resp.status] += 1
+        return resp
+
+    def _expire_idempotent(self):
+        now = time.monotonic()
+        entries = self._idempotent
+        while entries:
+            key, (expires, _, _) = next(iter(entries.items()))
+            if expires > now:
+                break
+            del entries[key]
+
+    async def _params(self, request):
+        if request.method == 'GET':
+            return parse_form(request.query.items())
+        return parse_form((await request.post()).items())
+
+    def _get(self, kind, obj_id):
+        obj = self._objects[kind].get(obj_id)
+        if obj is None:
+            raise _missing(kind, obj_id)
+        return obj
+
+    def _new_id(self, prefix):
+        return '%s_%s' % (
+            prefix, uuid.UUID(int=self._rng.getrandbits(128)).hex[:24])
+
+    def _retriever(self, kind):
+        async def retrieve(request):
+            obj = self._get(kind, request.match_info['id'])
+            return web.json_response(obj)
+        return retrieve
+
+    def _updater(self, kind, fields):
+        async def update(request):
+            obj = self._get(kind, request.match_info['id'])
+            params = await self._params(request)
+            self._update(obj, params, fields)
+            return web.json_response(obj)
+        return update
+
+    def _update(self, obj, params, fields):
+        for key, value in params.items():
+            if key == 'metadata':
+                metadata = dict(obj.get('metadata') or {})
+                metadata.update(value or {})
+                obj['metadata'] = {
+                    k: v for k, v in metadata.items() if v is not None}
+            elif key in fields:
+                obj[key] = value
+            elif key != 'expand':
+                raise FakeStripeError(
+                    400, 'invalid_request_error',
+                    'Received unknown parameter: %s' % (key,), key)
+
+    def _lister(self, kind, filter_key=None):
+        async def list_objects(request):
+            params = await self._params(request)
+            return web.json_response(self._list(
+                kind, params, filter_key, request.path))
+        return list_objects
+
+    def _list(self, kind, params, filter_key, url):
+        limit = _integer(params, 'limit', 10)
+        if not 1 <= limit <= 100:
+            raise FakeStripeError(
+                400, 'invalid_request_error',
+                'Invalid limit: must be between 1 and 100', 'limit')
+
+        # Newest first, as Stripe lists objects
+        objs = list(reversed(self._objects[kind].values()))
+
+        if filter_key is not None and params.get(filter_key) is not None:
+            objs = [o for o in objs if o[filter_key] == params[filter_key]]
+
+        created = params.get('created')
+        if isinstance(created, dict):
+            for op, test in (
+                    ('gt', lambda c, v: c > v),
+                    ('gte', lambda c, v: c >= v),
+                    ('lt', lambda c, v: c < v),
+                    ('lte', lambda c, v: c <= v)):
+                if op in created:
+                    bound = _integer(created, op)
+                    objs = [o for o in objs if test(o['created'], bound)]
+        elif created is not None:
+            bound = _integer(params, 'created')
+            objs = [o for o in objs if o['created'] == bound]
+
+        ids = [o['id'] for o in objs]
+        if params.get('starting_after') is not None:
+            cursor = params['starting_after']
+            if cursor not in ids:
+                raise _missing(kind, cursor)
+            objs = objs[ids.index(cursor) + 1:]
+            return _list_envelope(objs[:limit], url, len(objs) > limit)
+
+        if params.get('ending_before') is not None:
+            cursor = params['ending_before']
+            if cursor not in ids:
+                raise _missing(kind, cursor)
+            objs = objs[:ids.index(cursor)]
+            return _list_envelope(objs[-limit:], url, len(objs) > limit)
+
+        return _list_envelope(objs[:limit], url, len(objs) > limit)
+
+    async def _create_charge(self, request):
+        params = await self._params(request)
+        amount = _integer(params, 'amount')
+        if amount is None or amount < 1:
+            raise FakeStripeError(
+                400, 'invalid_request_error', 'Missing required param: amount',
+                'amount')
+        if params.get('currency') is None:
+            raise FakeStripeError(
+                400, 'invalid_request_error',
+                'Missing required param: currency', 'currency')
+
+        source = None
+        customer_id = params.get('customer')
+        if customer_id is not None:
+            customer = self._get('customer', customer_id)
+            for card in customer['sources']['data']:
+                if card['id'] in (
+                        params.get('source'), customer['default_source']):
+                    source = card
+                    break
+        if source is None:
+            source = fixtures.as_response(fixtures.card_source)
+            source['id'] = self._new_id('card')
+            source['customer'] = customer_id
+
+        capture = params.get('capture') != 'false'
+        charge = fixtures.as_response(fixtures.charge)
+        charge.update({
+            'id': self._new_id('ch'),
+            'amount': amount,
+            'currency': params['currency'].lower(),
+            'customer': customer_id,
+            'captured': capture,
+            'created': int(time.time()),
+            'description': params.get('description'),
+            'metadata': params.get('metadata') or {},
+            'receipt_email': params.get('receipt_email'),
+            'shipping': params.get('shipping'),
+            'source': source,
+            'statement_descriptor': params.get('statement_descriptor'),
+        })
+        charge['refunds']['url'] = '/v1/charges/%s/refunds' % (charge['id'],)
+        return web.json_response(self.add('charge', charge))
+
+    async def _capture_charge(self, request):
+        charge = self._get('charge', request.match_info['id'])
+        params = await self._params(request)
+        if charge['captured']:
+            raise FakeStripeError(
+                400, 'invalid_request_error',
+                'Charge %s has already been captured.' % (charge['id'],))
+        amount = _integer(params, 'amount', charge['amount'])
+        charge['captured'] = True
+        charge['amount_refunded'] = charge['amount'] - amount
+        return web.json_response(charge)
+
+    async def _create_customer(self, request):
+        params = await self._params(request)
+        customer = fixtures.as_response(fixtures.customer)
+        customer.update({
+            'id': self._new_id('cus'),
+            'created': int(time.time()),
+            'default_source': None,
+            'description': params.get('description'),
+            'email': params.get('email'),
+            'metadata': params.get('metadata') or {},
+            'shipping': params.get('shipping'),
+        })
+        customer['sources']['data'] = []
+        customer = self.add('customer', customer)
+        if params.get('source') is not None:
+            self._add_card(customer, params['source'], None)
+        return web.json_response(customer)
+
+    async def _delete_customer(self, request):
+        customer_id = request.match_info['id']
+        self._get('customer', customer_id)
+        del self._objects['customer'][customer_id]
+        return web.json_response({'id': customer_id, 'deleted': True})
+
+    def _add_card(self, customer, source, metadata):
+        card = fixtures.as_response(fixtures.card_source)
+        card.update({
+            'id': self._new_id('card'),
+            'customer': customer['id'],
+            'metadata': metadata or {},
+        })
+        if isinstance(source, dict):
+            for key in ('exp_month', 'exp_year'):
+                if key in source:
+                    source[key] = _integer(source, key)
+            card.update({
+                k: v for k, v in source.items()
+                if k in card and k not in ('id', 'object')})
+            number = source.get('number')
+            if number is not None:
+                card['last4'] = number[-4:]
+
+        customer['sources']['data'].append(card)
+        if customer['default_source'] is None:
+            customer['default_source'] = card['id']
+        return card
+
+    async def _create_card(self, request):
+        customer = self._get('customer', request.match_info['id'])
+        params = await self._params(request)
+        if params.get('source') is None:
+            raise FakeStripeError(
+                400, 'invalid_request_error',
+                'Missing required param: source', 'source')
+        return web.json_response(self._add_card(
+            customer, params['source'], params.get('metadata')))
+
+    def _card(self, customer, card_id):
+        for card in customer['sources']['data']:
+            if card['id'] == card_id:
+                return card
+        raise _missing('source', card_id)
+
+    async def _update_card(self, request):
+        customer = self._get('customer', request.match_info['id'])
+        card = self._card(customer, request.match_info['card'])
+        params = await self._params(request)
+        for key in ('exp_month', 'exp_year'):
+            if key in params:
+                params[key] = _integer(params, key)
+        self._update(card, params, (
+            'address_city', 'address_country', 'address_line1',
+            'address_line2', 'address_state', 'address_zip', 'exp_month',
+            'exp_year', 'name'))
+        return web.json_response(card)
+
+    async def _delete_card(self, request):
+        customer = self._get('customer', request.match_info['id'])
+        card = self._card(customer, request.match_info['card'])
+        customer['sources']['data'].remove(card)
+        if customer['default_source'] == card['id']:
+            remaining = customer['sources']['data']
+            customer['default_source'] = remaining[0]['id'] \
+                if remaining else None
+        return web.json_response({'id': card['id'], 'deleted': True})
+
+    async def _create_refund(self, request):
+        params = await self._params(request)
+        charge_id = params.get('charge')
+        if charge_id is None:
+            raise FakeStripeError(
+                400, 'invalid_request_error',
+                'Missing required param: charge', 'charge')
+        charge = self._get('charge', charge_id)
+
+        remaining = charge['amount'] - charge['amount_refunded']
+        amount = _integer(params, 'amount', remaining)
+        if not 0 < amount <= remaining:
+            raise FakeStripeError(
+                400, 'invalid_request_error',
+                'Refund amount (%d) is greater than unrefunded amount on '
+                'charge (%d)' % (amount, remaining), 'amount')
+
+        refund = fixtures.as_response(fixtures.refund)
+        refund.update({
+            'id': self._new_id('re'),
+            'amount': amount,
+            'charge': charge_id,
+            'created': int(time.time()),
+            'currency': charge['currency'],
+            'metadata': params.get('metadata') or {},
+            'reason': params.get('reason'),
+        })
+        refund = self.add('refund', refund)
+
+        charge['amount_refunded'] += amount
+        charge['refunded'] = charge['amount_refunded'] == charge['amount']
+        charge['refunds']['data'].insert(0, refund)
+        return web.json_response(refund)
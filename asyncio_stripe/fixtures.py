@@ -1,3 +1,5 @@
+import attr
+
 from . import stripe
 
 card_source = stripe.Card(
@@ -40,3 +42,96 @@ customer = stripe.Customer(
     shipping=None,
     sources=[card_source],
     subscriptions=[])
+
+charge = stripe.Charge(
+    amount=999,
+    amount_refunded=0,
+    application=None,
+    application_fee=None,
+    balance_transaction='txn_aabbcc',
+    captured=True,
+    created=1488920544,
+    currency='usd',
+    customer=customer.id,
+    description=None,
+    destination=None,
+    dispute=None,
+    failure_code=None,
+    failure_message=None,
+    fraud_details={},
+    id='ch_aabbcc',
+    invoice=None,
+    livemode=False,
+    metadata={'order_id': '6735'},
+    on_behalf_of=None,
+    order=None,
+    outcome={
+        'network_status': 'approved_by_network',
+        'reason': None,
+        'risk_level': 'normal',
+        'seller_message': 'Payment complete.',
+        'type': 'authorized'},
+    paid=True,
+    receipt_email=None,
+    receipt_number=None,
+    refunded=False,
+    refunds=[],
+    review=None,
+    shipping=None,
+    source=card_source,
+    source_transfer=None,
+    statement_descriptor=None,
+    status='succeeded',
+    transfer_group=None)
+
+refund = stripe.Refund(
+    amount=100,
+    balance_transaction='txn_bbccdd',
+    charge=charge.id,
+    created=1488920600,
+    currency='usd',
+    id='re_aabbcc',
+    metadata={},
+    reason=None,
+    receipt_number=None,
+    status='succeeded')
+
+event = stripe.Event(
+    account=None,
+    api_version='2017-02-14',
+    created=1488920600,
+    data={'object': charge},
+    id='evt_aabbcc',
+    livemode=False,
+    pending_webhooks=1,
+    request='req_aabbcc',
+    type='charge.succeeded')
+
+
+def as_response(obj):
+    '''
+    Render a model the way Stripe returns it, the inverse of
+    stripe.convert_json_response.  Lists become list objects.
+
+    @param obj  - model instance, list of model instances or plain value
+    @return     - JSON compatible value
+    '''
+    for name, cls in stripe.cls_map.items():
+        if type(obj) is cls:
+            ret = {'object': name}
+            for field in attr.fields(cls):
+                ret[field.name] = as_response(getattr(obj, field.name))
+            return ret
+
+    if isinstance(obj, dict):
+        return {k: as_response(v) for k, v in obj.items()}
+
+    if isinstance(obj, list):
+        return {
+            'object': 'list',
+            'data': [as_response(v) for v in obj],
+            'has_more': False,
+            'url': '',
+        }
+
+    return obj
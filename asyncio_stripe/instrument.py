@@ -0,0 +1,290 @@
+import asyncio
+import bisect
+import collections
+import logging
+import re
+
+import aiohttp
+import attr
+
+
+log = logging.getLogger(__name__)
+
+_id_segment = re.compile(r'^[a-z]+_[A-Za-z0-9]+$')
+
+
+def endpoint_template(page):
+    '''
+    Replace the object ids in a page with {id} so requests for different
+    objects are grouped, e.g. /charges/ch_aabbcc becomes /charges/{id}.
+
+    @param page - page relative to base stripe API URL
+    @return     - endpoint template
+    '''
+    return '/' + '/'.join(
+        '{id}' if _id_segment.match(seg) else seg
+        for seg in page.strip('/').split('/'))
+
+
+@attr.s(slots=True, frozen=True)
+class RequestEvent(object):
+    '''
+    What is known about a request attempt when a hook is called.  Fields not
+    yet known at that point are None.
+    '''
+    method = attr.ib()
+    endpoint = attr.ib()
+    attempt = attr.ib()
+    request_size = attr.ib()
+    status = attr.ib(default=None)
+    latency = attr.ib(default=None)
+    response_size = attr.ib(default=None)
+    request_id = attr.ib(default=None)
+    delay = attr.ib(default=None)
+    error = attr.ib(default=None)
+    phases = attr.ib(default=None)
+
+
+class Hooks(object):
+    '''
+    Base class for request lifecycle hooks passed as Client(hooks=[...]).
+    Every method receives a RequestEvent and is a no-op by default.  Hooks
+    run inline with the request so they should be cheap, exceptions raised
+    by a hook are logged and otherwise ignored.
+    '''
+    def on_request_start(self, event):
+        '''
+        An attempt is about to be sent, `attempt` is the number of retries
+        made so far.
+        '''
+
+    def on_response(self, event):
+        '''
+        A response was read, with status, latency, response_size and
+        request_id set.
+        '''
+
+    def on_retry(self, event):
+        '''
+        The request will be retried after `delay` seconds, status is None
+        after a connection error.
+        '''
+
+    def on_error(self, event):
+        '''
+        The call failed with `error` and will not be retried.
+        '''
+
+    def on_complete(self, event):
+        '''
+        A call returning a model succeeded.  The event is that of the last
+        attempt with `phases` set to a dictionary of seconds spent in each
+        phase, see CallTrace.
+        '''
+
+
+class CallTrace(object):
+    '''
+    Breakdown of where the time of a call went, filled in by Client and, for
+    the network phases, by the TraceConfig from phase_trace_config().
+
+    Phases reported, in seconds:
+        pool_wait   - waiting for a free connection in the pool
+        dns         - resolving api.stripe.com, when not cached
+        connect     - TCP connect and TLS handshake of a new connection,
+                      aiohttp does not time the handshake on its own
+        ttfb        - sending the request until the response headers arrived
+        body_read   - reading the response body
+        json_decode - decoding the body
+        model_build - converting to models (convert_json_response)
+    Phases that did not occur are omitted.
+    '''
+    __slots__ = ('marks', 'phases', 'event')
+
+    def __init__(self):
+        self.marks = {}
+        self.phases = {}
+        self.event = None
+
+    def reset(self):
+        '''
+        Forget the timings of a previous attempt.
+        '''
+        self.marks.clear()
+        self.phases.clear()
+
+    def mark(self, name):
+        self.marks[name] = asyncio.get_event_loop().time()
+
+    def span(self, phase, start, end):
+        '''
+        Record the time between two marks as `phase`, if both were set.
+        '''
+        if start in self.marks and end in self.marks:
+            self.phases[phase] = self.marks[end] - self.marks[start]
+
+    def network_phases(self):
+        '''
+        Derive pool_wait, dns, connect and ttfb from the marks set by the
+        trace config.
+        '''
+        self.span('pool_wait', 'queued_start', 'queued_end')
+        self.span('dns', 'dns_start', 'dns_end')
+        self.span('connect', 'create_start', 'create_end')
+        if 'connect' in self.phases and 'dns' in self.phases:
+            self.phases['connect'] -= self.phases['dns']
+
+        self.span('ttfb', 'request_start', 'request_end')
+        if 'ttfb' in self.phases:
+            self.phases['ttfb'] -= (
+                self.phases.get('pool_wait', 0) +
+                self.phases.get('dns', 0) +
+                self.phases.get('connect', 0))
+
+
+def phase_trace_config():
+    '''
+    Create the aiohttp.TraceConfig timing the network phases of a CallTrace.
+    Sessions created by Client include it, a session passed to Client needs
+    it in its trace_configs for those phases to be reported.
+
+    @return - aiohttp.TraceConfig
+    '''
+    def marker(name):
+        async def mark(session, ctx, params):
+            trace = ctx.trace_request_ctx
+            if isinstance(trace, CallTrace):
+                trace.mark(name)
+        return mark
+
+    config = aiohttp.TraceConfig()
+    for signal, name in (
+            (config.on_request_start, 'request_start'),
+            (config.on_request_end, 'request_end'),
+            (config.on_connection_queued_start, 'queued_start'),
+            (config.on_connection_queued_end, 'queued_end'),
+            (config.on_connection_create_start, 'create_start'),
+            (config.on_connection_create_end, 'create_end'),
+            (config.on_dns_resolvehost_start, 'dns_start'),
+            (config.on_dns_resolvehost_end, 'dns_end')):
+        signal.append(marker(name))
+    return config
+
+
+def call_hooks(hooks, name, event):
+    for hook in hooks:
+        try:
+            getattr(hook, name)(event)
+        except Exception:
+            log.exception('%s hook %r failed', name, hook)
+
+
+class Histogram(object):
+    '''
+    Latency histogram with logarithmic buckets from 1ms to roughly 10 minutes,
+    each 25% wider than the previous one.  Percentiles are reported as the
+    upper bound of the bucket they fall into.
+    '''
+    bounds = tuple(0.001 * 1.25 ** i for i in range(60))
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        '''
+        @param p    - percentile, 0-100
+        @return     - approximate value below which p percent of the values
+                      fall, None if empty
+        '''
+        if not self.count:
+            return None
+
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) \
+                    if i < len(self.bounds) else self.max
+        return self.max
+
+
+class MetricsCollector(Hooks):
+    '''
+    In-process collector of per endpoint latency histograms, status and
+    error counts, and of the time spent in each phase of successful calls.
+    Endpoints are keyed as 'METHOD /template'.
+    '''
+    def __init__(self):
+        self._latency = collections.defaultdict(Histogram)
+        self._phases = collections.defaultdict(
+            lambda: collections.defaultdict(Histogram))
+        self._statuses = collections.defaultdict(collections.Counter)
+        self._errors = collections.defaultdict(collections.Counter)
+        self._retries = collections.Counter()
+
+    def _key(self, event):
+        return '%s %s' % (event.method, event.endpoint)
+
+    def on_response(self, event):
+        key = self._key(event)
+        self._latency[key].add(event.latency)
+        self._statuses[key][event.status] += 1
+
+    def on_retry(self, event):
+        self._retries[self._key(event)] += 1
+
+    def on_error(self, event):
+        self._errors[self._key(event)][type(event.error).__name__] += 1
+
+    def on_complete(self, event):
+        phases = self._phases[self._key(event)]
+        for phase, seconds in event.phases.items():
+            phases[phase].add(seconds)
+
+    def snapshot(self):
+        '''
+        @return - dictionary of endpoint to count, mean, p50, p95, p99 and
+                  max latency in seconds along with status, retry and error
+                  counts and the mean, p50 and p95 of each phase
+        '''
+        ret = {}
+        for key in set(self._latency) | set(self._errors):
+            # Read without inserting into the defaultdicts
+            h = self._latency.get(key) or Histogram()
+            ret[key] = {
+                'count': h.count,
+                'mean': h.sum / h.count if h.count else None,
+                'p50': h.percentile(50),
+                'p95': h.percentile(95),
+                'p99': h.percentile(99),
+                'max': h.max if h.count else None,
+                'statuses': dict(self._statuses.get(key, {})),
+                'retries': self._retries.get(key, 0),
+                'errors': dict(self._errors.get(key, {})),
+                'phases': {
+                    phase: {
+                        'mean': p.sum / p.count,
+                        'p50': p.percentile(50),
+                        'p95': p.percentile(95),
+                    }
+                    for phase, p in self._phases.get(key, {}).items()
+                },
+            }
+        return ret
+
+    def reset(self):
+        self._latency.clear()
+        self._phases.clear()
+        self._statuses.clear()
+        self._errors.clear()
+        self._retries.clear()
@@ -0,0 +1,329 @@
+'''
+Drive a Client at a target request rate and report throughput and latency
+percentiles.  Without --url an in-process FakeStripe is started with the
+requested faults.
+
+    python -m asyncio_stripe.loadtest --rps 200 --duration 30 \\
+        --latency 0.05 --rate-limit 0.01 --server-error 0.005 --reset 0.001
+'''
+import argparse
+import asyncio
+import bisect
+import collections
+import itertools
+import json
+import math
+import random
+import sys
+
+from . import fakeserver
+from . import stripe
+
+
+DEFAULT_MIX = 'retrieve_charge=6,create_charge=2,list_charges=1,' \
+    'retrieve_customer=1'
+
+
+def _retrieve_charge(client, state, rng):
+    return client.retrieve_charge(rng.choice(state['charges']))
+
+
+def _create_charge(client, state, rng):
+    return client.create_charge(
+        rng.randint(100, 10000), 'usd', customer=state['customer'])
+
+
+def _list_charges(client, state, rng):
+    return client.list_charges(limit=10)
+
+
+def _retrieve_customer(client, state, rng):
+    return client.retrieve_customer(state['customer'])
+
+
+def _create_refund(client, state, rng):
+    return client.create_refund(rng.choice(state['charges']), amount=1)
+
+
+operations = {
+    'retrieve_charge': _retrieve_charge,
+    'create_charge': _create_charge,
+    'list_charges': _list_charges,
+    'retrieve_customer': _retrieve_customer,
+    'create_refund': _create_refund,
+}
+
+
+def parse_mix(mix):
+    '''
+    @param mix  - comma separated operation=weight pairs
+    @return     - list of (operation name, weight)
+    @raises ValueError on unknown operations or bad weights
+    '''
+    ret = []
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in operations:
+            raise ValueError('Unknown operation %r, expected one of %s' % (
+                name, ', '.join(sorted(operations))))
+        ret.append((name, float(weight or 1)))
+    return ret
+
+
+def percentile(values, p):
+    '''
+    @param values   - sorted list of values
+    @param p        - percentile, 0-100
+    @return         - nearest rank percentile, None if empty
+    '''
+    if not values:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+
+class LoadTest(object):
+    '''
+    Open loop load generator: calls are started at a fixed rate whether or
+    not earlier ones finished, so a slow server shows up as latency instead
+    of a lower request rate.  At most `concurrency` calls are in flight,
+    calls that would exceed it are counted as dropped.
+    '''
+    def __init__(self, client, rps, duration, mix, concurrency=256,
+                 seed=None):
+        '''
+        @param client       - Client to drive
+        @param rps          - target calls per second
+        @param duration     - seconds to generate load for
+        @param mix          - list of (operation name, weight)
+        @param concurrency  - maximum calls in flight
+        @param seed         - seed for choosing operations
+        '''
+        self.client = client
+        self.rps = rps
+        self.duration = duration
+        self.concurrency = concurrency
+
+        self._rng = random.Random(seed)
+        self._names = [name for name, _ in mix]
+        self._cumulative = list(itertools.accumulate(w for _, w in mix))
+        self._state = {}
+        self._inflight = set()
+
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.dropped = 0
+        self.elapsed = None
+
+    async def setup(self, charges=20):
+        '''
+        Create the customer and charges the operations work on.
+        '''
+        customer = await self.client.create_customer(
+            email='loadtest@invalid',
+            source={'object': 'card', 'number': '4242424242424242',
+                    'exp_month': 1, 'exp_year': 2099})
+        self._state['customer'] = customer.id
+        self._state['charges'] = [
+            (await self.client.create_charge(
+                10000, 'usd', customer=customer.id)).id
+            for _ in range(charges)]
+
+    async def _call(self, name):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        try:
+            await operations[name](self.client, self._state, self._rng)
+        except Exception as e:
+            self.errors['%s %s' % (name, type(e).__name__)] += 1
+        else:
+            self.latencies[name].append(loop.time() - start)
+
+    async def run(self):
+        '''
+        Generate load for `duration` seconds and wait for calls in flight.
+        '''
+        loop = asyncio.get_event_loop()
+        interval = 1.0 / self.rps
+        start = loop.time()
+        due = start
+        end = start + self.duration
+
+        while due < end:
+            now = loop.time()
+            if now < due:
+                await asyncio.sleep(due - now)
+            due += interval
+
+            if len(self._inflight) >= self.concurrency:
+                self.dropped += 1
+                continue
+
+            name = self._names[bisect.bisect(
+                self._cumulative, self._rng.random() * self._cumulative[-1])]
+            task = asyncio.ensure_future(self._call(name))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+        if self._inflight:
+            await asyncio.wait(list(self._inflight))
+        self.elapsed = loop.time() - start
+
+    def report(self):
+        '''
+        @return - dictionary of overall and per operation results, latencies
+                  in seconds
+        '''
+        def summary(latencies):
+            latencies = sorted(latencies)
+            return {
+                'ok': len(latencies),
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1] if latencies else None,
+            }
+
+        everything = [t for ts in self.latencies.values() for t in ts]
+        ret = summary(everything)
+        ret.update({
+            'target_rps': self.rps,
+            'elapsed': self.elapsed,
+            'throughput': len(everything) / self.elapsed
+            if self.elapsed else None,
+            'errors': dict(self.errors),
+            'dropped': self.dropped,
+            'operations': {
+                name: summary(ts) for name, ts in self.latencies.items()},
+        })
+        return ret
+
+
+def format_report(report):
+    '''
+    @return - human readable report
+    '''
+    def ms(value):
+        return '%8.1fms' % (value * 1000,) if value is not None else \
+            '%10s' % ('-',)
+
+    lines = [
+        'target %.1f rps, achieved %.1f rps over %.1fs, %d ok, %d errors, '
+        '%d dropped' % (
+            report['target_rps'], report['throughput'] or 0,
+            report['elapsed'] or 0, report['ok'],
+            sum(report['errors'].values()), report['dropped']),
+        '',
+        '%-20s %8s %10s %10s %10s %10s' % (
+            'operation', 'ok', 'p50', 'p90', 'p99', 'max'),
+    ]
+    rows = sorted(report['operations'].items()) + [('all', report)]
+    for name, r in rows:
+        lines.append('%-20s %8d %s %s %s %s' % (
+            name, r['ok'], ms(r['p50']), ms(r['p90']), ms(r['p99']),
+            ms(r['max'])))
+    if report['errors']:
+        lines.append('')
+        for name, count in sorted(report['errors'].items()):
+            lines.append('%-40s %8d' % (name, count))
+    return '\n'.join(lines)
+
+
+async def main(args):
+    server = None
+    url = args.url
+    if url is None:
+        latency = None
+        if args.latency:
+            latency = fakeserver.lognormal(args.latency, args.latency_sigma)
+        server = fakeserver.FakeStripe(seed=args.seed)
+        url = await server.start()
+        # Objects are set up before faults are switched on
+        faults = fakeserver.Faults(
+            latency=latency,
+            rate_limit=args.rate_limit,
+            server_error=args.server_error,
+            reset=args.reset)
+
+    pool = stripe.PoolConfig(
+        limit=args.concurrency, limit_per_host=args.concurrency)
+    client = stripe.Client(
+        None, args.key, url=url, pool=pool, timeout=args.timeout,
+        retry=stripe.RetryPolicy(max_retries=args.max_retries))
+    try:
+        async with client:
+            test = LoadTest(
+                client, args.rps, args.duration, parse_mix(args.mix),
+                concurrency=args.concurrency, seed=args.seed)
+            await test.setup()
+            if server is not None:
+                server.faults = faults
+            await test.run()
+    finally:
+        if server is not None:
+            await server.stop()
+
+    report = test.report()
+    if server is not None:
+        report['server'] = {str(k): v for k, v in server.stats.items()}
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m asyncio_stripe.loadtest',
+        description='Load test a Client against a fake or real Stripe API.')
+    parser.add_argument(
+        '--rps', type=float, default=50, help='target calls per second')
+    parser.add_argument(
+        '--duration', type=float, default=10, help='seconds to run for')
+    parser.add_argument(
+        '--concurrency', type=int, default=256, help='maximum calls in flight')
+    parser.add_argument(
+        '--mix', default=DEFAULT_MIX,
+        help='operation=weight pairs, operations: %s' % (
+            ', '.join(sorted(operations)),))
+    parser.add_argument(
+        '--url', help='API to test instead of an in-process fake server, '
+        'only use a Stripe test mode key')
+    parser.add_argument('--key', default='sk_test_loadtest', help='API key')
+    parser.add_argument(
+        '--timeout', type=float, default=None, help='per call timeout')
+    parser.add_argument(
+        '--max-retries', type=int, default=2, help='retries per call')
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='median fake server latency in seconds')
+    parser.add_argument(
+        '--latency-sigma', type=float, default=0.5,
+        help='spread of the log-normal fake server latency')
+    parser.add_argument(
+        '--rate-limit', type=float, default=0.0,
+        help='fraction of fake server responses that are 429s')
+    parser.add_argument(
+        '--server-error', type=float, default=0.0,
+        help='fraction of fake server responses that are 5xx')
+    parser.add_argument(
+        '--reset', type=float, default=0.0,
+        help='fraction of fake server connections reset')
+    parser.add_argument('--seed', type=int, default=None, help='random seed')
+    parser.add_argument(
+        '--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = asyncio.get_event_loop().run_until_complete(main(args))
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print(format_report(report))
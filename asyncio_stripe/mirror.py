@@ -0,0 +1,535 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import sqlite3
+
+from .checkpoint import Checkpoint
+from .stripe import (
+    Charge,
+    Customer,
+    Pager,
+    Refund,
+    convert_json_response,
+    json_loads,
+)
+
+
+# Stripe object type -> (table, indexed columns)
+_tables = {
+    'customer': ('customers', ('created', 'email')),
+    'card': ('cards', ('customer',)),
+    'charge': ('charges', ('created', 'customer', 'currency', 'status')),
+    'refund': ('refunds', ('created', 'charge')),
+}
+
+# Object types synced from a list endpoint, cards come with their customer
+_lists = {
+    'customer': ('/customers', Customer),
+    'charge': ('/charges', Charge),
+    'refund': ('/refunds', Refund),
+}
+
+_ops = {
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+}
+
+
+def _ref(value):
+    '''
+    @return - id of an expandable field, whether expanded or not
+    '''
+    if isinstance(value, dict):
+        return value.get('id')
+    return value
+
+
+def _list_items(value):
+    if isinstance(value, dict) and value.get('object') == 'list':
+        return value.get('data') or []
+    if isinstance(value, list):
+        return value
+    return []
+
+
+def _nested(obj):
+    '''
+    @return - mirrored objects embedded in `obj`, e.g. the refunds of a
+              charge or the cards of a customer
+    '''
+    found = []
+    for name in ('sources', 'refunds'):
+        found.extend(_list_items(obj.get(name)))
+    for name in ('source', 'charge', 'customer'):
+        found.append(obj.get(name))
+    return [
+        v for v in found
+        if isinstance(v, dict) and v.get('object') in _tables]
+
+
+class MirrorCheckpoint(Checkpoint):
+    '''
+    Checkpoint stored in the sync state of a SQLiteMirror, so it lives and
+    is backed up with the data it describes.
+    '''
+    def __init__(self, mirror, name):
+        '''
+        @param mirror   - SQLiteMirror
+        @param name     - state key
+        '''
+        self.mirror = mirror
+        self.name = name
+
+    async def load(self):
+        return await self.mirror.get_state(self.name)
+
+    async def save(self, value):
+        await self.mirror.set_state(self.name, value)
+
+
+class SQLiteMirror(object):
+    '''
+    Local copy of charges, customers, cards and refunds in a SQLite
+    database, read back as the usual models.
+
+    Each object is stored as the JSON Stripe returned, next to indexed
+    columns for the fields it can be looked up by: created, customer,
+    currency and status for charges, created and email for customers,
+    customer for cards and created and charge for refunds.  Objects embedded
+    in a stored one, such as the refunds of a charge or the sources of a
+    customer, are stored too.
+
+    Writes are one transaction each and may carry sync state, so a sync
+    resumed after a crash continues from exactly what was stored.  SQLite
+    calls run on a dedicated thread so the event loop never blocks on disk.
+    '''
+    def __init__(self, path, timeout=5.0):
+        '''
+        @param path     - database file, created if missing
+        @param timeout  - seconds to wait for a lock held by another
+                          process
+        '''
+        self.path = path
+        self._timeout = timeout
+        self._db = None
+        # A single thread owns the connection
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(
+                    self.path,
+                    timeout=self._timeout,
+                    isolation_level=None,
+                    check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for table, columns in _tables.values():
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS %s ('
+                    'id TEXT PRIMARY KEY, %s, data TEXT NOT NULL)' % (
+                        table, ', '.join(columns)))
+                for column in columns:
+                    # Listings are newest first, so filter and order at once
+                    indexed = column
+                    if column != 'created' and 'created' in columns:
+                        indexed = '%s, created' % (column,)
+                    db.execute(
+                        'CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)' % (
+                            table, column, table, indexed))
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS sync_state ('
+                'name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self._db = db
+        return self._db
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(
+                self._executor, fn, *args)
+
+    def _put(self, db, obj):
+        kind = obj['object']
+        table, columns = _tables[kind]
+        values = [obj['id']]
+        values.extend(_ref(obj.get(column)) for column in columns)
+        values.append(json.dumps(obj, separators=(',', ':')))
+        db.execute(
+            'INSERT OR REPLACE INTO %s (id, %s, data) VALUES (%s)' % (
+                table, ', '.join(columns), ', '.join('?' * len(values))),
+            values)
+
+        if kind == 'customer' and isinstance(obj.get('sources'), dict) and \
+                not obj['sources'].get('has_more', True):
+            # The listed sources are all the customer has
+            keep = [
+                c['id'] for c in _list_items(obj['sources'])
+                if c.get('object') == 'card']
+            db.execute(
+                'DELETE FROM cards WHERE customer = ? AND id NOT IN (%s)' % (
+                    ', '.join('?' * len(keep)),),
+                [obj['id']] + keep)
+
+        for nested in _nested(obj):
+            self._put(db, nested)
+
+    def _store(self, objs, deleted, state):
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for obj in objs:
+                self._put(db, obj)
+            for kind, obj_id in deleted:
+                db.execute(
+                    'DELETE FROM %s WHERE id = ?' % (_tables[kind][0],),
+                    (obj_id,))
+                if kind == 'customer':
+                    db.execute(
+                        'DELETE FROM cards WHERE customer = ?', (obj_id,))
+            for name, value in state.items():
+                db.execute(
+                    'INSERT OR REPLACE INTO sync_state (name, value) '
+                    'VALUES (?, ?)',
+                    (name, json.dumps(value)))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def _get_state(self, name):
+        row = self._connect().execute(
+            'SELECT value FROM sync_state WHERE name = ?', (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _select(self, sql, args):
+        return [
+            convert_json_response(json_loads(data))
+            for data, in self._connect().execute(sql, args)]
+
+    def _scalar(self, sql, args=()):
+        return self._connect().execute(sql, args).fetchone()[0]
+
+    def _close(self):
+        if self._db is not None:
+            db, self._db = self._db, None
+            db.close()
+
+    async def store(self, objs, deleted=(), state=None):
+        '''
+        Insert or replace objects, delete others and update sync state, all
+        in one transaction.
+
+        @param objs     - decoded Stripe objects, e.g. from a Pager created
+                          with raw=True
+        @param deleted  - (object type, id) pairs to remove
+        @param state    - dictionary of sync state names to JSON compatible
+                          values
+        '''
+        for obj in objs:
+            if obj.get('object') not in _tables:
+                raise ValueError(
+                    'Cannot mirror %r objects' % (obj.get('object'),))
+        for kind, _ in deleted:
+            if kind not in _tables:
+                raise ValueError('Cannot mirror %r objects' % (kind,))
+        await self._run(self._store, list(objs), list(deleted), state or {})
+
+    async def get_state(self, name):
+        '''
+        @return - sync state saved under `name`, None if there is none
+        '''
+        return await self._run(self._get_state, name)
+
+    async def set_state(self, name, value):
+        await self.store((), state={name: value})
+
+    def checkpoint(self, name):
+        '''
+        @return - MirrorCheckpoint saving under `name`
+        '''
+        return MirrorCheckpoint(self, name)
+
+    async def get(self, kind, obj_id):
+        '''
+        @param kind     - Stripe object type, e.g. 'charge'
+        @param obj_id   - object id
+        @return         - model instance, None if not mirrored
+        '''
+        if kind not in _tables:
+            raise ValueError('Cannot mirror %r objects' % (kind,))
+        ret = await self._run(
+                self._select,
+                'SELECT data FROM %s WHERE id = ?' % (_tables[kind][0],),
+                (obj_id,))
+        return ret[0] if ret else None
+
+    async def query(self, kind, created=None, limit=None, **filters):
+        '''
+        List mirrored objects, newest first where they have a creation
+        time.
+
+        @param kind     - Stripe object type, e.g. 'charge'
+        @param created  - unix timestamp or dictionary with any of gt, gte,
+                          lt and lte, as in Stripe's list parameters
+        @param limit    - maximum number of objects, None for all
+        @param filters  - indexed column names and the value they must
+                          equal, None matching unset
+        @return         - list of model instances
+
+        @raises ValueError if a filter is not on an indexed column
+        '''
+        if kind not in _tables:
+            raise ValueError('Cannot mirror %r objects' % (kind,))
+        table, columns = _tables[kind]
+
+        clauses = []
+        args = []
+        for name, value in sorted(filters.items()):
+            if name not in columns or name == 'created':
+                raise ValueError('Cannot filter %s by %s' % (table, name))
+            if value is None:
+                clauses.append('%s IS NULL' % (name,))
+            else:
+                clauses.append('%s = ?' % (name,))
+                args.append(value)
+
+        if created is not None:
+            if 'created' not in columns:
+                raise ValueError('Cannot filter %s by created' % (table,))
+            if isinstance(created, dict):
+                for op, value in sorted(created.items()):
+                    if op not in _ops:
+                        raise ValueError('Unknown created filter: %s' % (op,))
+                    clauses.append('created %s ?' % (_ops[op],))
+                    args.append(value)
+            else:
+                clauses.append('created = ?')
+                args.append(created)
+
+        sql = 'SELECT data FROM %s' % (table,)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        if 'created' in columns:
+            sql += ' ORDER BY created DESC, id DESC'
+        else:
+            sql += ' ORDER BY id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            args.append(limit)
+
+        return await self._run(self._select, sql, args)
+
+    async def count(self, kind):
+        '''
+        @return - number of mirrored objects of type `kind`
+        '''
+        return await self._run(
+                self._scalar, 'SELECT COUNT(*) FROM %s' % (_tables[kind][0],))
+
+    async def latest_created(self, kind):
+        '''
+        @return - creation time of the newest mirrored object of type
+                  `kind`, None if there is none
+        '''
+        return await self._run(
+                self._scalar, 'SELECT MAX(created) FROM %s' % (
+                    _tables[kind][0],))
+
+    async def retrieve_charge(self, charge_id):
+        return await self.get('charge', charge_id)
+
+    async def retrieve_customer(self, customer_id):
+        return await self.get('customer', customer_id)
+
+    async def retrieve_card(self, card_id):
+        return await self.get('card', card_id)
+
+    async def retrieve_refund(self, refund_id):
+        return await self.get('refund', refund_id)
+
+    async def list_charges(self, **kwds):
+        '''
+        See query(), e.g. list_charges(customer='cus_..', status='failed')
+        '''
+        return await self.query('charge', **kwds)
+
+    async def list_customers(self, **kwds):
+        return await self.query('customer', **kwds)
+
+    async def list_cards(self, customer_id):
+        return await self.query('card', customer=customer_id)
+
+    async def list_refunds(self, **kwds):
+        return await self.query('refund', **kwds)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+
+class MirrorSync(object):
+    '''
+    Keeps a SQLiteMirror up to date with a Stripe account.
+
+    run() backfills every customer, charge and refund, newest first, then
+    applies changes incrementally:
+        'events'    - replays the Events API from the last event before the
+                      backfill started, so updates and deletions made during
+                      and after the backfill are applied.  Stripe keeps
+                      events for 30 days, a mirror left behind longer has to
+                      be rebuilt.
+        'created'   - lists objects created since the newest one mirrored.
+                      Cheaper, but later updates and deletions are missed.
+
+    Progress is saved in the mirror in the same transaction as the page or
+    event it describes, a sync stopped at any point resumes where it left
+    off without applying anything twice.
+    Pages are written while the next one is fetched.
+    '''
+    def __init__(self, client, mirror, mode='events',
+                 kinds=('customer', 'charge', 'refund'), batch_size=100,
+                 poll_interval=60.0):
+        '''
+        @param client           - Client
+        @param mirror           - SQLiteMirror
+        @param mode             - 'events' or 'created'
+        @param kinds            - object types to sync, cards are synced
+                                  with their customer
+        @param batch_size       - objects requested per page, at most 100
+        @param poll_interval    - seconds between polls when following
+        '''
+        if mode not in ('events', 'created'):
+            raise ValueError('Unknown sync mode: %s' % (mode,))
+        for kind in kinds:
+            if kind not in _lists:
+                raise ValueError('Cannot sync %r objects' % (kind,))
+        if not 1 <= batch_size <= 100:
+            raise ValueError('batch_size must be between 1 and 100')
+
+        self.client = client
+        self.mirror = mirror
+        self.mode = mode
+        self.kinds = tuple(kinds)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.stats = collections.Counter()
+
+    async def run(self, follow=False):
+        '''
+        Backfill if not done yet, then apply changes until caught up.
+
+        @param follow   - keep polling for changes instead of returning once
+                          caught up
+        '''
+        if self.mode == 'events':
+            await self._mark_events()
+        await self.backfill()
+        if self.mode == 'events':
+            await self._tail(follow)
+        else:
+            await self._poll(follow)
+
+    async def backfill(self):
+        '''
+        Page through every object of each kind concurrently, resuming after
+        the last page stored.
+        '''
+        await asyncio.gather(*(self._backfill(kind) for kind in self.kinds))
+
+    async def _mark_events(self):
+        checkpoint = self.mirror.checkpoint('events')
+        if await checkpoint.load() is not None:
+            return
+        events = await self.client.list_events(limit=1)
+        if events:
+            await checkpoint.save(events[0].id)
+
+    async def _backfill(self, kind):
+        name = 'backfill.%s' % (kind,)
+        state = await self.mirror.get_state(name)
+        if state == 'done':
+            return
+
+        params = {'limit': self.batch_size}
+        if state is not None:
+            params['starting_after'] = state
+        await self._copy(kind, params, name)
+
+    async def _copy(self, kind, params, name=None):
+        '''
+        Store every object listed with `params`, a page at a time, saving
+        the last id stored under `name` and 'done' once finished.
+        '''
+        path, cls = _lists[kind]
+        pager = Pager(
+                self.client,
+                path,
+                self.client._list_params(cls, params),
+                raw=True)
+
+        rows = []
+        async for obj in pager:
+            rows.append(obj)
+            if len(rows) >= self.batch_size:
+                state = {name: rows[-1]['id']} if name else None
+                await self.mirror.store(rows, state=state)
+                self.stats['stored'] += len(rows)
+                rows = []
+        if rows or name:
+            await self.mirror.store(
+                    rows, state={name: 'done'} if name else None)
+            self.stats['stored'] += len(rows)
+
+    async def _tail(self, follow):
+        stream = self.client.tail_events(
+                self.mirror.checkpoint('events'),
+                follow=follow,
+                poll_interval=self.poll_interval,
+                raw=True)
+        async for event in stream:
+            await self.apply_event(event, state={'events': event['id']})
+
+    async def apply_event(self, event, state=None):
+        '''
+        Apply one event to the mirror, events about objects not mirrored
+        are ignored.
+
+        @param event    - decoded event JSON
+        @param state    - sync state saved in the same transaction, see
+                          SQLiteMirror.store()
+        '''
+        self.stats['events'] += 1
+        obj = (event.get('data') or {}).get('object') or {}
+        kind = obj.get('object')
+        if kind not in _tables or \
+                (kind != 'card' and kind not in self.kinds) or \
+                (kind == 'card' and 'customer' not in self.kinds):
+            self.stats['ignored'] += 1
+            if state:
+                await self.mirror.store((), state=state)
+            return
+
+        if event.get('type', '').endswith('.deleted') or obj.get('deleted'):
+            await self.mirror.store(
+                    (), deleted=[(kind, obj['id'])], state=state)
+            self.stats['deleted'] += 1
+        else:
+            await self.mirror.store([obj], state=state)
+            self.stats['stored'] += 1
+
+    async def _poll(self, follow):
+        while True:
+            for kind in self.kinds:
+                params = {'limit': self.batch_size}
+                latest = await self.mirror.latest_created(kind)
+                if latest is not None:
+                    # Objects created in the same second may not all be in
+                    # yet, storing them again is harmless.
+                    params['created'] = {'gte': latest}
+                await self._copy(kind, params)
+
+            if not follow:
+                return
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+
+class TokenBucket(object):
+    '''
+    Token bucket whose refill rate adapts to throttling.
+
+    Every request takes one token, tokens are refilled at `rate` per second up
+    to `burst`.  When Stripe answers with a 429 the rate is cut by
+    `decrease`, then grows again by `increase` per second of successful
+    requests until it is back at the configured maximum, so concurrent users
+    settle just below the account limit.
+
+    A burst of requests sent at too high a rate is usually answered with
+    several 429s.  Only the first cuts the rate: 429s for requests that took
+    their token before the last cut are ignored, as the cut already
+    accounts for them.
+    '''
+    def __init__(self, rate, burst=None, min_rate=1.0, decrease=0.5,
+                 increase=0.5):
+        '''
+        @param rate     - maximum requests per second
+        @param burst    - bucket size, defaults to one second worth of tokens
+        @param min_rate - rate is never decreased below this
+        @param decrease - multiplier applied to the rate on throttling
+        @param increase - requests per second added to the rate for each
+                          second of successful requests
+        '''
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.decrease = decrease
+        self.increase = increase
+
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._grown = self._last
+        # Number of rate cuts so far, tokens are taken in an epoch
+        self._epoch = 0
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self):
+        '''
+        Wait until a token is available and take it.  Waiters are served in
+        order.
+
+        @return - epoch the token was taken in, to pass to throttled()
+        '''
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+            return self._epoch
+
+    def throttled(self, epoch=None):
+        '''
+        Record a 429 from Stripe, shrinking the rate and draining the bucket.
+
+        @param epoch    - as returned by the acquire() of the throttled
+                          request.  The 429 is ignored if the rate was cut
+                          since.  None to always cut.
+        @return         - True if the rate was cut
+        '''
+        if epoch is not None and epoch != self._epoch:
+            return False
+
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self._tokens = min(self._tokens, 0)
+        self._grown = self._last
+        self._epoch += 1
+        return True
+
+    def succeeded(self):
+        '''
+        Record a successful request, growing the rate back toward max_rate
+        by `increase` per second since the last cut or growth.
+        '''
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(
+                    self.max_rate,
+                    self.rate + self.increase * (self._last - self._grown))
+        self._grown = self._last
+
+
+class RateLimiter(object):
+    '''
+    Client side rate limiting with separate buckets for reads and writes,
+    mirroring how Stripe accounts its limits.  A single instance may be shared
+    by any number of Clients running on the same event loop.
+    '''
+    def __init__(self, read_rate=100, write_rate=100, **kwds):
+        '''
+        Keyword arguments are passed through to both TokenBuckets.
+
+        @param read_rate    - maximum GET requests per second
+        @param write_rate   - maximum POST/DELETE requests per second
+        '''
+        self.read = TokenBucket(read_rate, **kwds)
+        self.write = TokenBucket(write_rate, **kwds)
+
+    def bucket(self, method):
+        '''
+        @param method   - http method, upper case
+        @return         - TokenBucket accounting for requests of `method`
+        '''
+        return self.read if method in ('GET', 'HEAD') else self.write
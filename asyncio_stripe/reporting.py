@@ -0,0 +1,341 @@
+import collections
+import datetime
+import itertools
+
+import attr
+
+from .columnar import ChargeBatch, RefundBatch
+from .stripe import Charge, Pager, Refund
+
+
+@attr.s(slots=True)
+class ChargeSummary(object):
+    '''
+    Aggregates over one group of charges.  amount and amount_refunded only
+    count succeeded charges, failure_codes counts the failure_code of failed
+    ones.
+    '''
+    count = attr.ib(default=0)
+    succeeded = attr.ib(default=0)
+    failed = attr.ib(default=0)
+    amount = attr.ib(default=0)
+    amount_refunded = attr.ib(default=0)
+    failure_codes = attr.ib(default=attr.Factory(collections.Counter))
+
+    @property
+    def net(self):
+        return self.amount - self.amount_refunded
+
+    @property
+    def refund_ratio(self):
+        '''
+        @return - share of the succeeded amount refunded, None if nothing
+                  succeeded
+        '''
+        if not self.amount:
+            return None
+        return self.amount_refunded / self.amount
+
+
+@attr.s(slots=True)
+class RefundSummary(object):
+    '''
+    Aggregates over one group of refunds.  amount only counts refunds that
+    did not fail or get canceled.
+    '''
+    count = attr.ib(default=0)
+    amount = attr.ib(default=0)
+    reasons = attr.ib(default=attr.Factory(collections.Counter))
+
+
+def _gather(column, rows):
+    '''
+    @return - list of column values at `rows`
+    '''
+    return list(map(column.__getitem__, rows))
+
+
+class Report(object):
+    '''
+    Base class for grouped aggregations over ColumnBatch data.
+
+    Rows are grouped by one or more dimensions, each of which is:
+        'day'           - UTC day of created, shifted by `utc_offset`
+                          seconds, as a datetime.date
+        'metadata.KEY'  - value of metadata KEY, None where it is not set
+        a field name    - e.g. 'currency' or 'status'
+
+    Aggregation works a batch at a time on whole columns: grouping is one
+    pass over the key columns and each aggregate is a sum or count over the
+    rows of a group, so no model is built per row.  consume() takes the
+    async iterator of a list endpoint and aggregates every `batch_size` rows
+    while the next page is already being fetched.
+    '''
+    batch_cls = None
+    summary_cls = None
+    # Fields the aggregates read, other fields are not stored
+    fields = ()
+
+    def __init__(self, by='currency', utc_offset=0):
+        '''
+        @param by           - dimension or tuple of dimensions to group by
+        @param utc_offset   - seconds added to created before cutting days,
+                              e.g. -18000 for days in UTC-5
+        '''
+        self.by = (by,) if isinstance(by, str) else tuple(by)
+        if not self.by:
+            raise ValueError('At least one dimension is needed')
+        self.utc_offset = utc_offset
+        self.groups = {}
+        self.rows = 0
+
+        names = frozenset(f.name for f in attr.fields(self.batch_cls.model))
+        needed = set(self.fields)
+        for dim in self.by:
+            if dim == 'day':
+                needed.add('created')
+            elif dim.startswith('metadata.'):
+                needed.add('metadata')
+            elif dim in names:
+                needed.add(dim)
+            else:
+                raise ValueError('Unknown dimension: %s' % (dim,))
+        self._drop = tuple(names - needed - {'id'})
+        self._days = {}
+
+    def new_batch(self):
+        '''
+        @return - empty batch storing only the fields this report reads
+        '''
+        return self.batch_cls(self._drop)
+
+    def _day(self, day):
+        date = self._days.get(day)
+        if date is None:
+            date = self._days[day] = datetime.date.fromordinal(
+                    day + datetime.date(1970, 1, 1).toordinal())
+        return date
+
+    def _dimension(self, batch, dim):
+        '''
+        @return - (list of one key per row, callable turning a key into the
+                  reported value)
+        '''
+        if dim == 'day':
+            offset = self.utc_offset
+            return (
+                [(c + offset) // 86400 for c in batch.column('created')],
+                self._day)
+
+        if dim.startswith('metadata.'):
+            key = dim[len('metadata.'):]
+            column = batch.column('metadata')
+            keys = [None] * len(column)
+            # Only rows with metadata are stored
+            for i, metadata in column.values.items():
+                if metadata:
+                    keys[i] = metadata.get(key)
+            return keys, None
+
+        column = batch.column(dim)
+        if hasattr(column, 'codes'):
+            return column.codes, column.values.__getitem__
+        return column, None
+
+    def _group(self, batch):
+        '''
+        @return - dictionary of reported key to list of row indexes
+        '''
+        dims = [self._dimension(batch, dim) for dim in self.by]
+        if len(dims) == 1:
+            keys, decode = dims[0]
+        else:
+            keys = zip(*(k for k, _ in dims))
+            decodes = [d for _, d in dims]
+
+            def decode(key):
+                return tuple(
+                    v if d is None else d(v) for v, d in zip(key, decodes))
+
+        rows = collections.defaultdict(list)
+        for i, key in enumerate(keys):
+            rows[key].append(i)
+        if decode is None:
+            return rows
+        return {decode(key): idx for key, idx in rows.items()}
+
+    def add(self, batch):
+        '''
+        Aggregate every row of `batch`, which must hold the fields this
+        report reads, e.g. one from new_batch().
+        '''
+        if not len(batch):
+            return
+        context = self._prepare(batch)
+        for key, idx in self._group(batch).items():
+            summary = self.groups.get(key)
+            if summary is None:
+                summary = self.groups[key] = self.summary_cls()
+            self._update(summary, context, idx)
+        self.rows += len(batch)
+
+    def _prepare(self, batch):
+        raise NotImplementedError()
+
+    def _update(self, summary, context, idx):
+        raise NotImplementedError()
+
+    async def consume(self, objs, batch_size=1000):
+        '''
+        Aggregate every object yielded by an async iterator, models or
+        decoded JSON, e.g. a Pager created with raw=True.
+
+        @param objs         - async iterator of objects
+        @param batch_size   - rows collected before aggregating them
+        @return             - self
+        '''
+        batch = self.new_batch()
+        async for obj in objs:
+            batch.extend((obj,))
+            if len(batch) >= batch_size:
+                self.add(batch)
+                batch = self.new_batch()
+        self.add(batch)
+        return self
+
+    def result(self):
+        '''
+        @return - dictionary of group key to summary, keys are a tuple when
+                  grouping by several dimensions
+        '''
+        return self.groups
+
+
+class ChargeReport(Report):
+    '''
+    Counts, succeeded amount, refunded amount and failure codes of charges.
+    '''
+    batch_cls = ChargeBatch
+    summary_cls = ChargeSummary
+    fields = ('amount', 'amount_refunded', 'status', 'failure_code')
+
+    def _prepare(self, batch):
+        status = batch.column('status')
+        codes = status.codes
+        ok = [False] * len(codes)
+        failed = [False] * len(codes)
+        if 'succeeded' in status.values:
+            ok = list(map(status.values.index('succeeded').__eq__, codes))
+        if 'failed' in status.values:
+            failed = list(map(status.values.index('failed').__eq__, codes))
+        return (
+            batch.column('amount'),
+            batch.column('amount_refunded'),
+            batch.column('failure_code'),
+            ok,
+            failed)
+
+    def _update(self, summary, context, idx):
+        amount, refunded, failure_code, ok, failed = context
+
+        ok_idx = list(itertools.compress(idx, _gather(ok, idx)))
+        failed_idx = list(itertools.compress(idx, _gather(failed, idx)))
+
+        summary.count += len(idx)
+        summary.succeeded += len(ok_idx)
+        summary.failed += len(failed_idx)
+        summary.amount += sum(_gather(amount, ok_idx))
+        summary.amount_refunded += sum(_gather(refunded, ok_idx))
+
+        values = failure_code.values
+        for code, n in collections.Counter(
+                _gather(failure_code.codes, failed_idx)).items():
+            if values[code] is not None:
+                summary.failure_codes[values[code]] += n
+
+
+class RefundReport(Report):
+    '''
+    Counts, amount and reasons of refunds.
+    '''
+    batch_cls = RefundBatch
+    summary_cls = RefundSummary
+    fields = ('amount', 'reason', 'status')
+
+    def _prepare(self, batch):
+        status = batch.column('status')
+        void = frozenset(
+            i for i, v in enumerate(status.values)
+            if v in ('failed', 'canceled'))
+        return (
+            batch.column('amount'),
+            batch.column('reason'),
+            [c not in void for c in status.codes])
+
+    def _update(self, summary, context, idx):
+        amount, reason, counted = context
+
+        summary.count += len(idx)
+        summary.amount += sum(itertools.compress(
+            _gather(amount, idx), _gather(counted, idx)))
+
+        values = reason.values
+        for code, n in collections.Counter(
+                _gather(reason.codes, idx)).items():
+            if values[code] is not None:
+                summary.reasons[values[code]] += n
+
+
+async def charge_report(client, by='currency', utc_offset=0,
+                        batch_size=1000, **kwds):
+    '''
+    Aggregate all charges matching the given parameters, fetched without
+    building a Charge per row.
+
+        report = await charge_report(
+                client, by=('day', 'currency'), created={'gte': start})
+        for (day, currency), summary in report.result().items():
+            ...
+
+    Keyword arguments can be passed as defined by:
+    https://stripe.com/docs/api/curl#list_charges
+
+    @param client       - Client
+    @param by           - see Report
+    @param utc_offset   - see Report
+    @param batch_size   - rows aggregated at once
+    @return             - ChargeReport
+
+    @raises StripeError - Parsed errors from stripe
+    '''
+    report = ChargeReport(by, utc_offset)
+    return await report.consume(
+            Pager(
+                client,
+                '/charges',
+                client._list_params(Charge, kwds),
+                raw=True),
+            batch_size)
+
+
+async def refund_report(client, by='currency', utc_offset=0,
+                        batch_size=1000, **kwds):
+    '''
+    Aggregate all refunds matching the given parameters, see
+    charge_report().
+
+    Keyword arguments can be passed as defined by:
+    https://stripe.com/docs/api/curl#list_refunds
+
+    @return - RefundReport
+
+    @raises StripeError - Parsed errors from stripe
+    '''
+    report = RefundReport(by, utc_offset)
+    return await report.consume(
+            Pager(
+                client,
+                '/refunds',
+                client._list_params(Refund, kwds),
+                raw=True),
+            batch_size)
@@ -1,6 +1,31 @@
+import asyncio
+import collections
+import copy
+import functools
+import json
+import random
+import ssl
+import urllib.parse
+import uuid
+
 import aiohttp
 import attr
 
+from .bulk import Bulk
+from .checkpoint import MemoryCheckpoint
+from .instrument import (
+    CallTrace,
+    RequestEvent,
+    call_hooks,
+    endpoint_template,
+    phase_trace_config,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class StripeException(Exception):
     pass
@@ -46,6 +71,10 @@ class ParseError(StripeException):
     pass
 
 
+class StripeTimeout(StripeException, asyncio.TimeoutError):
+    pass
+
+
 class DeletionError(StripeException):
     pass
 
@@ -78,10 +107,10 @@ class Charge(object):
     receipt_email = attr.ib()
     receipt_number = attr.ib()
     refunded = attr.ib()
-    refunds = attr.ib()
+    refunds = attr.ib(metadata={'nested': True})
     review = attr.ib(metadata={'expandable': True})
     shipping = attr.ib()
-    source = attr.ib()
+    source = attr.ib(metadata={'nested': True})
     source_transfer = attr.ib(metadata={'expandable': True})
     statement_descriptor = attr.ib()
     status = attr.ib()
@@ -106,10 +135,12 @@ class Customer(object):
     livemode = attr.ib()
     metadata = attr.ib()
     shipping = attr.ib()
-    sources = attr.ib()
+    sources = attr.ib(metadata={'nested': True})
 
     # Not returned when customer has no subscriptions
-    subscriptions = attr.ib(default=attr.Factory(list))
+    subscriptions = attr.ib(
+            metadata={'nested': True},
+            default=attr.Factory(list))
 
     # In documentation but not seen
     # business_vat_id = attr.ib()
@@ -168,29 +199,526 @@ class Refund(object):
     # description = attr.ib()
 
 
+def _event_data(data):
+    '''
+    Convert the object an event is about, data.previous_attributes is left
+    as is.
+    '''
+    if isinstance(data, dict) and isinstance(data.get('object'), dict):
+        data = dict(data, object=convert_json_response(data['object']))
+    return data
+
+
+@attr.s(slots=True, frozen=True)
+class Event(object):
+    id = attr.ib()
+    api_version = attr.ib()
+    created = attr.ib()
+    # {'object': model, 'previous_attributes': {..}} for *.updated events
+    data = attr.ib(converter=_event_data)
+    livemode = attr.ib()
+    pending_webhooks = attr.ib()
+    request = attr.ib()
+    type = attr.ib()
+
+    # Connect only
+    account = attr.ib(default=None)
+
+
+@attr.s(slots=True, frozen=True)
+class RetryPolicy(object):
+    '''
+    Controls how Client retries failed requests.
+
+    Requests are retried on connection errors, 409, 429 and 502-504 as well as
+    500 for anything but POST (Stripe replays the stored 500 for a POST with
+    the same idempotency key).  A Stripe-Should-Retry header always takes
+    precedence.  The delay between attempts grows exponentially from
+    `backoff`, is capped at `max_backoff`, is reduced by up to `jitter` of
+    itself at random and is never less than a Retry-After header asks for.
+    A Retry-After longer than `max_retry_after` is not waited out, the error
+    is raised instead of retrying earlier than Stripe asked.
+    '''
+    max_retries = attr.ib(default=2)
+    backoff = attr.ib(default=0.5)
+    max_backoff = attr.ib(default=8.0)
+    jitter = attr.ib(default=0.5)
+    max_retry_after = attr.ib(default=60.0)
+
+    def should_retry(self, attempt, method, status=None, headers=None):
+        '''
+        @param attempt  - number of retries already made
+        @param method   - http method, upper case
+        @param status   - http status, None on connection errors
+        @param headers  - response headers, None on connection errors
+        @return         - True if the request should be retried
+        '''
+        if attempt >= self.max_retries:
+            return False
+
+        if status is None:
+            return True
+
+        if self._retry_after(headers) > self.max_retry_after:
+            return False
+
+        should = (headers or {}).get('Stripe-Should-Retry')
+        if should is not None:
+            return should == 'true'
+
+        if status in (409, 429, 502, 503, 504):
+            return True
+
+        return status == 500 and method != 'POST'
+
+    def delay(self, attempt, headers=None):
+        '''
+        @param attempt  - number of retries already made
+        @param headers  - response headers, None on connection errors
+        @return         - seconds to wait before the next attempt
+        '''
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        delay *= 1 - self.jitter * random.random()
+        return max(delay, self._retry_after(headers))
+
+    @staticmethod
+    def _retry_after(headers):
+        try:
+            return float((headers or {}).get('Retry-After', 0))
+        except ValueError:
+            return 0
+
+
+@attr.s(slots=True, frozen=True)
+class PoolConfig(object):
+    '''
+    Connection pool settings for sessions created by Client itself.
+
+    All requests go to a single host, so the per host limit is what bounds
+    concurrency.  Idle connections are kept alive long enough to be reused
+    between bursts, DNS lookups are cached and a single SSL context is shared
+    by every connection rather than loading the CA store per connection.
+    '''
+    limit = attr.ib(default=100)
+    limit_per_host = attr.ib(default=64)
+    keepalive_timeout = attr.ib(default=60.0)
+    ttl_dns_cache = attr.ib(default=300)
+
+    def connector(self):
+        '''
+        @return - new aiohttp.TCPConnector using these settings
+        '''
+        return aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.ttl_dns_cache,
+                ssl=ssl.create_default_context())
+
+
+def expand_paths(cls, expand, prefix=''):
+    '''
+    Validate the objects to expand against the fields of `cls` tagged as
+    expandable and return them as values for the expand[] parameter.  Only
+    the first component of a dotted path (e.g. customer.default_source) is
+    checked.
+
+    Expanded objects with a model (charge, customer, card, refund) are
+    converted to it.  Any other, e.g. a balance_transaction, is left as the
+    decoded JSON dictionary, see convert_json_response().
+
+    @param cls      - model class being requested
+    @param expand   - field name or list of field names
+    @param prefix   - prepended to every path, 'data.' for list endpoints
+    @return         - list of paths
+
+    @raises ValueError if a path does not start with an expandable field
+    '''
+    if isinstance(expand, str):
+        expand = [expand]
+
+    fields = set(
+        f.name for f in attr.fields(cls) if f.metadata.get('expandable'))
+
+    ret = []
+    for path in expand:
+        if prefix and path.startswith(prefix):
+            path = path[len(prefix):]
+        if path.split('.', 1)[0] not in fields:
+            raise ValueError('%s cannot expand "%s"' % (cls.__name__, path))
+        ret.append(prefix + path)
+    return ret
+
+
+@functools.lru_cache(maxsize=4096)
+def _subkey(key, subkey):
+    return '%s[%s]' % (key, subkey)
+
+
+_quote_key = functools.lru_cache(maxsize=4096)(urllib.parse.quote_plus)
+
+
+def _encode_into(pairs, key, value):
+    if isinstance(value, dict):
+        if not value and key is not None:
+            pairs.append((key, ''))
+        for k, v in value.items():
+            _encode_into(pairs, k if key is None else _subkey(key, k), v)
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            pairs.append((key, ''))
+        for i, v in enumerate(value):
+            if isinstance(v, (dict, list, tuple)):
+                _encode_into(pairs, _subkey(key, i), v)
+            else:
+                _encode_into(pairs, _subkey(key, ''), v)
+    elif value is True:
+        pairs.append((key, 'true'))
+    elif value is False:
+        pairs.append((key, 'false'))
+    elif value is None:
+        pairs.append((key, ''))
+    elif value.__class__ is str:
+        pairs.append((key, value))
+    else:
+        pairs.append((key, str(value)))
+
+
+def encode_params(params):
+    '''
+    Flatten request parameters into the (key, value) pairs of Stripe's form
+    encoding in a single pass.
+
+    Dictionaries nest as key[subkey], lists of objects as key[0][subkey] and
+    lists of plain values as key[].  Booleans become 'true'/'false' and None
+    or an empty dictionary or list becomes '', which Stripe takes as unset.
+    Generated keys are cached, so parameters of the same shape only pay for
+    building them once.
+
+    @param params   - dictionary of parameters
+    @return         - list of (key, value) string pairs
+    '''
+    pairs = []
+    _encode_into(pairs, None, params)
+    return pairs
+
+
+def form_encode(pairs):
+    '''
+    @param pairs    - (key, value) pairs as returned by encode_params
+    @return         - application/x-www-form-urlencoded body
+    '''
+    quote = urllib.parse.quote_plus
+    return '&'.join(
+        _quote_key(k) + '=' + quote(v)
+        for k, v in pairs).encode('ascii')
+
+
+def json_loads(data):
+    '''
+    Decode a JSON response body with the standard library.
+
+    @param data - response body as bytes
+    @return     - decoded JSON
+    '''
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
 class Client(object):
-    def __init__(self, session, pk):
+    def __init__(self, session, pk, retry=None, limiter=None, coalesce=True,
+                 cache=None, lazy=False, loads=None, pool=None,
+                 timeout=None, hooks=None, url='https://api.stripe.com/v1'):
         '''
         Create a new Stripe client
 
-        @param session  - aiohttp session
+        @param session  - aiohttp session.  If None, the client creates its
+                          own session configured by `pool` and closes it in
+                          close() or when leaving an `async with` block.
+                          Either way the client cannot be used once closed.
         @param pk       - private stripe key
+        @param retry    - RetryPolicy, defaults to RetryPolicy()
+        @param limiter  - RateLimiter, possibly shared with other clients.  If
+                          None, requests are not rate limited.
+        @param coalesce - share a single request between concurrent identical
+                          GETs
+        @param cache    - ResponseCache consulted by retrieve_* and kept up to
+                          date by updates made through this client.  If None,
+                          nothing is cached.
+        @param lazy     - return LazyModel views that only build nested
+                          objects when they are accessed instead of models
+        @param loads    - callable decoding JSON from the bytes of a response
+                          body.  Defaults to orjson.loads when orjson is
+                          installed, json_loads otherwise.
+        @param pool     - PoolConfig for the session created when `session`
+                          is None, defaults to PoolConfig()
+        @param timeout  - seconds each call may take in total, including
+                          waiting for the rate limiter, connecting, reading
+                          the response and any retries.  None for no limit.
+                          Every call also takes a `timeout` keyword
+                          overriding this one.
+        @param hooks    - list of Hooks instances notified of every request,
+                          e.g. MetricsCollector()
+        @param url      - base API URL, e.g. that of a FakeStripe server
         '''
         self._session = session
+        self._owns_session = session is None
+        self._pool = PoolConfig() if pool is None else pool
+        self._timeout = timeout
+        self._hooks = tuple(hooks or ())
         self._auth = aiohttp.BasicAuth(pk)
-        self._url = 'https://api.stripe.com/v1'
+        self._url = url.rstrip('/')
+        self._retry = RetryPolicy() if retry is None else retry
+        self._limiter = limiter
+        self._coalesce = coalesce
+        self._inflight = {}
+        self._closed = False
+        # Background requests, e.g. page prefetches, cancelled by close()
+        self._tasks = set()
+        # Client whose lifecycle this one follows, see with_timeout()
+        self._root = self
+        self._cache = cache
+        self._convert = convert_lazy_response if lazy else \
+            convert_json_response
+
+        if loads is None:
+            loads = json_loads if orjson is None else orjson.loads
+        self._loads = loads
+
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self):
+        if self._root._closed:
+            raise RuntimeError('Client is closed')
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                    connector=self._pool.connector(),
+                    trace_configs=[phase_trace_config()])
+        return self._session
+
+    def _spawn(self, coro):
+        '''
+        Run `coro` in a task that close() cancels if it is still running.
 
-    async def _req(self, method, page, params=None):
+        @return - task
         '''
-        Issue a request to the given page relative to the base Stripe API URL.
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _join(self, task):
+        '''
+        Wait for a task from _spawn(), reporting one cancelled by close() as
+        the client being closed.
+        '''
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task.cancelled() and self._root._closed:
+                raise RuntimeError('Client is closed')
+            raise
+
+    async def close(self):
+        '''
+        Stop the client: background requests such as page prefetches are
+        cancelled and later calls raise RuntimeError.  The session is closed
+        if it was created by this client, one passed in by the caller is left
+        open.  Closing a client returned by with_timeout() does nothing, it
+        is closed along with the client it came from.
+        '''
+        if self._root is not self:
+            return
+        self._closed = True
+
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._owns_session and self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    def pool_stats(self):
+        '''
+        Report on the connection pool of the session in use.
+
+        @return - dictionary of limit and limit_per_host, the number of open
+                  connections split into in_use and idle, and the number of
+                  requests waiting for a connection
+        '''
+        connector = getattr(self._session, 'connector', None)
+        idle = sum(len(c) for c in getattr(connector, '_conns', {}).values())
+        in_use = len(getattr(connector, '_acquired', ()))
+        waiting = sum(
+            len(w) for w in getattr(connector, '_waiters', {}).values())
+
+        return {
+            'limit': getattr(connector, 'limit', self._pool.limit),
+            'limit_per_host': getattr(
+                connector, 'limit_per_host', self._pool.limit_per_host),
+            'open': idle + in_use,
+            'in_use': in_use,
+            'idle': idle,
+            'waiting': waiting,
+        }
+
+    def with_timeout(self, timeout):
+        '''
+        Return a client sharing this one's session, limiter, cache and
+        settings whose calls are bounded by `timeout`, e.g.
+        await client.with_timeout(2).create_charge(...).  A single call can
+        pass timeout= instead.  The returned client is closed, and its
+        background requests cancelled, when this client is closed.  When
+        this client owns its session this must be called with the event loop
+        running.
+
+        @param timeout  - seconds each call may take in total, None for no
+                          limit
+        @return         - Client
+        '''
+        self._get_session()
+        client = copy.copy(self)
+        client._owns_session = False
+        client._timeout = timeout
+        return client
+
+    async def _req_raw(self, method, page, params=None, trace=None):
+        '''
+        Issue a request to the given page relative to the base Stripe API URL
+        and return the decoded response body without converting it.
 
         @param method   - http method
         @param page     - page relative to base stripe API URL
-        @param params   - data to post, if any
-        @return         - Stripe Object
+        @param params   - data to post, if any.  An idempotency_key entry
+                          is sent as the Idempotency-Key header of a POST
+                          rather than as a parameter, a timeout entry bounds
+                          this call instead of the client's timeout.
+        @param trace    - CallTrace to record the phases of the request in
+        @return         - decoded JSON body
+
+        @raises StripeError on error from stripe
+        @raises StripeTimeout if the call did not complete within the timeout
+        '''
+        method = method.upper()
+        params = dict(params or {})
+        key = params.pop('idempotency_key', None)
+        timeout = params.pop('timeout', None)
+        if timeout is None:
+            timeout = self._timeout
+        params = encode_params(params)
+
+        if timeout is None:
+            return await self._dispatch(
+                    method, page, params, None, trace, key)
+
+        deadline = asyncio.get_event_loop().time() + timeout
+        task = asyncio.ensure_future(self._dispatch(
+                method, page, params, deadline, trace, key))
+        try:
+            done, _ = await asyncio.wait((task,), timeout=timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+        if done:
+            # Errors of the call itself, e.g. aiohttp's ServerTimeoutError,
+            # are raised as they are.
+            return task.result()
+
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+        error = StripeTimeout('%s %s did not complete within %ss' % (
+            method, page, timeout))
+        if self._hooks:
+            call_hooks(self._hooks, 'on_error', RequestEvent(
+                method, endpoint_template(page), None, None, error=error))
+        raise error
+
+    async def _dispatch(self, method, page, params, deadline, trace,
+                        idempotency_key=None):
+        if method != 'GET' or not self._coalesce:
+            return await self._send(
+                    method, page, params, lambda: deadline, trace,
+                    idempotency_key)
+
+        # Concurrent identical GETs wait on the first one's request.  The
+        # shield keeps one caller being cancelled, e.g. by its deadline, from
+        # failing the others.  The request itself is cancelled once every
+        # caller has given up on it, so it does not go on holding a
+        # connection and retrying for nobody.
+        #
+        # The request retries until the latest deadline of its callers, each
+        # caller's own timeout is enforced by _req_raw.  It records its
+        # phases in a trace of its own, handed to the caller that started it
+        # only once the request is done.
+        key = (page, tuple(params))
+        entry = self._inflight.get(key)
+        owner = entry is None
+        if owner:
+            # [request, number of callers waiting on it, latest deadline,
+            #  trace of the request]
+            entry = [None, 0, deadline, None]
+            if trace is not None:
+                entry[3] = CallTrace()
+            fut = entry[0] = self._spawn(self._send(
+                    method, page, params, lambda: entry[2], entry[3]))
+            self._inflight[key] = entry
+
+            def done(f):
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+            fut.add_done_callback(done)
+        elif entry[2] is not None:
+            entry[2] = None if deadline is None else max(entry[2], deadline)
+
+        fut = entry[0]
+        entry[1] += 1
+        try:
+            body = await asyncio.shield(fut)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not fut.done():
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                fut.cancel()
+
+        if owner and trace is not None:
+            trace.phases.update(entry[3].phases)
+            trace.event = entry[3].event
+        return body
+
+    async def _send(self, method, page, params, deadline=None, trace=None,
+                    idempotency_key=None):
+        '''
+        Send a request, retrying and rate limiting as configured.
+
+        @param method   - http method, upper case
+        @param page     - page relative to base stripe API URL
+        @param params   - parameters as returned by encode_params, sent as
+                          the body for POST and the query string otherwise
+        @param deadline - callable returning the event loop time after which
+                          no retry is started, None for no limit, read
+                          before each retry
+        @param trace    - CallTrace to record the phases of the last attempt
+        @param idempotency_key - Idempotency-Key of a POST, a random one is
+                                 generated if None
+        @return         - decoded JSON body
 
         @raises StripeError on error from stripe
-        @raises ParseError on failing to parse Stripe Object
         '''
         url = self._url + '/' + page.lstrip('/')
         headers = {
@@ -198,35 +726,137 @@ class Client(object):
             'Stripe-Version': '2017-02-14',
         }
 
-        if params is None:
-            params = {}
-
-        # Turn any dictionaries into parameters
-        for key in [k for k, v in params.items() if isinstance(v, dict)]:
-            for subkey, v in params[key].items():
-                params['%s[%s]' % (key, subkey)] = v
-            del params[key]
-
-        # Booleans to strings
-        params.update({
-            k: str(v).lower()
-            for k, v in params.items()
-            if isinstance(v, bool)})
-
-        r = await self._session.request(
-                method.upper(),
-                url,
-                params=params,
-                auth=self._auth,
-                headers=headers)
-
-        if r.headers.get('Content-Type', '').startswith('application/json'):
-            body = await r.json()
+        # Makes retrying a POST safe, Stripe will replay the first response.
+        if method == 'POST':
+            headers['Idempotency-Key'] = idempotency_key or str(uuid.uuid4())
+            kwds = {'data': form_encode(params)}
         else:
-            body = await r.read()
+            kwds = {'params': params}
+
+        if trace is not None:
+            kwds['trace_request_ctx'] = trace
+
+        bucket = None
+        if self._limiter is not None:
+            bucket = self._limiter.bucket(method)
+
+        hooks = self._hooks
+        loop = asyncio.get_event_loop()
+
+        attempt = 0
+        while True:
+            if bucket is not None:
+                epoch = await bucket.acquire()
+
+            if hooks:
+                event = RequestEvent(
+                    method,
+                    endpoint_template(page),
+                    attempt,
+                    len(kwds.get('data', b'')))
+                call_hooks(hooks, 'on_request_start', event)
+            if trace is not None:
+                trace.reset()
+            start = loop.time()
+
+            try:
+                r = await self._get_session().request(
+                        method,
+                        url,
+                        auth=self._auth,
+                        headers=headers,
+                        **kwds)
+
+                read_start = loop.time()
+                body = await r.read()
+                read_end = loop.time()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+                retry = self._retry.should_retry(attempt, method)
+                if retry:
+                    delay = self._retry.delay(attempt)
+                if hooks:
+                    event = attr.evolve(event, latency=loop.time() - start)
+            else:
+                size = len(body)
+
+                # Decode straight from the raw body, skipping aiohttp's text
+                # decoding.
+                ctype = r.headers.get('Content-Type', '')
+                if ctype.startswith('application/json'):
+                    try:
+                        body = self._loads(body)
+                        if trace is not None:
+                            trace.phases['json_decode'] = \
+                                loop.time() - read_end
+                    except ValueError as e:
+                        error = ParseError('Invalid JSON from Stripe: %s' % (
+                            e,))
+                        if hooks:
+                            call_hooks(hooks, 'on_error', attr.evolve(
+                                event, status=r.status, error=error))
+                        raise error
+
+                if hooks:
+                    event = attr.evolve(
+                        event,
+                        status=r.status,
+                        latency=loop.time() - start,
+                        response_size=size,
+                        request_id=r.headers.get('Request-Id'))
+                    call_hooks(hooks, 'on_response', event)
+
+                if trace is not None:
+                    trace.network_phases()
+                    trace.phases['body_read'] = read_end - read_start
+                    trace.event = event
+
+                if bucket is not None:
+                    if r.status == 429:
+                        bucket.throttled(epoch)
+                    elif r.status == 200:
+                        bucket.succeeded()
+
+                if r.status == 200:
+                    return body
+
+                error = StripeError(r, body)
+                retry = self._retry.should_retry(
+                    attempt, method, r.status, r.headers)
+                if retry:
+                    delay = self._retry.delay(attempt, r.headers)
+
+            # Report the real failure rather than a timeout if the next
+            # attempt could not start before the deadline anyway.
+            if retry and deadline is not None:
+                limit = deadline()
+                if limit is not None:
+                    retry = loop.time() + delay < limit
+            if not retry:
+                if hooks:
+                    call_hooks(hooks, 'on_error', attr.evolve(
+                        event, error=error))
+                raise error
+
+            if hooks:
+                call_hooks(hooks, 'on_retry', attr.evolve(event, delay=delay))
+            await asyncio.sleep(delay)
+            attempt += 1
 
-        if r.status != 200:
-            raise StripeError(r, body)
+    async def _req(self, method, page, params=None):
+        '''
+        Issue a request to the given page relative to the base Stripe API URL.
+
+        @param method   - http method
+        @param page     - page relative to base stripe API URL
+        @param params   - data to post, if any
+        @return         - Stripe Object
+
+        @raises StripeError on error from stripe
+        @raises ParseError on failing to parse Stripe Object
+        '''
+        trace = CallTrace() if self._hooks else None
+        body = await self._req_raw(method, page, params, trace)
 
         if method.upper() == 'DELETE':
             if not body.get('deleted', False):
@@ -236,7 +866,61 @@ class Client(object):
         if 'object' not in body:
             raise ParseError('Stripe response missing "object": %s' % (body,))
 
-        return convert_json_response(body)
+        if trace is None or trace.event is None:
+            return self._convert(body)
+
+        # Calls coalesced onto another request have no trace of their own
+        # and are not reported.
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        obj = self._convert(body)
+        trace.phases['model_build'] = loop.time() - start
+        call_hooks(self._hooks, 'on_complete', attr.evolve(
+            trace.event, phases=dict(trace.phases)))
+        return obj
+
+    async def _retrieve(self, kind, obj_id, page, expand=None, timeout=None):
+        '''
+        Retrieve an object, serving it from the cache when possible.
+        Requests expanding related objects bypass the cache.
+
+        @param kind     - Stripe object type
+        @param obj_id   - object identifier
+        @param page     - page relative to base stripe API URL
+        @param expand   - expandable fields to expand, if any
+        @param timeout  - seconds the call may take, None for the client's
+                          timeout
+        @return         - Stripe Object
+        '''
+        params = {'timeout': timeout}
+        if expand:
+            params['expand'] = expand_paths(cls_map[kind], expand)
+            return await self._req('get', page, params)
+
+        if self._cache is not None:
+            obj = self._cache.get(kind, obj_id)
+            if obj is not None:
+                return obj
+
+        obj = await self._req('get', page, params)
+        self._cache_put(kind, obj)
+        return obj
+
+    def _list_params(self, cls, params):
+        if params.get('expand'):
+            params = dict(
+                params,
+                expand=expand_paths(cls, params['expand'], 'data.'))
+        return params
+
+    def _cache_put(self, kind, obj):
+        if self._cache is not None:
+            self._cache.put(kind, obj)
+        return obj
+
+    def _cache_invalidate(self, kind, obj_id):
+        if self._cache is not None:
+            self._cache.invalidate(kind, obj_id)
 
     async def create_charge(self, amount, currency, **kwds):
         '''
@@ -244,6 +928,11 @@ class Client(object):
 
         Keyword arguments can be passed as defined by:
         https://stripe.com/docs/api/curl#create_charge
+        `idempotency_key` replaces the random key retries are sent with, e.g.
+        one derived from an order id keeps a charge retried after a restart
+        from being made twice.  Every call issuing a POST with keyword
+        arguments accepts it.  `timeout` bounds this call in seconds, in
+        place of the client's timeout, and is accepted by every call.
 
         @param amount   - amount to be charged, in cents
         @param currency - charge currency
@@ -255,17 +944,28 @@ class Client(object):
         params = {'amount': amount, 'currency': currency, **kwds}
         return await self._req('post', '/charges', params=params)
 
-    async def retrieve_charge(self, charge_id):
+    async def retrieve_charge(self, charge_id, expand=None, timeout=None):
         '''
         Retrieve a charge
 
         @param charge_id - charge identifier
+        @param expand    - expandable field or list of fields to expand,
+                           e.g. ['customer'].  Objects without a model,
+                           e.g. balance_transaction, are left as
+                           dictionaries.
+        @param timeout   - seconds the call may take, None for the client's
+                           timeout
         @return - matching Charge instance
 
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Charge instance failed
         '''
-        return await self._req('get', '/charges/%s' % (charge_id,))
+        return await self._retrieve(
+                'charge',
+                charge_id,
+                '/charges/%s' % (charge_id,),
+                expand,
+                timeout)
 
     async def update_charge(self, charge_id, **kwds):
         '''
@@ -280,10 +980,11 @@ class Client(object):
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Charge instance failed
         '''
-        return await self._req(
+        charge = await self._req(
                 'post',
                 '/charges/%s' % (charge_id,),
                 params=kwds)
+        return self._cache_put('charge', charge)
 
     async def capture_charge(self, charge_id, **kwds):
         '''
@@ -298,10 +999,11 @@ class Client(object):
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Charge instance failed
         '''
-        return await self._req(
+        charge = await self._req(
                 'post',
                 '/charges/%s/capture' % (charge_id,),
                 params=kwds)
+        return self._cache_put('charge', charge)
 
     async def list_charges(self, **kwds):
         '''
@@ -310,13 +1012,118 @@ class Client(object):
 
         Keyword arguments can be passed as defined by:
         https://stripe.com/docs/api/curl#list_charges
+        `expand` may name expandable fields of the listed objects.
 
         @return - list of matching Charge instances
 
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Charge instance failed
         '''
-        return await self._req('get', '/charges', params=kwds)
+        return await self._req(
+                'get',
+                '/charges',
+                params=self._list_params(Charge, kwds))
+
+    def iter_charges(self, raw=False, **kwds):
+        '''
+        Iterate over all previously created charges matching the given
+        parameters, following pagination cursors as needed.  The next page is
+        fetched while the current one is being consumed.
+
+        Keyword arguments can be passed as defined by:
+        https://stripe.com/docs/api/curl#list_charges
+        `expand` may name expandable fields of the listed objects.
+
+        @param raw  - yield decoded JSON instead of models, e.g. to fill a
+                      ChargeBatch
+        @return - async iterator of matching Charge instances
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing Charge instance failed
+        '''
+        return Pager(self, '/charges', self._list_params(Charge, kwds), raw)
+
+    def backfill_charges(self, start, end, window=86400, workers=4, **kwds):
+        '''
+        Iterate over all charges created in [start, end) by splitting the
+        range into windows of `window` seconds and paging through up to
+        `workers` windows concurrently.  Results are yielded newest first,
+        the same order as iter_charges.
+
+        Keyword arguments can be passed as defined by:
+        https://stripe.com/docs/api/curl#list_charges
+        `expand` may name expandable fields of the listed objects, `created`
+        narrows [start, end) further.
+
+        @param start    - earliest creation time, unix timestamp (inclusive)
+        @param end      - latest creation time, unix timestamp (exclusive)
+        @param window   - length of each window in seconds
+        @param workers  - maximum number of windows fetched at once
+        @return - async iterator of matching Charge instances
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing Charge instance failed
+        '''
+        return Backfill(
+                self,
+                '/charges',
+                start,
+                end,
+                window,
+                workers,
+                self._list_params(Charge, kwds))
+
+    async def charge_batch(self, **kwds):
+        '''
+        Fetch all charges matching the given parameters into a ChargeBatch,
+        following pagination cursors as needed.  Pages are appended to the
+        batch as decoded, without building a Charge per row.
+
+        Keyword arguments can be passed as defined by:
+        https://stripe.com/docs/api/curl#list_charges
+
+        @param drop - Charge fields not to store, see ChargeBatch
+        @return - ChargeBatch, newest charge first
+
+        @raises StripeError - Parsed errors from stripe
+        '''
+        from .columnar import ChargeBatch
+
+        batch = ChargeBatch(kwds.pop('drop', ()))
+        return await batch.fill(Pager(
+                self,
+                '/charges',
+                self._list_params(Charge, kwds),
+                raw=True))
+
+    async def backfill_charge_batch(self, start, end, window=86400,
+                                    workers=4, **kwds):
+        '''
+        Fetch all charges created in [start, end) into a ChargeBatch, with up
+        to `workers` windows of `window` seconds fetched concurrently as in
+        backfill_charges.
+
+        @param start    - earliest creation time, unix timestamp (inclusive)
+        @param end      - latest creation time, unix timestamp (exclusive)
+        @param window   - length of each window in seconds
+        @param workers  - maximum number of windows fetched at once
+        @param drop     - Charge fields not to store, see ChargeBatch
+        @return - ChargeBatch, newest charge first
+
+        @raises StripeError - Parsed errors from stripe
+        '''
+        from .columnar import ChargeBatch
+
+        batch = ChargeBatch(kwds.pop('drop', ()))
+        return await batch.fill(Backfill(
+                self,
+                '/charges',
+                start,
+                end,
+                window,
+                workers,
+                self._list_params(Charge, kwds),
+                raw=True))
 
     async def create_customer(self, **kwds):
         '''
@@ -324,6 +1131,7 @@ class Client(object):
 
         Keyword arguments can be passed as defined by:
         https://stripe.com/docs/api/curl#create_customer
+        `idempotency_key` is sent as the Idempotency-Key, see create_charge.
 
         @return - created Customer
 
@@ -332,17 +1140,26 @@ class Client(object):
         '''
         return await self._req('post', '/customers', params=kwds)
 
-    async def retrieve_customer(self, customer_id):
+    async def retrieve_customer(self, customer_id, expand=None, timeout=None):
         '''
         Retrieve a customer
 
         @param customer_id  - customer identifier
+        @param expand       - expandable field or list of fields to expand,
+                              e.g. ['default_source']
+        @param timeout      - seconds the call may take, None for the
+                              client's timeout
         @return - matching Customer instance
 
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Charge instance failed
         '''
-        return await self._req('get', '/customers/%s' % (customer_id,))
+        return await self._retrieve(
+                'customer',
+                customer_id,
+                '/customers/%s' % (customer_id,),
+                expand,
+                timeout)
 
     async def update_customer(self, customer_id, **kwds):
         '''
@@ -357,20 +1174,27 @@ class Client(object):
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Charge instance failed
         '''
-        return await self._req(
+        customer = await self._req(
             'post',
             '/customers/%s' % (customer_id,),
             params=kwds)
+        return self._cache_put('customer', customer)
 
-    async def delete_customer(self, customer_id):
+    async def delete_customer(self, customer_id, timeout=None):
         '''
         Delete a customer
 
         @param customer_id  - customer identifier
+        @param timeout      - seconds the call may take, None for the
+                              client's timeout
 
         @raises StripeError - Parsed errors from stripe
         '''
-        await self._req('delete', '/customers/%s' % (customer_id,))
+        await self._req(
+            'delete',
+            '/customers/%s' % (customer_id,),
+            {'timeout': timeout})
+        self._cache_invalidate('customer', customer_id)
 
     async def list_customers(self, **kwds):
         '''
@@ -379,48 +1203,110 @@ class Client(object):
 
         Keyword arguments can be passed as defined by:
         https://stripe.com/docs/api/curl#list_charges
+        `expand` may name expandable fields of the listed objects.
 
         @return - list of matching Charge instances
 
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Charge instance failed
         '''
-        return await self._req('get', '/customers', params=kwds)
+        return await self._req(
+                'get',
+                '/customers',
+                params=self._list_params(Customer, kwds))
 
-    async def create_card(self, customer_id, source, metadata=None):
+    def iter_customers(self, raw=False, **kwds):
+        '''
+        Iterate over all previously created customers matching the given
+        parameters, following pagination cursors as needed.  The next page is
+        fetched while the current one is being consumed.
+
+        Keyword arguments can be passed as defined by:
+        https://stripe.com/docs/api/curl#list_customers
+        `expand` may name expandable fields of the listed objects.
+
+        @param raw  - yield decoded JSON instead of models
+        @return - async iterator of matching Customer instances
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing Customer instance failed
+        '''
+        return Pager(
+                self, '/customers', self._list_params(Customer, kwds), raw)
+
+    def backfill_customers(self, start, end, window=86400, workers=4, **kwds):
+        '''
+        Iterate over all customers created in [start, end) by splitting the
+        range into windows of `window` seconds and paging through up to
+        `workers` windows concurrently.  Results are yielded newest first,
+        the same order as iter_customers.
+
+        Keyword arguments can be passed as defined by:
+        https://stripe.com/docs/api/curl#list_customers
+        `expand` may name expandable fields of the listed objects, `created`
+        narrows [start, end) further.
+
+        @param start    - earliest creation time, unix timestamp (inclusive)
+        @param end      - latest creation time, unix timestamp (exclusive)
+        @param window   - length of each window in seconds
+        @param workers  - maximum number of windows fetched at once
+        @return - async iterator of matching Customer instances
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing Customer instance failed
+        '''
+        return Backfill(
+                self,
+                '/customers',
+                start,
+                end,
+                window,
+                workers,
+                self._list_params(Customer, kwds))
+
+    async def create_card(self, customer_id, source, metadata=None,
+                          timeout=None):
         '''
         Create a new credit card for the specified customer
 
         @param customer_id  - customer identifier
         @param source       - token or dictionary with credit card details
         @param metadata     - map of metadata if any
+        @param timeout      - seconds the call may take, None for the
+                              client's timeout
         @return             - new card
 
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Card instance failed
         '''
-        params = {'source': source}
+        params = {'source': source, 'timeout': timeout}
         if metadata is not None:
             params['metadata'] = metadata
 
-        return await self._req(
+        card = await self._req(
                 'post',
                 '/customers/%s/sources' % (customer_id,),
                 params=params)
+        self._cache_invalidate('customer', customer_id)
+        return card
 
-    async def delete_card(self, customer_id, source_id):
+    async def delete_card(self, customer_id, source_id, timeout=None):
         '''
         Delete a credit card from the specified customer
 
         @param customer_id  - customer identifier
         @param source_id    - id of card to be deleted
+        @param timeout      - seconds the call may take, None for the
+                              client's timeout
 
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Card instance failed
         '''
         await self._req(
             'delete',
-            '/customers/%s/sources/%s' % (customer_id, source_id))
+            '/customers/%s/sources/%s' % (customer_id, source_id),
+            {'timeout': timeout})
+        self._cache_invalidate('customer', customer_id)
 
     async def update_card(self, customer_id, source_id, **kwds):
         '''
@@ -436,10 +1322,12 @@ class Client(object):
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Card instance failed
         '''
-        return await self._req(
+        card = await self._req(
                 'post',
                 '/customers/%s/sources/%s' % (customer_id, source_id),
                 params=kwds)
+        self._cache_invalidate('customer', customer_id)
+        return card
 
     async def create_refund(self, charge_id, **kwds):
         '''
@@ -447,6 +1335,7 @@ class Client(object):
 
         Keyword arguments can be passed as defined by:
         https://stripe.com/docs/api/curl#create_refund
+        `idempotency_key` is sent as the Idempotency-Key, see create_charge.
 
         @param charge_id - charge identifier
         @return - Refund instance
@@ -456,34 +1345,51 @@ class Client(object):
         '''
         params = {'charge': charge_id}
         params.update(kwds)
-        return await self._req('post', '/refunds', params)
+        refund = await self._req('post', '/refunds', params)
+        self._cache_invalidate('charge', charge_id)
+        return self._cache_put('refund', refund)
 
-    async def retrieve_refund(self, refund_id):
+    async def retrieve_refund(self, refund_id, expand=None, timeout=None):
         '''
         Retrieve a refund
 
         @param refund_id    - refund identifier
+        @param expand       - expandable field or list of fields to expand,
+                              e.g. ['charge']
+        @param timeout      - seconds the call may take, None for the
+                              client's timeout
         @return - matching Refund instance
 
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Refund instance failed
         '''
-        return await self._req('get', '/refunds/%s' % (refund_id,))
-
-    async def update_refund(self, refund_id, metadata):
+        return await self._retrieve(
+                'refund',
+                refund_id,
+                '/refunds/%s' % (refund_id,),
+                expand,
+                timeout)
+
+    async def update_refund(self, refund_id, metadata, timeout=None):
         '''
         Update the metadata on a refund.  Keys can be removed by setting the
         value to None for that key.
 
         @param refund_id    - refund identifier
         @param metadata     - MultiDict of metadata
+        @param timeout      - seconds the call may take, None for the
+                              client's timeout
         @return - updated Refund instance
 
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Refund instance failed
         '''
-        params = {'metadata': metadata}
-        return await self._req('post', '/refunds/%s' % (refund_id,), params)
+        params = {'metadata': metadata, 'timeout': timeout}
+        refund = await self._req(
+                'post',
+                '/refunds/%s' % (refund_id,),
+                params)
+        return self._cache_put('refund', refund)
 
     async def list_refunds(self, **kwds):
         '''
@@ -491,13 +1397,621 @@ class Client(object):
 
         Keyword arguments can be passed as defined by:
         https://stripe.com/docs/api/curl#list_refunds
+        `expand` may name expandable fields of the listed objects.
 
         @return - list of matching Refund instances
 
         @raises StripeError - Parsed errors from stripe
         @raises ParseError  - Parsing Refund instance failed
         '''
-        return await self._req('get', '/refunds', params=kwds)
+        return await self._req(
+                'get',
+                '/refunds',
+                params=self._list_params(Refund, kwds))
+
+    def iter_refunds(self, raw=False, **kwds):
+        '''
+        Iterate over all previously created refunds matching the given
+        parameters, following pagination cursors as needed.  The next page is
+        fetched while the current one is being consumed.
+
+        Keyword arguments can be passed as defined by:
+        https://stripe.com/docs/api/curl#list_refunds
+        `expand` may name expandable fields of the listed objects.
+
+        @param raw  - yield decoded JSON instead of models, e.g. to fill a
+                      RefundBatch
+        @return - async iterator of matching Refund instances
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing Refund instance failed
+        '''
+        return Pager(self, '/refunds', self._list_params(Refund, kwds), raw)
+
+    def backfill_refunds(self, start, end, window=86400, workers=4, **kwds):
+        '''
+        Iterate over all refunds created in [start, end) by splitting the
+        range into windows of `window` seconds and paging through up to
+        `workers` windows concurrently.  Results are yielded newest first,
+        the same order as iter_refunds.
+
+        Keyword arguments can be passed as defined by:
+        https://stripe.com/docs/api/curl#list_refunds
+        `expand` may name expandable fields of the listed objects, `created`
+        narrows [start, end) further.
+
+        @param start    - earliest creation time, unix timestamp (inclusive)
+        @param end      - latest creation time, unix timestamp (exclusive)
+        @param window   - length of each window in seconds
+        @param workers  - maximum number of windows fetched at once
+        @return - async iterator of matching Refund instances
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing Refund instance failed
+        '''
+        return Backfill(
+                self,
+                '/refunds',
+                start,
+                end,
+                window,
+                workers,
+                self._list_params(Refund, kwds))
+
+    async def retrieve_event(self, event_id, timeout=None):
+        '''
+        Retrieve an event, events from the last 30 days are available.
+
+        @param event_id - event identifier
+        @param timeout  - seconds the call may take, None for the client's
+                          timeout
+        @return - matching Event instance, data['object'] holds the model
+                  the event is about
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing Event instance failed
+        '''
+        return await self._retrieve(
+                'event',
+                event_id,
+                '/events/%s' % (event_id,),
+                timeout=timeout)
+
+    async def list_events(self, **kwds):
+        '''
+        Return a list of events matching the given parameters, newest first.
+
+        Keyword arguments can be passed as defined by:
+        https://stripe.com/docs/api/curl#list_events
+
+        @return - list of matching Event instances
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing Event instance failed
+        '''
+        return await self._req('get', '/events', params=kwds)
+
+    def iter_events(self, raw=False, **kwds):
+        '''
+        Iterate over all events matching the given parameters, newest first,
+        following pagination cursors as needed.
+
+        Keyword arguments can be passed as defined by:
+        https://stripe.com/docs/api/curl#list_events
+
+        @param raw  - yield decoded JSON instead of models
+        @return - async iterator of matching Event instances
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing Event instance failed
+        '''
+        return Pager(self, '/events', kwds, raw)
+
+    def tail_events(self, checkpoint=None, follow=False, poll_interval=5.0,
+                    batch_size=100, raw=False, **kwds):
+        '''
+        Iterate over events oldest first, starting after the event saved in
+        `checkpoint`.  The checkpoint is saved after each batch has been
+        consumed, so after a restart at most one batch is seen again.  With
+        no saved checkpoint, iteration starts at the most recent event.
+
+        Keyword arguments filter events as defined by:
+        https://stripe.com/docs/api/curl#list_events
+        e.g. types=['charge.succeeded', 'charge.refunded']
+
+        @param checkpoint       - Checkpoint holding the last event id
+                                  processed, defaults to a MemoryCheckpoint
+        @param follow           - keep polling for new events once caught
+                                  up instead of stopping
+        @param poll_interval    - seconds between polls when following
+        @param batch_size       - events requested per page, at most 100
+        @param raw              - yield decoded JSON instead of models
+        @return - async iterator of Event instances
+
+        @raises StripeError - Parsed errors from stripe, e.g. when the saved
+                              event is older than Stripe retains events
+        @raises ParseError  - Parsing Event instance failed
+        '''
+        return EventStream(
+                self,
+                MemoryCheckpoint() if checkpoint is None else checkpoint,
+                kwds,
+                batch_size,
+                follow,
+                poll_interval,
+                raw)
+
+    def bulk(self, calls, concurrency=10, ordered=True, buffer=None):
+        '''
+        Run many calls, e.g. create_refund or update_customer, with at most
+        `concurrency` of them in flight.  A failing call does not cancel the
+        others, its exception is reported in its BulkResult instead.  Use
+        the result as an async context manager so calls still in flight are
+        cancelled when iteration stops early, see Bulk.
+
+        @param calls        - iterable of callables taking no arguments and
+                              returning an awaitable, e.g.
+                              functools.partial(client.create_refund, id)
+        @param concurrency  - maximum number of calls in flight
+        @param ordered      - yield results in input order rather than
+                              completion order
+        @param buffer       - maximum number of completed results waiting to
+                              be yielded, defaults to 4 * concurrency
+        @return - Bulk, an async iterator of BulkResult instances
+        '''
+        return Bulk(calls, concurrency, ordered, buffer)
+
+    def map_concurrent(self, fn, items, concurrency=10, ordered=True,
+                       buffer=None):
+        '''
+        Call `fn` on each of `items` with at most `concurrency` calls in
+        flight, e.g. map_concurrent(client.retrieve_charge, charge_ids).
+        See bulk().
+
+        @param fn           - coroutine function taking a single argument
+        @param items        - iterable of arguments to `fn`
+        @param concurrency  - maximum number of calls in flight
+        @param ordered      - yield results in input order rather than
+                              completion order
+        @param buffer       - maximum number of completed results waiting to
+                              be yielded, defaults to 4 * concurrency
+        @return - Bulk, an async iterator of BulkResult instances
+        '''
+        return Bulk(
+                (functools.partial(fn, item) for item in items),
+                concurrency,
+                ordered,
+                buffer)
+
+    async def resolve(self, objs, fields=None, concurrency=10):
+        '''
+        Replace the ids held by expandable fields of `objs` with the objects
+        they refer to, without a request per object.  Ids are deduplicated
+        and fetched concurrently through retrieve_*, so the cache, if any, is
+        consulted first.  Only charge, customer and refund ids can be
+        resolved, other ids are left as is.
+
+        @param objs         - iterable of models, e.g. from list_charges
+        @param fields       - names of the fields to resolve, all expandable
+                              fields if None
+        @param concurrency  - maximum number of requests in flight
+        @return - list of new models with the ids replaced
+
+        @raises StripeError - Parsed errors from stripe
+        @raises ParseError  - Parsing an object failed
+        '''
+        objs = [
+            o.materialize() if isinstance(o, LazyModel) else o
+            for o in objs]
+
+        wanted = collections.OrderedDict()
+        for obj in objs:
+            for name in _resolvable_fields(type(obj), fields):
+                v = getattr(obj, name)
+                if isinstance(v, str) and v not in wanted:
+                    fetch = self._resolver(v)
+                    if fetch is not None:
+                        wanted[v] = fetch
+
+        ids = list(wanted)
+        resolved = {}
+        results = Bulk(
+                (functools.partial(wanted[i], i) for i in ids),
+                concurrency,
+                ordered=False)
+        try:
+            async for r in results:
+                if not r.ok:
+                    raise r.exception
+                resolved[ids[r.index]] = r.value
+        finally:
+            await results.aclose()
+
+        ret = []
+        for obj in objs:
+            changes = {}
+            for name in _resolvable_fields(type(obj), fields):
+                v = getattr(obj, name)
+                if isinstance(v, str) and v in resolved:
+                    changes[name] = resolved[v]
+            ret.append(attr.evolve(obj, **changes) if changes else obj)
+        return ret
+
+    def _resolver(self, obj_id):
+        for prefix, name in _id_prefixes:
+            if obj_id.startswith(prefix):
+                return getattr(self, name)
+        return None
+
+
+_id_prefixes = (
+    ('ch_', 'retrieve_charge'),
+    ('py_', 'retrieve_charge'),
+    ('cus_', 'retrieve_customer'),
+    ('re_', 'retrieve_refund'),
+    ('pyr_', 'retrieve_refund'),
+)
+
+
+def _resolvable_fields(cls, fields):
+    return [
+        f.name
+        for f in attr.fields(cls)
+        if f.metadata.get('expandable') and
+        (fields is None or f.name in fields)]
+
+
+class Pager(object):
+    '''
+    Async iterator over every object of a Stripe list endpoint.
+
+    Pages are requested through Client._req_raw and the cursor is taken from
+    the last (or, when paging backwards with ending_before, the first) object
+    of each page.  As soon as a page arrives the request for the following one
+    is started so that fetching overlaps with consumption.  Objects are only
+    converted to models as they are yielded.
+    '''
+    def __init__(self, client, page, params, raw=False):
+        '''
+        @param client   - Client used to issue requests
+        @param page     - list endpoint relative to base stripe API URL
+        @param params   - list parameters, e.g. limit, created
+        @param raw      - yield decoded JSON instead of models
+        '''
+        self._client = client
+        self._raw = raw
+        self._page = page
+        self._params = dict(params)
+        self._cursor = 'ending_before' if 'ending_before' in params \
+            else 'starting_after'
+        self._items = collections.deque()
+        self._next = None
+        self._started = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._items:
+            if self._next is None:
+                if self._started:
+                    raise StopAsyncIteration
+                self._started = True
+                self._fetch(self._params.get(self._cursor))
+
+            try:
+                body = await self._client._join(self._next)
+            finally:
+                self._next = None
+
+            data = body.get('data', [])
+            if body.get('has_more', False) and data:
+                last = data[0] if self._cursor == 'ending_before' else data[-1]
+                self._fetch(last['id'])
+            self._items.extend(data)
+
+        if self._raw:
+            return self._items.popleft()
+        return self._client._convert(self._items.popleft())
+
+    def _fetch(self, cursor):
+        params = dict(self._params)
+        if cursor is not None:
+            params[self._cursor] = cursor
+
+        self._next = self._client._spawn(
+                self._client._req_raw('get', self._page, params=params))
+
+    async def aclose(self):
+        '''
+        Stop iterating, cancelling any page request still in flight.
+        '''
+        self._started = True
+        self._items.clear()
+        if self._next is not None:
+            self._next.cancel()
+            try:
+                await self._next
+            except (asyncio.CancelledError, StripeException):
+                pass
+            self._next = None
+
+
+def _created_range(created, start, end):
+    '''
+    Narrow [start, end) to the creation times matched by a `created` list
+    filter.
+
+    @param created  - unix timestamp, or dictionary of gt, gte, lt and lte
+    @param start    - earliest creation time (inclusive)
+    @param end      - latest creation time (exclusive)
+    @return         - (start, end), empty if the two do not overlap
+
+    @raises ValueError if `created` is not a valid filter
+    '''
+    if isinstance(created, int) and not isinstance(created, bool):
+        return max(start, created), min(end, created + 1)
+
+    if not isinstance(created, dict) or \
+            not set(created) <= {'gt', 'gte', 'lt', 'lte'} or \
+            not all(isinstance(v, int) for v in created.values()):
+        raise ValueError('Invalid created filter: %r' % (created,))
+
+    if 'gt' in created:
+        start = max(start, created['gt'] + 1)
+    if 'gte' in created:
+        start = max(start, created['gte'])
+    if 'lt' in created:
+        end = min(end, created['lt'])
+    if 'lte' in created:
+        end = min(end, created['lte'] + 1)
+    return start, end
+
+
+class Backfill(object):
+    '''
+    Async iterator over every object of a Stripe list endpoint created within
+    a time range.
+
+    The range is split into created[gte]/created[lt] windows which are each
+    paged through by a task of their own.  At most `workers` windows are in
+    flight and a window is only started once it is within `workers` of the
+    window currently being yielded.  Each window hands its pages over through
+    a queue holding one page, so a window holds at most one page waiting and
+    one being fetched, and the window being yielded is consumed page by page
+    as it arrives.  Memory stays bounded by the number of workers and the
+    page size rather than the size of the range or of a window.
+    '''
+    def __init__(self, client, page, start, end, window, workers, params,
+                 raw=False):
+        '''
+        @param client   - Client used to issue requests
+        @param page     - list endpoint relative to base stripe API URL
+        @param start    - earliest creation time, unix timestamp (inclusive)
+        @param end      - latest creation time, unix timestamp (exclusive)
+        @param window   - length of each window in seconds
+        @param workers  - maximum number of windows fetched at once
+        @param params   - additional list parameters, a created filter
+                          narrows [start, end)
+        @param raw      - yield decoded JSON instead of models
+
+        @raises ValueError if created is not a valid filter
+        '''
+        if window <= 0:
+            raise ValueError('window must be positive')
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+
+        self._client = client
+        self._page = page
+        self._params = dict(params)
+        created = self._params.pop('created', None)
+        if created is not None:
+            start, end = _created_range(created, start, end)
+        self._workers = workers
+        self._raw = raw
+
+        # Newest window first to match Stripe's list ordering.
+        self._windows = collections.deque()
+        lt = end
+        while lt > start:
+            gte = max(start, lt - window)
+            self._windows.append((gte, lt))
+            lt = gte
+
+        # (task, queue of pages) of each window in flight, oldest first
+        self._tasks = collections.deque()
+        self._items = collections.deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._items:
+            self._schedule()
+            if not self._tasks:
+                raise StopAsyncIteration
+
+            try:
+                data = await self._next_page()
+            except BaseException:
+                await self.aclose()
+                raise
+            if data is None:
+                # The window is done, start the next one
+                self._tasks.popleft()
+                continue
+            self._items.extend(data)
+
+        if self._raw:
+            return self._items.popleft()
+        return self._client._convert(self._items.popleft())
+
+    async def _next_page(self):
+        '''
+        @return - next page of the oldest window in flight, None once it has
+                  none left
+
+        @raises the error the window failed with
+        '''
+        task, queue = self._tasks[0]
+        if not queue.empty():
+            return queue.get_nowait()
+
+        get = asyncio.ensure_future(queue.get())
+        try:
+            await asyncio.wait(
+                    (get, task), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not get.done():
+                get.cancel()
+        if get.done() and not get.cancelled():
+            return get.result()
+        # The window may have finished before the get was woken up
+        if not queue.empty():
+            return queue.get_nowait()
+
+        # The window stopped without handing over its end, e.g. it failed
+        await self._client._join(task)
+        return None
+
+    def _schedule(self):
+        while self._windows and len(self._tasks) < self._workers:
+            gte, lt = self._windows.popleft()
+            queue = asyncio.Queue(maxsize=1)
+            task = self._client._spawn(self._fetch(gte, lt, queue))
+            self._tasks.append((task, queue))
+
+    async def _fetch(self, gte, lt, queue):
+        '''
+        Page through one window, putting each page's objects in `queue`
+        followed by None.
+        '''
+        params = dict(self._params, created={'gte': gte, 'lt': lt})
+        while True:
+            body = await self._client._req_raw(
+                    'get', self._page, params=params)
+            data = body.get('data', [])
+            if data:
+                await queue.put(data)
+            if not body.get('has_more', False) or not data:
+                break
+            params['starting_after'] = data[-1]['id']
+        await queue.put(None)
+
+    async def aclose(self):
+        '''
+        Stop iterating, cancelling any windows still being fetched.
+        '''
+        self._windows.clear()
+        self._items.clear()
+        tasks = [task for task, _ in self._tasks]
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, StripeException):
+                pass
+
+
+class EventStream(object):
+    '''
+    Async iterator over /events, oldest first, from a checkpointed event id.
+
+    Stripe lists newest first, so each batch is requested with ending_before
+    set to the last event seen and reversed.  The cursor is only saved once
+    every event of a batch has been yielded, delivery is at least once.
+    '''
+    def __init__(self, client, checkpoint, params, batch_size, follow,
+                 poll_interval, raw=False):
+        '''
+        @param client           - Client used to issue requests
+        @param checkpoint       - Checkpoint holding the last event id
+        @param params           - additional list parameters, e.g. types
+        @param batch_size       - events requested per page
+        @param follow           - keep polling once caught up
+        @param poll_interval    - seconds between polls when following
+        @param raw              - yield decoded JSON instead of models
+        '''
+        if not 1 <= batch_size <= 100:
+            raise ValueError('batch_size must be between 1 and 100')
+
+        self._client = client
+        self._checkpoint = checkpoint
+        self._params = dict(params)
+        self._batch_size = batch_size
+        self._follow = follow
+        self._poll_interval = poll_interval
+        self._raw = raw
+
+        self._items = collections.deque()
+        self._started = False
+        self._caught_up = False
+        self._closed = False
+        self.cursor = None
+        self._unsaved = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._items:
+            if self._closed:
+                raise StopAsyncIteration
+
+            if self._unsaved is not None:
+                await self._checkpoint.save(self._unsaved)
+                self._unsaved = None
+
+            if not self._started:
+                self._started = True
+                self.cursor = await self._checkpoint.load()
+            elif self._caught_up:
+                if not self._follow:
+                    raise StopAsyncIteration
+                await asyncio.sleep(self._poll_interval)
+
+            await self._fetch()
+
+        if self._raw:
+            return self._items.popleft()
+        return self._client._convert(self._items.popleft())
+
+    async def _fetch(self):
+        if self.cursor is None:
+            # Nothing processed yet, start after the most recent event.
+            body = await self._client._req_raw(
+                    'get', '/events', params=dict(self._params, limit=1))
+            data = body.get('data', [])
+            if data:
+                self.cursor = data[0]['id']
+                await self._checkpoint.save(self.cursor)
+            self._caught_up = True
+            return
+
+        body = await self._client._req_raw(
+                'get',
+                '/events',
+                params=dict(
+                    self._params,
+                    limit=self._batch_size,
+                    ending_before=self.cursor))
+        data = body.get('data', [])
+        self._caught_up = not body.get('has_more', False)
+        if data:
+            self._items.extend(reversed(data))
+            self.cursor = self._unsaved = data[0]['id']
+
+    async def aclose(self):
+        '''
+        Stop iterating.  The checkpoint is not advanced past a batch that
+        was not fully consumed.
+        '''
+        self._closed = True
+        self._items.clear()
+        self._unsaved = None
 
 
 cls_map = {
@@ -505,29 +2019,214 @@ cls_map = {
     'customer': Customer,
     'card': Card,
     'refund': Refund,
+    'event': Event,
 }
 
 
+def compile_decoder(cls):
+    '''
+    Build a function turning a decoded Stripe object into an instance of the
+    attrs class `cls`.
+
+    Only fields tagged as expandable or nested in their attrs metadata can
+    hold Stripe objects and are only converted when they contain a list or
+    dictionary, everything else (e.g. metadata) is passed through untouched.
+    Instances are built from positional arguments, matching the keys of
+    decoded JSON against 30+ keyword parameters is the single most expensive
+    part of building a model.
+
+    @param cls  - model class
+    @return     - decoder taking a dictionary and returning a `cls` instance
+    '''
+    missing = object()
+    fields = attr.fields(cls)
+    allowed = frozenset(f.name for f in fields) | {'object'}
+    spec = tuple(
+        (f.name, missing if isinstance(f.default, attr.Factory) or
+            f.default is attr.NOTHING else f.default)
+        for f in fields)
+    factories = tuple(
+        (i, f.default.factory)
+        for i, f in enumerate(fields)
+        if isinstance(f.default, attr.Factory))
+    nested = tuple(
+        i
+        for i, f in enumerate(fields)
+        if f.metadata.get('expandable') or f.metadata.get('nested'))
+
+    def decode(resp):
+        get = resp.get
+        args = [get(name, default) for name, default in spec]
+
+        for i in nested:
+            v = args[i]
+            if v.__class__ is dict or v.__class__ is list:
+                args[i] = convert_json_response(v)
+
+        for i, factory in factories:
+            if args[i] is missing:
+                args[i] = factory()
+
+        if missing in args or not resp.keys() <= allowed:
+            # Let attrs raise its usual TypeError
+            kwds = resp.copy()
+            del kwds['object']
+            return cls(**kwds)
+
+        return cls(*args)
+
+    return decode
+
+
+_decoders = {}
+
+
 def convert_json_response(resp):
-    if isinstance(resp, list):
+    '''
+    Convert decoded JSON to models.  Objects whose type is in cls_map become
+    instances of its model and lists become Python lists, anything else,
+    e.g. an expanded balance_transaction, is returned unchanged as a
+    dictionary.
+
+    @param resp - decoded JSON
+    @return     - model, list or the value as given
+    '''
+    if isinstance(resp, dict):
+        obj = resp.get('object', '')
+        decode = _decoders.get(obj)
+        if decode is None and obj in cls_map:
+            decode = _decoders[obj] = compile_decoder(cls_map[obj])
+
+        if decode is not None:
+            return decode(resp)
+        elif obj == 'list':
+            return [convert_json_response(r) for r in resp['data']]
+    elif isinstance(resp, list):
         return [convert_json_response(r) for r in resp]
-    elif isinstance(resp, dict) and resp.get('object', '') in cls_map:
-        resp = resp.copy()
-        cls = cls_map[resp['object']]
-        del resp['object']
 
-        for k in (k for k, v in resp.items() if isinstance(v, (list, dict))):
-            resp[k] = convert_json_response(resp[k])
+    return resp
+
+
+class LazyModel(object):
+    '''
+    Read-only view of a decoded Stripe object standing in for its model.
+
+    Fields are read straight from the decoded JSON and nested Stripe objects
+    are only converted, to views themselves, the first time they are
+    accessed.  Views compare equal to the model they represent and
+    materialize() builds that model.  Subclasses are created per model by
+    compile_view().
+    '''
+    __slots__ = ('_resp', '_values')
+    model = None
+
+    def __init__(self, resp):
+        self._resp = resp
+        self._values = None
 
-        return cls(**resp)
-    elif isinstance(resp, dict) and resp.get('object', '') == 'list':
-        return [convert_json_response(r) for r in resp['data']]
+    def materialize(self):
+        '''
+        @return - the model instance this view represents
+        '''
+        return convert_json_response(self._resp)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyModel):
+            other = other.materialize()
+        return self.materialize() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.materialize())
+
+    def __repr__(self):
+        return '<%s id=%r>' % (self.__class__.__name__, self._resp.get('id'))
+
+
+def _view_property(field):
+    name = field.name
+    factory = None
+    default = field.default
+    if isinstance(default, attr.Factory):
+        factory = default.factory
+    nested = field.metadata.get('expandable') or field.metadata.get('nested')
+    converter = field.converter
+
+    def get(self):
+        values = self._values
+        if values is not None and name in values:
+            return values[name]
+
+        try:
+            v = self._resp[name]
+        except KeyError:
+            if factory is not None:
+                v = factory()
+            elif default is not attr.NOTHING:
+                return default
+            else:
+                raise ParseError('Stripe %s missing "%s"' % (
+                    self._resp.get('object'), name))
+        else:
+            if converter is not None:
+                v = converter(v)
+            elif not nested or (v.__class__ is not dict and
+                                v.__class__ is not list):
+                return v
+            else:
+                v = convert_lazy_response(v)
+
+        if values is None:
+            values = self._values = {}
+        values[name] = v
+        return v
+
+    return property(get)
+
+
+def compile_view(cls):
+    '''
+    Build the LazyModel subclass standing in for the attrs class `cls`.
+
+    @param cls  - model class
+    @return     - LazyModel subclass with a property per field of `cls`
+    '''
+    ns = {'__slots__': (), 'model': cls}
+    for field in attr.fields(cls):
+        ns[field.name] = _view_property(field)
+    return type('Lazy' + cls.__name__, (LazyModel,), ns)
+
+
+_views = {}
+
+
+def convert_lazy_response(resp):
+    '''
+    Like convert_json_response, but Stripe objects are wrapped in LazyModel
+    views rather than converted.
+    '''
+    if isinstance(resp, dict):
+        obj = resp.get('object', '')
+        view = _views.get(obj)
+        if view is None and obj in cls_map:
+            view = _views[obj] = compile_view(cls_map[obj])
+
+        if view is not None:
+            return view(resp)
+        elif obj == 'list':
+            return [convert_lazy_response(r) for r in resp['data']]
+    elif isinstance(resp, list):
+        return [convert_lazy_response(r) for r in resp]
 
     return resp
 
 
 def create_json_request(req):
-    if isinstance(req, tuple(cls_map.values())):
+    if isinstance(req, LazyModel):
+        return create_json_request(req.materialize())
+    elif isinstance(req, tuple(cls_map.values())):
         return create_json_request(attr.asdict(req))
     elif isinstance(req, dict):
         return {k: create_json_request(v) for k, v in req.items()}
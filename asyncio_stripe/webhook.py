@@ -0,0 +1,379 @@
+import asyncio
+import collections
+import hashlib
+import hmac
+import logging
+import time
+
+from aiohttp import web
+
+from .stripe import (
+    Event,
+    ParseError,
+    StripeException,
+    convert_json_response,
+    json_loads,
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class SignatureError(StripeException):
+    '''
+    A webhook payload did not carry a valid Stripe-Signature.
+    '''
+    pass
+
+
+def compute_signature(payload, secret, timestamp):
+    '''
+    @param payload      - raw request body, bytes
+    @param secret       - endpoint signing secret, whsec_...
+    @param timestamp    - unix time the payload was signed at
+    @return             - hex encoded HMAC-SHA256 Stripe signs with
+    '''
+    signed = ('%d.' % (timestamp,)).encode('ascii') + payload
+    return hmac.new(
+        secret.encode('utf-8'), signed, hashlib.sha256).hexdigest()
+
+
+def sign(payload, secret, timestamp=None):
+    '''
+    Build a Stripe-Signature header the way Stripe does, e.g. to test
+    webhook endpoints.
+
+    @param payload      - raw request body, bytes
+    @param secret       - endpoint signing secret
+    @param timestamp    - unix time to sign at, defaults to now
+    @return             - header value
+    '''
+    if timestamp is None:
+        timestamp = int(time.time())
+    return 't=%d,v1=%s' % (
+        timestamp, compute_signature(payload, secret, timestamp))
+
+
+def verify_signature(payload, header, secrets, tolerance=300, now=None):
+    '''
+    Check a Stripe-Signature header against the payload.  Signatures are
+    compared in constant time and the header may carry several, e.g. while
+    a secret is being rolled.
+
+    @param payload      - raw request body, bytes
+    @param header       - Stripe-Signature header value
+    @param secrets      - endpoint signing secret or list of secrets any of
+                          which may have signed the payload
+    @param tolerance    - seconds the signature timestamp may be away from
+                          now, protecting against replays.  None to skip
+                          the check.
+    @param now          - current unix time, defaults to time.time()
+    @return             - signature timestamp
+
+    @raises SignatureError if the header is malformed, stale or no
+            signature matches
+    '''
+    if isinstance(secrets, str):
+        secrets = [secrets]
+
+    timestamp = None
+    signatures = []
+    for item in (header or '').split(','):
+        key, _, value = item.strip().partition('=')
+        if key == 't':
+            try:
+                timestamp = int(value)
+            except ValueError:
+                raise SignatureError('Invalid timestamp in Stripe-Signature')
+        elif key == 'v1':
+            signatures.append(value)
+
+    if timestamp is None:
+        raise SignatureError('No timestamp in Stripe-Signature')
+    if not signatures:
+        raise SignatureError('No v1 signature in Stripe-Signature')
+
+    if tolerance is not None:
+        now = time.time() if now is None else now
+        if abs(now - timestamp) > tolerance:
+            raise SignatureError(
+                'Stripe-Signature timestamp outside the tolerance')
+
+    for secret in secrets:
+        expected = compute_signature(payload, secret, timestamp)
+        # Compare against every signature so timing does not reveal which
+        # one matched.
+        matched = False
+        for signature in signatures:
+            matched |= hmac.compare_digest(expected, signature)
+        if matched:
+            return timestamp
+
+    raise SignatureError('No matching signature in Stripe-Signature')
+
+
+def construct_event(payload, header, secrets, tolerance=300, loads=None):
+    '''
+    Verify and decode a webhook payload.
+
+    @param payload      - raw request body, bytes
+    @param header       - Stripe-Signature header value
+    @param secrets      - endpoint signing secret or list of secrets
+    @param tolerance    - see verify_signature()
+    @param loads        - callable decoding JSON, defaults to json_loads
+    @return             - Event with data.object converted to a model
+
+    @raises SignatureError if the signature does not verify
+    @raises ParseError if the payload is not a Stripe event
+    '''
+    verify_signature(payload, header, secrets, tolerance)
+
+    try:
+        event = convert_json_response((loads or json_loads)(payload))
+    except (ValueError, TypeError) as e:
+        raise ParseError('Invalid webhook payload: %s' % (e,))
+
+    if not isinstance(event, Event):
+        raise ParseError('Webhook payload is not an event')
+    return event
+
+
+class WebhookReceiver(object):
+    '''
+    aiohttp request handler for Stripe webhooks.
+
+    Requests are verified and decoded, then handled in one of two ways
+    depending on `ack`:
+
+        'received'  - the event is queued and acknowledged straight away so
+                      slow processing never makes Stripe time out and
+                      redeliver.  A fixed number of worker tasks take events
+                      off the bounded queue and pass them to `handler`.
+                      Stripe has already been told the event was received,
+                      so an event whose handler fails is dropped: it is
+                      logged and counted as failed but never redelivered.
+        'handled'   - `handler` runs before responding, at most `workers` at
+                      a time.  Stripe gets a 200 once it succeeded and a 500
+                      if it raised, and redelivers the event later.  The
+                      handler has to finish within Stripe's response
+                      timeout.
+
+    When `queue_size` events are already waiting the request is answered
+    with a 503 and Stripe retries it later, so a burst cannot exhaust
+    memory.
+
+    Workers are started with the first request or by start() and should be
+    stopped with stop(), attach() does both with the application.
+
+    With a DedupStore, events already received are acknowledged without
+    being handled again.  Events answered with a 5xx are released from the
+    store so Stripe's redelivery is handled.  Events whose handler failed
+    after being acknowledged are released as well, which only matters if
+    Stripe happens to deliver them again.
+    '''
+    def __init__(self, secrets, handler, workers=4, queue_size=1000,
+                 tolerance=300, loads=None, dedup=None, ack='received'):
+        '''
+        @param secrets      - endpoint signing secret or list of secrets
+        @param handler      - coroutine function called with each Event
+        @param workers      - number of worker tasks
+        @param queue_size   - maximum events waiting for a worker
+        @param tolerance    - see verify_signature()
+        @param loads        - callable decoding JSON, defaults to json_loads
+        @param dedup        - DedupStore to skip redelivered events, None to
+                              handle every delivery
+        @param ack          - 'received' to acknowledge events before they
+                              are handled, 'handled' to acknowledge them
+                              only once `handler` succeeded
+        '''
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        if ack not in ('received', 'handled'):
+            raise ValueError('Unknown ack mode: %s' % (ack,))
+
+        self._secrets = secrets
+        self._handler = handler
+        self._workers = workers
+        self._queue_size = queue_size
+        self._tolerance = tolerance
+        self._loads = loads
+        self._dedup = dedup
+        self._ack = ack
+
+        self._queue = None
+        self._tasks = []
+        # Requests handling their event in 'handled' mode
+        self._active = 0
+        self._semaphore = None
+        self.stats = collections.Counter()
+
+    async def __call__(self, request):
+        payload = await request.read()
+        try:
+            event = construct_event(
+                    payload,
+                    request.headers.get('Stripe-Signature'),
+                    self._secrets,
+                    self._tolerance,
+                    self._loads)
+        except SignatureError as e:
+            self.stats['rejected'] += 1
+            log.warning('Rejected webhook: %s', e)
+            return web.Response(status=400, text=str(e))
+        except ParseError as e:
+            self.stats['invalid'] += 1
+            log.warning('Invalid webhook: %s', e)
+            return web.Response(status=400, text=str(e))
+
+        if self._dedup is not None and not await self._dedup.claim(event.id):
+            self.stats['duplicate'] += 1
+            return web.Response(status=200)
+
+        if self._ack == 'handled':
+            return await self._handle_now(event)
+
+        self.start()
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            return await self._overflow(event)
+
+        self.stats['accepted'] += 1
+        return web.Response(status=200)
+
+    async def _overflow(self, event):
+        if self._dedup is not None:
+            await self._dedup.release(event.id)
+        self.stats['overflow'] += 1
+        log.warning('Webhook queue full, deferring %s', event.id)
+        return web.Response(status=503, text='Busy')
+
+    async def _handle_now(self, event):
+        if self._active >= self._workers + self._queue_size:
+            return await self._overflow(event)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._workers)
+
+        self.stats['accepted'] += 1
+        self._active += 1
+        try:
+            async with self._semaphore:
+                handled = await self._handle(event)
+        finally:
+            self._active -= 1
+
+        if not handled:
+            return web.Response(status=500, text='Handler failed')
+        return web.Response(status=200)
+
+    def start(self):
+        '''
+        Start the worker tasks, if not running yet.  There are none in
+        'handled' mode.
+        '''
+        if self._tasks or self._ack == 'handled':
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(self._queue_size)
+        self._tasks = [
+            asyncio.ensure_future(self._work())
+            for _ in range(self._workers)]
+
+    async def stop(self, timeout=None):
+        '''
+        Wait for queued events to be handled, then stop the workers.
+
+        @param timeout  - seconds to wait for the queue to drain before
+                          cancelling, None to wait indefinitely
+        '''
+        if not self._tasks:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning(
+                'Dropping %d queued webhook events', self._queue.qsize())
+
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def pending(self):
+        '''
+        @return - number of events waiting for a worker, or in 'handled'
+                  mode being handled or waiting to be
+        '''
+        if self._ack == 'handled':
+            return self._active
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def attach(self, app, path='/stripe/webhook'):
+        '''
+        Serve webhooks on `path` of `app`, starting and stopping the workers
+        with the application.
+
+        @param app  - web.Application
+        @param path - path Stripe is configured to post to
+        '''
+        async def on_startup(app):
+            self.start()
+
+        async def on_cleanup(app):
+            await self.stop()
+
+        app.router.add_post(path, self)
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+
+    async def _handle(self, event):
+        '''
+        Pass `event` to the handler, releasing it from the DedupStore if the
+        handler fails.
+
+        @return - True if the handler succeeded
+        '''
+        try:
+            await self._handler(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.stats['failed'] += 1
+            log.exception('Webhook handler failed on %s', event.id)
+            if self._dedup is not None:
+                try:
+                    await self._dedup.release(event.id)
+                except Exception:
+                    log.exception('Failed to release %s', event.id)
+            return False
+
+        self.stats['handled'] += 1
+        return True
+
+    async def _work(self):
+        while True:
+            event = await self._queue.get()
+            try:
+                await self._handle(event)
+            finally:
+                self._queue.task_done()
+
+
+def webhook_handler(secrets, handler, **kwds):
+    '''
+    Create an aiohttp handler receiving Stripe webhooks, see WebhookReceiver
+    for the keyword arguments.
+
+        receiver = webhook_handler('whsec_...', on_event)
+        receiver.attach(app, '/stripe/webhook')
+
+    @param secrets  - endpoint signing secret or list of secrets
+    @param handler  - coroutine function called with each Event
+    @return         - WebhookReceiver
+    '''
+    return WebhookReceiver(secrets, handler, **kwds)
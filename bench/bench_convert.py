@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+'''
+Compare the compiled convert_json_response against the original
+copy-and-walk implementation on a single charge and a 100 charge list page,
+and against lazy views when only a few fields are read.
+
+    python bench/bench_convert.py
+'''
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio_stripe.fixtures as fixtures  # noqa: E402
+import asyncio_stripe.stripe as stripe  # noqa: E402
+
+
+def legacy_convert_json_response(resp):
+    '''
+    convert_json_response as of 0.2.1, kept as the baseline.
+    '''
+    if isinstance(resp, list):
+        return [legacy_convert_json_response(r) for r in resp]
+    elif isinstance(resp, dict) and resp.get('object', '') in stripe.cls_map:
+        resp = resp.copy()
+        cls = stripe.cls_map[resp['object']]
+        del resp['object']
+
+        for k in (k for k, v in resp.items() if isinstance(v, (list, dict))):
+            resp[k] = legacy_convert_json_response(resp[k])
+
+        return cls(**resp)
+    elif isinstance(resp, dict) and resp.get('object', '') == 'list':
+        return [legacy_convert_json_response(r) for r in resp['data']]
+
+    return resp
+
+
+def charge_page(count=100):
+    '''
+    @return - decoded list page holding `count` charges
+    '''
+    page = fixtures.as_response([
+        fixtures.charge
+        for _ in range(count)])
+    # Decode from JSON so no objects are shared between rows
+    return json.loads(json.dumps(page))
+
+
+def bench(fn, arg, number):
+    '''
+    @return - best time per call in microseconds
+    '''
+    times = timeit.repeat(lambda: fn(arg), number=number, repeat=5)
+    return min(times) / number * 1e6
+
+
+def main():
+    single = json.loads(json.dumps(fixtures.as_response(fixtures.charge)))
+    page = charge_page()
+
+    assert stripe.convert_json_response(page) == \
+        legacy_convert_json_response(page)
+
+    for name, arg, number in (
+            ('charge', single, 2000),
+            ('charge list page (100)', page, 20)):
+        legacy = bench(legacy_convert_json_response, arg, number)
+        compiled = bench(stripe.convert_json_response, arg, number)
+        print('%-24s legacy %9.1fus  compiled %9.1fus  speedup %.2fx' % (
+            name, legacy, compiled, legacy / compiled))
+
+    def lazy_read(page):
+        for c in stripe.convert_lazy_response(page):
+            c.id, c.amount, c.status, c.customer
+
+    lazy = bench(lazy_read, page, 20)
+    compiled = bench(stripe.convert_json_response, page, 20)
+    print('%-24s compiled %7.1fus  lazy %13.1fus  speedup %.2fx' % (
+        'lazy page, 4 fields', compiled, lazy, compiled / lazy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+'''
+Compare decoding a 100 charge list page the way Client used to, with
+aiohttp's ClientResponse.json() (charset lookup, strip, text decode, then
+json.loads), against reading the raw body once with read() and handing it
+to the loads callables Client can use.
+
+Both are timed on the same real response, fetched once from a local server,
+so the network and the body read itself are left out and only the decoding
+differs.
+
+    python bench/bench_loads.py
+'''
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio_stripe.fixtures as fixtures  # noqa: E402
+import asyncio_stripe.stripe as stripe  # noqa: E402
+
+
+async def serve(body):
+    '''
+    @return - (AppRunner, URL of a page returning `body` as Stripe does)
+    '''
+    async def page(request):
+        return web.Response(body=body, content_type='application/json')
+
+    app = web.Application()
+    app.router.add_get('/v1/charges', page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, 'http://%s:%d/v1/charges' % (host, port)
+
+
+async def bench(decode, number, repeat=5):
+    '''
+    @return - best time per call of the coroutine function `decode` in
+              microseconds
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            await decode()
+        times.append(time.perf_counter() - start)
+    return min(times) / number * 1e6
+
+
+async def run():
+    page = fixtures.as_response([fixtures.charge for _ in range(100)])
+    body = json.dumps(page).encode('utf-8')
+
+    runner, url = await serve(body)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as r:
+                await r.read()
+
+                def read_loads(loads):
+                    async def decode():
+                        return loads(await r.read())
+                    return decode
+
+                decoders = [
+                    ('ClientResponse.json', r.json),
+                    ('read + json_loads', read_loads(stripe.json_loads))]
+                if stripe.orjson is not None:
+                    decoders.append(
+                        ('read + orjson.loads',
+                         read_loads(stripe.orjson.loads)))
+
+                baseline = None
+                for name, decode in decoders:
+                    assert await decode() == page
+                    t = await bench(decode, 50)
+                    baseline = baseline or t
+                    print('%-22s %9.1fus  speedup %.2fx' % (
+                        name, t, baseline / t))
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
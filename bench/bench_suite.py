@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+'''
+Offline micro-benchmarks of the parse and encode hot paths, with results
+that can be saved as JSON and compared against a previous run to catch
+regressions between releases.
+
+    python bench/bench_suite.py
+    python bench/bench_suite.py --json baseline.json
+    python bench/bench_suite.py --compare baseline.json --tolerance 0.2
+
+Timings are the best of several repeats, in microseconds per call.  Memory
+is what tracemalloc sees retained per model decoded from a response body,
+including nested sources, metadata and the strings the model refers to.
+'''
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio_stripe.columnar as columnar  # noqa: E402
+import asyncio_stripe.fixtures as fixtures  # noqa: E402
+import asyncio_stripe.stripe as stripe  # noqa: E402
+
+
+class FakeResponse(object):
+    '''
+    Just enough of aiohttp.ClientResponse for StripeError.
+    '''
+    status = 402
+
+
+error_body = {
+    'error': {
+        'type': 'card_error',
+        'charge': 'ch_19t4yv2eZvKYlo2CpTQShodI',
+        'message': 'Your card was declined.',
+        'code': 'card_declined',
+        'decline_code': 'insufficient_funds',
+    },
+}
+
+charge_params = {
+    'amount': 999,
+    'currency': 'usd',
+    'customer': 'cus_AE0KH4CnjT0QSg',
+    'description': 'Bench charge',
+    'capture': False,
+    'metadata': {'order_id': '6735', 'sku': 'sku_1'},
+    'shipping': {
+        'name': 'Jenny Rosen',
+        'address': {'line1': '1234 Main Street', 'city': 'San Francisco'},
+    },
+    'expand': ['customer', 'balance_transaction'],
+}
+
+
+def decoded(obj):
+    '''
+    @return - Stripe JSON for `obj` as decoded from a response, sharing no
+              objects with the fixtures
+    '''
+    return json.loads(json.dumps(fixtures.as_response(obj)))
+
+
+def timed(fn, number, repeat=5):
+    '''
+    @return - best time per call in microseconds
+    '''
+    times = timeit.repeat(fn, number=number, repeat=repeat)
+    return min(times) / number * 1e6
+
+
+def memory_per_instance(make, count=1000):
+    '''
+    @return - bytes allocated per instance returned by `make`
+    '''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        keep = [make() for _ in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del keep
+    return (after - before) / count
+
+
+def memory_per_row(append, count=1000, **kwds):
+    '''
+    @return - bytes allocated per row added to a ChargeBatch by `append`
+    '''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        batch = columnar.ChargeBatch(**kwds)
+        for _ in range(count):
+            append(batch)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del batch
+    return (after - before) / count
+
+
+def run():
+    '''
+    @return - dictionary of benchmark name to {'value': .., 'unit': ..}
+    '''
+    charge = decoded(fixtures.charge)
+    customer = decoded(fixtures.customer)
+    page = decoded([fixtures.charge for _ in range(100)])
+    charges = stripe.convert_json_response(page)
+    resp = FakeResponse()
+
+    results = {}
+
+    def add(name, value, unit):
+        results[name] = {'value': value, 'unit': unit}
+
+    add('convert_charge',
+        timed(lambda: stripe.convert_json_response(charge), 2000), 'us')
+    add('convert_customer',
+        timed(lambda: stripe.convert_json_response(customer), 2000), 'us')
+    add('convert_charge_page_100',
+        timed(lambda: stripe.convert_json_response(page), 20), 'us')
+    add('convert_lazy_charge_page_100',
+        timed(lambda: stripe.convert_lazy_response(page), 200), 'us')
+    add('create_json_request_charge_page_100',
+        timed(lambda: stripe.create_json_request(charges), 20), 'us')
+    add('round_trip_charge_page_100',
+        timed(lambda: stripe.convert_json_response(
+            stripe.create_json_request(stripe.convert_json_response(page))),
+            10), 'us')
+    add('encode_params_charge',
+        timed(lambda: stripe.encode_params(charge_params), 5000), 'us')
+    add('form_encode_charge',
+        timed(lambda: stripe.form_encode(
+            stripe.encode_params(charge_params)), 5000), 'us')
+    add('stripe_error',
+        timed(lambda: stripe.StripeError(resp, error_body), 5000), 'us')
+
+    add('memory_charge',
+        memory_per_instance(lambda: stripe.convert_json_response(
+            decoded(fixtures.charge))),
+        'bytes')
+    add('memory_charge_batch_row',
+        memory_per_row(lambda batch: batch.append_json(
+            decoded(fixtures.charge))),
+        'bytes')
+    add('memory_charge_batch_row_no_source',
+        memory_per_row(lambda batch: batch.append_json(
+            decoded(fixtures.charge)), drop=('source', 'outcome')),
+        'bytes')
+    add('memory_customer',
+        memory_per_instance(lambda: stripe.convert_json_response(
+            decoded(fixtures.customer))),
+        'bytes')
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Print how each result changed relative to `baseline`.
+
+    @return - names of benchmarks more than `tolerance` (a fraction) slower
+              or larger than in the baseline
+    '''
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['value']
+        new = results[name]['value']
+        change = (new - old) / old if old else 0.0
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-40s %12.1f -> %12.1f %-5s %+7.1f%%%s' % (
+            name, old, new, results[name]['unit'], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--json', metavar='FILE', help='write the results to FILE')
+    parser.add_argument(
+        '--compare', metavar='FILE',
+        help='compare against results previously written with --json')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='fraction a result may grow before it counts as a regression')
+    parser.add_argument(
+        '--label', default='', help='free form label stored with the results')
+    args = parser.parse_args()
+
+    results = run()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+    else:
+        regressions = []
+        for name in sorted(results):
+            print('%-40s %12.1f %s' % (
+                name, results[name]['value'], results[name]['unit']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'label': args.label,
+                'date': datetime.datetime.utcnow().isoformat() + 'Z',
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'orjson': stripe.orjson is not None,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print('Regressions: %s' % (', '.join(regressions),))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
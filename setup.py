@@ -27,6 +27,9 @@ setuptools.setup(
           ('share/asyncio_stripe/', ['README.rst', 'LICENSE']),
         ],
         install_requires=['aiohttp', 'attrs'],
+        extras_require={
+            'orjson': ['orjson'],
+        },
         classifiers=[
             'Development Status :: 4 - Beta',
             'Framework :: AsyncIO',
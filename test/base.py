@@ -70,3 +70,5 @@ def mkfuture(ret, return_from=None):
     if return_from is not None:
         assert isinstance(return_from, unittest.mock.Mock)
         return_from.return_value = f
+
+    return f
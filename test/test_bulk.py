@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import sys
+import unittest
+
+import base
+
+import asyncio_stripe.bulk as bulk
+
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._running = 0
+        self._max_running = 0
+        self._started = 0
+
+    def tearDown(self):
+        self._loop.close()
+
+    async def _call(self, value, delay=0):
+        self._started += 1
+        self._running += 1
+        self._max_running = max(self._max_running, self._running)
+        try:
+            await asyncio.sleep(delay)
+            if isinstance(value, Exception):
+                raise value
+            return value
+        finally:
+            self._running -= 1
+
+    def _collect(self, it):
+        async def collect():
+            ret = []
+            async for r in it:
+                ret.append(r)
+            return ret
+        return base.run_until(collect())
+
+    def test_ordered(self):
+        delays = [0.03, 0.01, 0.02, 0, 0.01, 0]
+        calls = (
+            (lambda i=i, d=d: self._call(i, d))
+            for i, d in enumerate(delays))
+
+        r = self._collect(bulk.Bulk(calls, concurrency=2))
+        self.assertEqual([x.index for x in r], list(range(6)))
+        self.assertEqual([x.value for x in r], list(range(6)))
+        self.assertTrue(all(x.ok for x in r))
+        self.assertEqual(self._max_running, 2)
+
+    def test_ordered_slow_head(self):
+        delays = [0.1] + [0.01] * 7
+        calls = (
+            (lambda i=i, d=d: self._call(i, d))
+            for i, d in enumerate(delays))
+
+        async def first():
+            async with bulk.Bulk(calls, concurrency=2) as results:
+                r = await results.__anext__()
+                return r.index, self._started, [x.index async for x in results]
+
+        # The other calls keep running behind the slow first one
+        index, started, rest = base.run_until(first())
+        self.assertEqual(index, 0)
+        self.assertEqual(started, 8)
+        self.assertEqual(rest, list(range(1, 8)))
+        self.assertEqual(self._max_running, 2)
+
+    def test_buffer(self):
+        delays = [0.05] + [0] * 7
+        calls = (
+            (lambda i=i, d=d: self._call(i, d))
+            for i, d in enumerate(delays))
+
+        async def first():
+            results = bulk.Bulk(calls, concurrency=2, buffer=3)
+            results._schedule()
+            await asyncio.sleep(0.02)
+            started = self._started
+            return started, [x.index async for x in results]
+
+        # Calls stop once the results waiting behind the first fill the buffer
+        started, r = base.run_until(first())
+        self.assertEqual(started, 3)
+        self.assertEqual(r, list(range(8)))
+
+        with self.assertRaises(ValueError):
+            bulk.Bulk([], buffer=0)
+
+    def test_abandoned(self):
+        calls = [lambda: self._call(0)] + [lambda: self._call(1, 10)] * 4
+
+        async def first():
+            async with bulk.Bulk(calls, concurrency=3) as results:
+                async for r in results:
+                    break
+            return r.value
+
+        self.assertEqual(base.run_until(first()), 0)
+        # The three calls in flight are cancelled on leaving the block, the
+        # last one never starts
+        self.assertEqual(self._running, 0)
+        self.assertEqual(self._started, 4)
+
+    def test_consumer_cancelled(self):
+        calls = [lambda: self._call(1, 10)] * 3
+
+        async def consume():
+            results = bulk.Bulk(calls, concurrency=2)
+            task = asyncio.ensure_future(results.__anext__())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return results
+
+        results = base.run_until(consume())
+        self.assertEqual(self._running, 0)
+        self.assertEqual(self._started, 2)
+        with self.assertRaises(StopAsyncIteration):
+            base.run_until(results.__anext__())
+
+    def test_unordered(self):
+        delays = [0.05, 0, 0, 0]
+        calls = (
+            (lambda i=i, d=d: self._call(i, d))
+            for i, d in enumerate(delays))
+
+        r = self._collect(bulk.Bulk(calls, concurrency=2, ordered=False))
+        self.assertEqual(sorted(x.index for x in r), list(range(4)))
+        self.assertEqual(r[-1].index, 0)
+        self.assertEqual(self._max_running, 2)
+
+    def test_failures_reported(self):
+        error = ValueError('boom')
+        calls = [
+            lambda: self._call(1),
+            lambda: self._call(error),
+            lambda: self._call(3)]
+
+        r = self._collect(bulk.Bulk(calls, concurrency=3))
+        self.assertEqual([x.ok for x in r], [True, False, True])
+        self.assertIs(r[1].exception, error)
+        self.assertEqual(r[2].value, 3)
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import logging
+import sys
+import unittest
+import unittest.mock
+
+import attr
+
+import base
+
+import asyncio_stripe.cache as cache
+
+
+@attr.s(frozen=True)
+class Obj(object):
+    id = attr.ib()
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self._now = 1000.0
+        patcher = unittest.mock.patch(
+                'asyncio_stripe.cache.time.monotonic',
+                side_effect=lambda: self._now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hit_and_miss(self):
+        c = cache.ResponseCache()
+        self.assertIsNone(c.get('charge', 'ch_1'))
+        c.put('charge', Obj('ch_1'))
+        self.assertEqual(c.get('charge', 'ch_1'), Obj('ch_1'))
+        self.assertIsNone(c.get('customer', 'ch_1'))
+        self.assertEqual(c.stats(), {'size': 1, 'hits': 1, 'misses': 2, 'evictions': 0})
+
+    def test_ttl(self):
+        c = cache.ResponseCache(ttl={'customer': 60}, default_ttl=10)
+        c.put('charge', Obj('ch_1'))
+        c.put('customer', Obj('cus_1'))
+
+        self._now += 11
+        self.assertIsNone(c.get('charge', 'ch_1'))
+        self.assertEqual(c.get('customer', 'cus_1'), Obj('cus_1'))
+        self.assertEqual(len(c), 1)
+
+        self._now += 50
+        self.assertIsNone(c.get('customer', 'cus_1'))
+        self.assertEqual(len(c), 0)
+
+    def test_lru_eviction(self):
+        c = cache.ResponseCache(maxsize=2)
+        c.put('charge', Obj('ch_1'))
+        c.put('charge', Obj('ch_2'))
+        c.get('charge', 'ch_1')
+        c.put('charge', Obj('ch_3'))
+
+        self.assertIsNone(c.get('charge', 'ch_2'))
+        self.assertIsNotNone(c.get('charge', 'ch_1'))
+        self.assertIsNotNone(c.get('charge', 'ch_3'))
+        self.assertEqual(c.evictions, 1)
+
+    def test_invalidate(self):
+        c = cache.ResponseCache()
+        c.put('charge', Obj('ch_1'))
+        c.invalidate('charge', 'ch_1')
+        c.invalidate('charge', 'ch_2')
+        self.assertIsNone(c.get('charge', 'ch_1'))
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
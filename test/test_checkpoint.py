@@ -0,0 +1,46 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+import base
+
+import asyncio_stripe.checkpoint as checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+    def tearDown(self):
+        self._loop.close()
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'events.json')
+            cp = checkpoint.FileCheckpoint(path)
+            self.assertIsNone(base.run_until(cp.load()))
+
+            base.run_until(cp.save('evt_1'))
+            base.run_until(cp.save({'cursor': 'evt_2', 'created': 1000}))
+            self.assertEqual(
+                base.run_until(checkpoint.FileCheckpoint(path).load()),
+                {'cursor': 'evt_2', 'created': 1000})
+            self.assertEqual(os.listdir(tmp), ['events.json'])
+
+    def test_memory(self):
+        cp = checkpoint.MemoryCheckpoint('evt_1')
+        self.assertEqual(base.run_until(cp.load()), 'evt_1')
+        base.run_until(cp.save('evt_2'))
+        self.assertEqual(cp.value, 'evt_2')
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
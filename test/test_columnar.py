@@ -0,0 +1,198 @@
+import array
+import asyncio
+import json
+import logging
+import sys
+import tracemalloc
+import unittest
+import unittest.mock
+
+import aiohttp
+import attr
+
+import base
+
+import asyncio_stripe.columnar as columnar
+import asyncio_stripe.fixtures as fixtures
+import asyncio_stripe.stripe as stripe
+
+from test_stripe import mkresp
+
+
+def charge_json(**kwds):
+    return json.loads(json.dumps(fixtures.as_response(
+        attr.evolve(fixtures.charge, **kwds))))
+
+
+class TestColumns(unittest.TestCase):
+    def test_dict_column(self):
+        c = columnar.DictColumn()
+        for v in ('usd', 'eur', 'usd', None):
+            c.append(v)
+        self.assertEqual(c.values, ['usd', 'eur', None])
+        self.assertEqual(list(c.codes), [0, 1, 0, 2])
+        self.assertEqual([c[i] for i in range(len(c))], ['usd', 'eur', 'usd', None])
+
+        for i in range(70000):
+            c.append(i)
+        self.assertEqual(c.codes.typecode, 'I')
+        self.assertEqual(c[-1], 69999)
+        self.assertEqual(c[0], 'usd')
+
+    def test_sparse_column(self):
+        c = columnar.SparseColumn(dict)
+        for v in ({}, {'a': 1}, None, {}):
+            c.append(v)
+        self.assertEqual(len(c), 4)
+        self.assertEqual(c.values, {1: {'a': 1}, 2: None})
+        self.assertEqual([c[i] for i in range(4)], [{}, {'a': 1}, None, {}])
+        self.assertEqual(c[-1], {})
+        with self.assertRaises(IndexError):
+            c[4]
+
+    def test_struct_column(self):
+        c = columnar.StructColumn(('type', 'rule'))
+        for v in ({'type': 'authorized'}, None, {'type': 'authorized', 'rule': 'r_1'},
+                  {'rule': {'id': 'r_1'}}, {'other': 1}):
+            c.append(v)
+        self.assertEqual(c.columns['type'].values[0], 'authorized')
+        self.assertEqual(set(c.other), {1, 3, 4})
+        self.assertEqual(
+            [c[i] for i in range(len(c))],
+            [{'type': 'authorized'}, None, {'type': 'authorized', 'rule': 'r_1'},
+             {'rule': {'id': 'r_1'}}, {'other': 1}])
+        self.assertEqual(c[-1], {'other': 1})
+        with self.assertRaises(IndexError):
+            c[5]
+
+    def test_batch_column(self):
+        c = columnar.BatchColumn(columnar.CardBatch)
+        bank = {'object': 'bank_account', 'id': 'ba_1'}
+        c.append(json.loads(json.dumps(fixtures.as_response(fixtures.card_source))))
+        c.append(None)
+        c.append(fixtures.card_source)
+        c.append(bank)
+        self.assertEqual(len(c.batch), 2)
+        self.assertEqual(list(c.rows), [0, -1, 1, -1])
+        self.assertEqual([c[i] for i in range(3)], [fixtures.card_source, None, fixtures.card_source])
+        self.assertEqual(c[-1], stripe.convert_json_response(bank))
+
+
+class TestChargeBatch(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+    def tearDown(self):
+        self._loop.close()
+
+    def test_rows(self):
+        batch = columnar.ChargeBatch()
+        charges = [
+            fixtures.charge,
+            attr.evolve(
+                fixtures.charge, id='ch_2', amount=5, currency='eur',
+                status='failed', failure_code='card_declined', paid=False,
+                metadata={}, refunds=[fixtures.refund], transfer='tr_1'),
+        ]
+        batch.append_json(charge_json())
+        batch.extend([fixtures.as_response(charges[1]), charges[0]])
+
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(list(batch), [charges[0], charges[1], charges[0]])
+        self.assertEqual(batch[-2], charges[1])
+        self.assertEqual(batch[1:], [charges[1], charges[0]])
+        self.assertIsInstance(batch[1].refunds[0], stripe.Refund)
+        self.assertIsInstance(batch[0].source, stripe.Card)
+
+        self.assertEqual(batch.column('amount'), array.array('q', [999, 5, 999]))
+        self.assertEqual(batch.column('currency').values, ['usd', 'eur'])
+        self.assertEqual(list(batch.column('currency').codes), [0, 1, 0])
+        self.assertEqual(batch.column('paid'), array.array('b', [1, 0, 1]))
+        self.assertGreater(batch.nbytes(), 0)
+
+        with self.assertRaises(ValueError):
+            batch.append_json(fixtures.as_response(fixtures.refund))
+
+    def test_memory(self):
+        pages = [charge_json(id='ch_%d' % (i,)) for i in range(1000)]
+
+        def per_row(make):
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                keep = make(json.loads(json.dumps(pages)))
+                after = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            del keep
+            return (after - before) / len(pages)
+
+        def fill(objs):
+            batch = columnar.ChargeBatch()
+            batch.extend(objs)
+            return batch
+
+        def convert(objs):
+            return [stripe.convert_json_response(o) for o in objs]
+
+        batch_row = per_row(fill)
+        charge_row = per_row(convert)
+        # Sources and outcomes cost a few bytes per row, not an object
+        self.assertLess(batch_row, 1200)
+        self.assertLess(batch_row * 2.5, charge_row)
+
+    def test_drop(self):
+        batch = columnar.ChargeBatch(drop=('source', 'outcome'))
+        batch.append_json(charge_json())
+        self.assertEqual(batch[0], attr.evolve(fixtures.charge, source=None, outcome=None))
+        with self.assertRaises(KeyError):
+            batch.column('source')
+
+        for drop in (('bogus',), ('id',)):
+            with self.assertRaises(ValueError):
+                columnar.ChargeBatch(drop=drop)
+
+    def test_client(self):
+        session = unittest.mock.MagicMock(spec=aiohttp.ClientSession)
+        client = stripe.Client(session, 'sekret_key')
+        session.request.side_effect = [
+            mkresp({'object': 'list', 'has_more': True, 'data': [
+                charge_json(id='ch_1'), charge_json(id='ch_2')]}),
+            mkresp({'object': 'list', 'has_more': False, 'data': [
+                charge_json(id='ch_3')]}),
+        ]
+
+        # Pages are not converted to models
+        client._convert = unittest.mock.Mock(side_effect=AssertionError)
+        batch = base.run_until(client.charge_batch(limit=2, drop=('source',)))
+
+        self.assertEqual(batch.column('id'), ['ch_1', 'ch_2', 'ch_3'])
+        self.assertEqual(batch[2].amount, 999)
+        calls = session.request.call_args_list
+        self.assertEqual(calls[1][1]['params'], [('limit', '2'), ('starting_after', 'ch_2')])
+
+    def test_fill_raw(self):
+        session = unittest.mock.MagicMock(spec=aiohttp.ClientSession)
+        client = stripe.Client(session, 'sekret_key')
+        session.request.side_effect = [
+            mkresp({'object': 'list', 'has_more': False, 'data': [
+                charge_json(id='ch_1'), charge_json(id='ch_2')]}),
+        ]
+
+        client._convert = unittest.mock.Mock(side_effect=AssertionError)
+        batch = base.run_until(columnar.ChargeBatch().fill(
+            client.iter_charges(raw=True, limit=2)))
+
+        self.assertEqual(batch.column('id'), ['ch_1', 'ch_2'])
+        # raw is not sent to Stripe
+        args, kwds = session.request.call_args
+        self.assertEqual(kwds['params'], [('limit', '2')])
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
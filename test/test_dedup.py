@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import base
+
+import asyncio_stripe.dedup as dedup
+
+
+class TestMemoryDedupStore(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._now = 1000.0
+        patcher = unittest.mock.patch(
+                'asyncio_stripe.dedup.time.monotonic',
+                side_effect=lambda: self._now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._loop.close()
+
+    def test_claim(self):
+        store = dedup.MemoryDedupStore(ttl=10)
+        self.assertTrue(base.run_until(store.claim('evt_1')))
+        self.assertFalse(base.run_until(store.claim('evt_1')))
+        self.assertTrue(base.run_until(store.claim('evt_2')))
+
+        base.run_until(store.release('evt_1'))
+        self.assertTrue(base.run_until(store.claim('evt_1')))
+
+    def test_ttl(self):
+        store = dedup.MemoryDedupStore(ttl=10)
+        base.run_until(store.claim('evt_1'))
+        self._now += 5
+        base.run_until(store.claim('evt_2'))
+        self._now += 6
+        self.assertTrue(base.run_until(store.claim('evt_1')))
+        self.assertFalse(base.run_until(store.claim('evt_2')))
+        self.assertEqual(len(store), 2)
+
+    def test_maxsize(self):
+        store = dedup.MemoryDedupStore(maxsize=2)
+        for event_id in ('evt_1', 'evt_2', 'evt_3'):
+            base.run_until(store.claim(event_id))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.evictions, 1)
+        self.assertTrue(base.run_until(store.claim('evt_1')))
+
+        with self.assertRaises(ValueError):
+            dedup.MemoryDedupStore(maxsize=0)
+
+    def test_lru(self):
+        store = dedup.MemoryDedupStore(maxsize=2, ttl=10)
+        base.run_until(store.claim('evt_1'))
+        base.run_until(store.claim('evt_2'))
+        # A redelivery makes evt_1 the most recently seen
+        self._now += 6
+        self.assertFalse(base.run_until(store.claim('evt_1')))
+        base.run_until(store.claim('evt_3'))
+        self.assertEqual(list(store._entries), ['evt_1', 'evt_3'])
+        self.assertFalse(base.run_until(store.claim('evt_1')))
+
+        # and remembered for another ttl from then
+        self._now += 9
+        self.assertFalse(base.run_until(store.claim('evt_1')))
+        self._now += 11
+        self.assertTrue(base.run_until(store.claim('evt_1')))
+
+
+class TestSQLiteDedupStore(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        fd, self._path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self._stores = []
+
+    def tearDown(self):
+        for store in self._stores:
+            base.run_until(store.close())
+        self._loop.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self._path + suffix):
+                os.unlink(self._path + suffix)
+
+    def store(self, **kwds):
+        store = dedup.SQLiteDedupStore(self._path, **kwds)
+        self._stores.append(store)
+        return store
+
+    def test_shared(self):
+        first, second = self.store(), self.store()
+
+        async def go():
+            return [
+                await first.claim('evt_1'),
+                await second.claim('evt_1'),
+                await second.claim('evt_2'),
+                await first.release('evt_1'),
+                await second.claim('evt_1'),
+            ]
+
+        self.assertEqual(base.run_until(go()), [True, False, True, None, True])
+
+    def test_ttl(self):
+        store = self.store(ttl=10, purge_every=4)
+        now = [1000.0]
+
+        async def claim(event_id):
+            with unittest.mock.patch(
+                    'asyncio_stripe.dedup.time.time', return_value=now[0]):
+                return await store.claim(event_id)
+
+        async def count():
+            return await store._run(lambda: store._connect().execute(
+                'SELECT COUNT(*) FROM webhook_events').fetchone()[0])
+
+        async def go():
+            ret = [await claim('evt_1'), await claim('evt_2')]
+            now[0] += 11
+            ret.append(await claim('evt_1'))
+            ret.append(await count())
+            # Fourth claim purges evt_2
+            ret.append(await claim('evt_3'))
+            ret.append(await count())
+            return ret
+
+        self.assertEqual(base.run_until(go()), [True, True, True, 2, True, 2])
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
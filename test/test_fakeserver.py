@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import sys
+import unittest
+
+import aiohttp
+
+import base
+
+import asyncio_stripe.fakeserver as fakeserver
+import asyncio_stripe.fixtures as fixtures
+import asyncio_stripe.loadtest as loadtest
+import asyncio_stripe.stripe as stripe
+
+
+class TestFakeStripe(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = fakeserver.FakeStripe(seed=1)
+        url = base.run_until(self._server.start())
+        self._stripe = stripe.Client(
+            None, 'sk_test', url=url,
+            retry=stripe.RetryPolicy(max_retries=0))
+
+    def tearDown(self):
+        base.run_until(self._stripe.close())
+        base.run_until(self._server.stop())
+        self._loop.close()
+
+    def test_parse_form(self):
+        pairs = stripe.encode_params({
+            'amount': 100,
+            'metadata': {'a': '1', 'b': None},
+            'expand': ['customer', 'invoice'],
+            'shipping': {'address': {'city': 'Town'}},
+        })
+        self.assertEqual(fakeserver.parse_form(pairs), {
+            'amount': '100',
+            'metadata': {'a': '1', 'b': None},
+            'expand': ['customer', 'invoice'],
+            'shipping': {'address': {'city': 'Town'}},
+        })
+
+    def test_charges(self):
+        async def go():
+            customer = await self._stripe.create_customer(email='a@invalid')
+            card = await self._stripe.create_card(customer.id, {
+                'object': 'card', 'number': '4000000000000077',
+                'exp_month': 3, 'exp_year': 2030})
+            charge = await self._stripe.create_charge(
+                500, 'usd', customer=customer.id, capture=False,
+                metadata={'order': '1'})
+            captured = await self._stripe.capture_charge(charge.id)
+            refund = await self._stripe.create_refund(charge.id, amount=200)
+            return card, charge, captured, refund, \
+                await self._stripe.retrieve_charge(charge.id)
+
+        card, charge, captured, refund, fetched = base.run_until(go())
+        self.assertEqual(card.last4, '0077')
+        self.assertEqual(card.exp_month, 3)
+        self.assertEqual(charge.source, card)
+        self.assertFalse(charge.captured)
+        self.assertEqual(charge.metadata, {'order': '1'})
+        self.assertTrue(captured.captured)
+        self.assertEqual(refund.amount, 200)
+        self.assertEqual(fetched.amount_refunded, 200)
+        self.assertEqual(fetched.refunds, [refund])
+
+    def test_coalesced_timeout(self):
+        self._server.faults = fakeserver.Faults(latency=fakeserver.constant(1.0))
+        self._server.add('charge', fixtures.charge)
+
+        async def go():
+            client = self._stripe.with_timeout(0.1)
+            ret = await asyncio.gather(
+                client.retrieve_charge(fixtures.charge.id),
+                client.retrieve_charge(fixtures.charge.id),
+                return_exceptions=True)
+            # Let the cancelled request release its connection
+            await asyncio.sleep(0.05)
+            return ret
+
+        for ret in base.run_until(go()):
+            self.assertIsInstance(ret, stripe.StripeTimeout)
+        self.assertEqual(self._stripe._inflight, {})
+        self.assertEqual(self._stripe.pool_stats()['in_use'], 0)
+        self.assertEqual(self._server.stats['requests'], 1)
+
+    def test_customers(self):
+        async def go():
+            customer = await self._stripe.create_customer(
+                metadata={'a': '1', 'b': '2'})
+            updated = await self._stripe.update_customer(
+                customer.id, metadata={'a': None, 'c': '3'})
+            await self._stripe.delete_customer(customer.id)
+            try:
+                await self._stripe.retrieve_customer(customer.id)
+            except stripe.StripeError as e:
+                return updated, e
+
+        updated, error = base.run_until(go())
+        self.assertEqual(updated.metadata, {'b': '2', 'c': '3'})
+        self.assertEqual(error.http_code, 404)
+        self.assertEqual(error.param, 'id')
+
+    def test_list(self):
+        for i in range(5):
+            self._server.add('charge', {
+                **fixtures.as_response(fixtures.charge),
+                'id': 'ch_%d' % (i,), 'created': 1000 + i})
+
+        async def go():
+            return [
+                [c.id async for c in self._stripe.iter_charges(limit=2)],
+                [c.id for c in await self._stripe.list_charges(
+                    created={'gte': 1001, 'lt': 1004})],
+                [c.id for c in await self._stripe.list_charges(
+                    ending_before='ch_1', limit=2)],
+            ]
+
+        every, created, before = base.run_until(go())
+        self.assertEqual(every, ['ch_4', 'ch_3', 'ch_2', 'ch_1', 'ch_0'])
+        self.assertEqual(created, ['ch_3', 'ch_2', 'ch_1'])
+        self.assertEqual(before, ['ch_3', 'ch_2'])
+
+    def test_faults(self):
+        self._server.faults = fakeserver.Faults(rate_limit=1.0)
+        with self.assertRaises(stripe.StripeError) as cm:
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc'))
+        self.assertEqual(cm.exception.http_code, 429)
+
+        self._server.faults = fakeserver.Faults(server_error=1.0)
+        with self.assertRaises(stripe.StripeError) as cm:
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc'))
+        self.assertIn(cm.exception.http_code, (500, 502, 503))
+
+        self._server.faults = fakeserver.Faults(reset=1.0)
+        with self.assertRaises(aiohttp.ClientConnectionError):
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc'))
+
+        self._server.faults = fakeserver.Faults(
+            latency=fakeserver.constant(0.05))
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        with self.assertRaises(stripe.StripeError):
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc'))
+        self.assertGreaterEqual(loop.time() - start, 0.05)
+
+        # aiohttp retries a GET once on a reused connection itself
+        self.assertGreaterEqual(self._server.stats['reset'], 1)
+        self.assertEqual(self._server.stats[429], 1)
+        self.assertEqual(self._server.stats[404], 1)
+
+    def test_idempotency_replay(self):
+        async def go():
+            session = self._stripe._get_session()
+            url = self._server.url + '/charges'
+            headers = {'Idempotency-Key': 'key_1'}
+            data = {'amount': '100', 'currency': 'usd'}
+            async with session.post(url, data=data, headers=headers) as r:
+                first = await r.json()
+            async with session.post(url, data=data, headers=headers) as r:
+                second = await r.json()
+            return first, second
+
+        first, second = base.run_until(go())
+        self.assertEqual(first, second)
+        self.assertEqual(self._server.stats['replayed'], 1)
+
+    def test_idempotency_bounded(self):
+        self._server._idempotency_keys = 2
+
+        async def post(key):
+            session = self._stripe._get_session()
+            async with session.post(
+                    self._server.url + '/charges',
+                    data={'amount': '100', 'currency': 'usd'},
+                    headers={'Idempotency-Key': key}) as r:
+                return r.status
+
+        async def go(keys):
+            for key in keys:
+                await post(key)
+
+        # Expired keys are dropped before the next lookup
+        self._server._idempotency_ttl = 0
+        base.run_until(go(['k0', 'k0']))
+        self.assertEqual(self._server.stats['replayed'], 0)
+
+        self._server._idempotency_ttl = 86400
+        base.run_until(go(['k1', 'k2', 'k3', 'k3']))
+        self.assertEqual(self._server.stats['replayed'], 1)
+        self.assertEqual(list(self._server._idempotent), ['k2', 'k3'])
+
+    def test_loadtest(self):
+        async def go():
+            test = loadtest.LoadTest(
+                self._stripe, rps=200, duration=0.1,
+                mix=loadtest.parse_mix(loadtest.DEFAULT_MIX), seed=1)
+            await test.setup(charges=2)
+            await test.run()
+            return test.report()
+
+        report = base.run_until(go(), timeout=5.0)
+        self.assertEqual(report['errors'], {})
+        self.assertGreater(report['ok'], 0)
+        self.assertEqual(
+            report['ok'], sum(r['ok'] for r in report['operations'].values()))
+        self.assertLessEqual(report['p50'], report['p99'])
+        self.assertIn('retrieve_charge', loadtest.format_report(report))
+
+    def test_loadtest_helpers(self):
+        self.assertEqual(
+            loadtest.parse_mix('retrieve_charge=3,list_charges'),
+            [('retrieve_charge', 3.0), ('list_charges', 1.0)])
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('bogus=1')
+
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile(values, 100), 100)
+        self.assertIsNone(loadtest.percentile([], 50))
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import sys
+import unittest
+
+import base
+
+import asyncio_stripe.instrument as instrument
+
+
+class TestInstrument(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+    def tearDown(self):
+        self._loop.close()
+
+    def test_endpoint_template(self):
+        self.assertEqual(instrument.endpoint_template('/charges'), '/charges')
+        self.assertEqual(instrument.endpoint_template('/charges/ch_19t4yv2eZvKYlo2C'), '/charges/{id}')
+        self.assertEqual(
+            instrument.endpoint_template('customers/cus_aabbcc/sources/card_aabbcc'),
+            '/customers/{id}/sources/{id}')
+        self.assertEqual(instrument.endpoint_template('/charges/ch_1/capture'), '/charges/{id}/capture')
+
+    def test_histogram(self):
+        h = instrument.Histogram()
+        self.assertIsNone(h.percentile(50))
+
+        for ms in range(1, 101):
+            h.add(ms / 1000.0)
+
+        self.assertEqual(h.count, 100)
+        self.assertAlmostEqual(h.sum, 5.05)
+        # Buckets are 25% wide
+        self.assertLessEqual(abs(h.percentile(50) - 0.050) / 0.050, 0.25)
+        self.assertLessEqual(abs(h.percentile(95) - 0.095) / 0.095, 0.25)
+        self.assertEqual(h.percentile(100), 0.1)
+
+    def test_collector(self):
+        c = instrument.MetricsCollector()
+        event = instrument.RequestEvent('GET', '/charges/{id}', 0, 0)
+        c.on_response(instrument.RequestEvent(
+            'GET', '/charges/{id}', 0, 0, status=503, latency=0.2))
+        c.on_retry(event)
+        c.on_response(instrument.RequestEvent(
+            'GET', '/charges/{id}', 1, 0, status=200, latency=0.1))
+        c.on_error(instrument.RequestEvent(
+            'POST', '/charges', 0, 10, error=ValueError()))
+
+        snap = c.snapshot()
+        self.assertEqual(snap['GET /charges/{id}']['count'], 2)
+        self.assertEqual(snap['GET /charges/{id}']['statuses'], {200: 1, 503: 1})
+        self.assertEqual(snap['GET /charges/{id}']['retries'], 1)
+        self.assertEqual(snap['GET /charges/{id}']['max'], 0.2)
+        self.assertEqual(snap['POST /charges']['errors'], {'ValueError': 1})
+        self.assertEqual(snap['POST /charges']['count'], 0)
+
+        c.on_complete(instrument.RequestEvent(
+            'GET', '/charges/{id}', 1, 0, status=200, latency=0.1,
+            phases={'ttfb': 0.08, 'model_build': 0.002}))
+        phases = c.snapshot()['GET /charges/{id}']['phases']
+        self.assertEqual(set(phases), {'ttfb', 'model_build'})
+        self.assertAlmostEqual(phases['ttfb']['mean'], 0.08)
+        self.assertEqual(c.snapshot()['POST /charges']['phases'], {})
+        # Reading does not add entries
+        self.assertNotIn('POST /charges', c._latency)
+        self.assertNotIn('GET /charges/{id}', c._errors)
+
+        c.reset()
+        self.assertEqual(c.snapshot(), {})
+
+    def test_call_trace(self):
+        trace = instrument.CallTrace()
+        trace.marks.update({
+            'request_start': 0.0,
+            'queued_start': 0.0,
+            'queued_end': 0.1,
+            'create_start': 0.1,
+            'dns_start': 0.1,
+            'dns_end': 0.15,
+            'create_end': 0.3,
+            'request_end': 0.5,
+        })
+        trace.network_phases()
+        self.assertEqual(set(trace.phases), {'pool_wait', 'dns', 'connect', 'ttfb'})
+        self.assertAlmostEqual(trace.phases['pool_wait'], 0.1)
+        self.assertAlmostEqual(trace.phases['dns'], 0.05)
+        self.assertAlmostEqual(trace.phases['connect'], 0.15)
+        self.assertAlmostEqual(trace.phases['ttfb'], 0.2)
+
+        # Reused connection
+        trace.reset()
+        trace.marks.update({'request_start': 1.0, 'request_end': 1.25})
+        trace.network_phases()
+        self.assertEqual(trace.phases, {'ttfb': 0.25})
+
+    def test_trace_config(self):
+        async def go():
+            trace = instrument.CallTrace()
+            config = instrument.phase_trace_config()
+            config.freeze()
+            ctx = config.trace_config_ctx(trace_request_ctx=trace)
+            await config.on_request_start.send(None, ctx, None)
+            await config.on_request_end.send(None, ctx, None)
+            # Other requests' contexts are ignored
+            other = config.trace_config_ctx(trace_request_ctx={})
+            await config.on_dns_resolvehost_start.send(None, other, None)
+            return trace
+
+        trace = base.run_until(go())
+        self.assertEqual(set(trace.marks), {'request_start', 'request_end'})
+
+    def test_hook_failures_ignored(self):
+        class Broken(instrument.Hooks):
+            def on_response(self, event):
+                raise RuntimeError()
+
+        seen = []
+
+        class Recorder(instrument.Hooks):
+            def on_response(self, event):
+                seen.append(event)
+
+        event = instrument.RequestEvent('GET', '/charges', 0, 0)
+        instrument.call_hooks((Broken(), Recorder()), 'on_response', event)
+        self.assertEqual(seen, [event])
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import aiohttp
+import attr
+
+import base
+
+import asyncio_stripe.fakeserver as fakeserver
+import asyncio_stripe.fixtures as fixtures
+import asyncio_stripe.mirror as mirror
+import asyncio_stripe.stripe as stripe
+
+from test_stripe import mkresp
+
+
+def as_json(obj, **kwds):
+    return json.loads(json.dumps(fixtures.as_response(attr.evolve(obj, **kwds))))
+
+
+class MirrorTestCase(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._dir = tempfile.TemporaryDirectory()
+        self._mirror = mirror.SQLiteMirror(os.path.join(self._dir.name, 'mirror.db'))
+
+    def tearDown(self):
+        base.run_until(self._mirror.close())
+        self._dir.cleanup()
+        self._loop.close()
+
+
+class TestSQLiteMirror(MirrorTestCase):
+    def test_store(self):
+        m = self._mirror
+        refund = attr.evolve(fixtures.refund, id='re_1', charge='ch_1')
+        base.run_until(m.store([
+            as_json(fixtures.customer),
+            as_json(fixtures.charge, id='ch_1', created=100, refunds=[refund]),
+            as_json(fixtures.charge, id='ch_2', created=200, status='failed',
+                    customer=None, source=None),
+        ]))
+
+        self.assertEqual(base.run_until(m.retrieve_customer('cus_aabbcc')), fixtures.customer)
+        self.assertEqual(base.run_until(m.retrieve_card('card_aabbcc')), fixtures.card_source)
+        self.assertEqual(base.run_until(m.retrieve_refund('re_1')), refund)
+        self.assertIsInstance(base.run_until(m.retrieve_charge('ch_1')), stripe.Charge)
+        self.assertIsNone(base.run_until(m.retrieve_charge('ch_3')))
+        self.assertEqual(base.run_until(m.count('charge')), 2)
+        self.assertEqual(base.run_until(m.latest_created('charge')), 200)
+
+        def ids(ret):
+            return [o.id for o in ret]
+
+        self.assertEqual(ids(base.run_until(m.list_charges())), ['ch_2', 'ch_1'])
+        self.assertEqual(ids(base.run_until(m.list_charges(limit=1))), ['ch_2'])
+        self.assertEqual(ids(base.run_until(m.list_charges(customer='cus_aabbcc'))), ['ch_1'])
+        self.assertEqual(ids(base.run_until(m.list_charges(customer=None))), ['ch_2'])
+        self.assertEqual(ids(base.run_until(m.list_charges(status='failed'))), ['ch_2'])
+        self.assertEqual(ids(base.run_until(m.list_charges(created={'lt': 200}))), ['ch_1'])
+        self.assertEqual(ids(base.run_until(m.list_charges(created=200))), ['ch_2'])
+        self.assertEqual(ids(base.run_until(m.list_refunds(charge='ch_1'))), ['re_1'])
+        self.assertEqual(ids(base.run_until(m.list_cards('cus_aabbcc'))), ['card_aabbcc'])
+
+        for kwds in ({'amount': 1}, {'created': {'ne': 1}}):
+            with self.assertRaises(ValueError):
+                base.run_until(m.list_charges(**kwds))
+        with self.assertRaises(ValueError):
+            base.run_until(m.store([as_json(fixtures.event)]))
+
+    def test_delete(self):
+        m = self._mirror
+        base.run_until(m.store([as_json(fixtures.customer)]))
+
+        # A complete source list replaces the customer's cards
+        base.run_until(m.store([as_json(fixtures.customer, sources=[])]))
+        self.assertIsNone(base.run_until(m.retrieve_card('card_aabbcc')))
+
+        base.run_until(m.store([as_json(fixtures.customer)]))
+        base.run_until(m.store((), deleted=[('customer', 'cus_aabbcc')]))
+        self.assertIsNone(base.run_until(m.retrieve_customer('cus_aabbcc')))
+        self.assertIsNone(base.run_until(m.retrieve_card('card_aabbcc')))
+
+    def test_state(self):
+        checkpoint = self._mirror.checkpoint('events')
+        self.assertIsNone(base.run_until(checkpoint.load()))
+        base.run_until(checkpoint.save('evt_1'))
+        self.assertEqual(base.run_until(checkpoint.load()), 'evt_1')
+
+        base.run_until(self._mirror.store(
+            [as_json(fixtures.refund)], state={'events': 'evt_2', 'other': [1]}))
+        self.assertEqual(base.run_until(checkpoint.load()), 'evt_2')
+        self.assertEqual(base.run_until(self._mirror.get_state('other')), [1])
+
+
+class TestSyncCreated(MirrorTestCase):
+    def setUp(self):
+        super().setUp()
+        self._server = fakeserver.FakeStripe(seed=1)
+        url = base.run_until(self._server.start())
+        self._stripe = stripe.Client(None, 'sk_test', url=url)
+
+        self._server.add('customer', fixtures.customer)
+        for i in range(5):
+            self._server.add('charge', attr.evolve(
+                fixtures.charge, id='ch_%d' % (i,), created=1000 + i))
+
+    def tearDown(self):
+        base.run_until(self._stripe.close())
+        base.run_until(self._server.stop())
+        super().tearDown()
+
+    def test_run(self):
+        sync = mirror.MirrorSync(self._stripe, self._mirror, mode='created', batch_size=2)
+        base.run_until(sync.run())
+        self.assertEqual(base.run_until(self._mirror.count('charge')), 5)
+        self.assertEqual(base.run_until(self._mirror.count('customer')), 1)
+        self.assertEqual(base.run_until(self._mirror.count('card')), 1)
+        self.assertEqual(base.run_until(self._mirror.get_state('backfill.charge')), 'done')
+
+        # Only charges from the newest second mirrored onwards are listed
+        self._server.add('charge', attr.evolve(fixtures.charge, id='ch_5', created=2000))
+        sync.stats.clear()
+        base.run_until(sync.run())
+        self.assertEqual(base.run_until(self._mirror.count('charge')), 6)
+        self.assertEqual(sync.stats['stored'], 3)
+
+    def test_resume(self):
+        base.run_until(self._mirror.set_state('backfill.charge', 'ch_3'))
+        sync = mirror.MirrorSync(self._stripe, self._mirror, kinds=('charge',))
+        base.run_until(sync.backfill())
+        self.assertEqual(
+            [c.id for c in base.run_until(self._mirror.list_charges())], ['ch_2', 'ch_1', 'ch_0'])
+
+        with self.assertRaises(ValueError):
+            mirror.MirrorSync(self._stripe, self._mirror, kinds=('card',))
+
+
+class TestSyncEvents(MirrorTestCase):
+    def test_run(self):
+        session = unittest.mock.MagicMock(spec=aiohttp.ClientSession)
+        client = stripe.Client(session, 'sekret_key')
+
+        def event(id, type, obj):
+            return json.loads(json.dumps(fixtures.as_response(attr.evolve(
+                fixtures.event, id=id, type=type, data={'object': obj}))))
+
+        charge = attr.evolve(fixtures.charge, id='ch_1')
+        session.request.side_effect = [
+            mkresp({'object': 'list', 'has_more': False, 'data': [
+                event('evt_0', 'charge.succeeded', charge)]}),
+            mkresp({'object': 'list', 'has_more': False, 'data': [
+                as_json(charge)]}),
+            mkresp({'object': 'list', 'has_more': False, 'data': [
+                event('evt_3', 'charge.refunded', attr.evolve(charge, amount_refunded=999)),
+                event('evt_2', 'customer.created', fixtures.customer),
+                event('evt_1', 'charge.updated', attr.evolve(charge, description='x')),
+            ]}),
+        ]
+
+        sync = mirror.MirrorSync(client, self._mirror, kinds=('charge',))
+        base.run_until(sync.run())
+
+        calls = session.request.call_args_list
+        self.assertEqual(calls[0][1]['params'], [('limit', '1')])
+        self.assertEqual(calls[2][1]['params'], [('limit', '100'), ('ending_before', 'evt_0')])
+
+        stored = base.run_until(self._mirror.retrieve_charge('ch_1'))
+        self.assertEqual(stored, attr.evolve(charge, amount_refunded=999))
+        self.assertIsNone(base.run_until(self._mirror.retrieve_customer('cus_aabbcc')))
+        self.assertEqual(base.run_until(self._mirror.get_state('events')), 'evt_3')
+        self.assertEqual(sync.stats['events'], 3)
+        self.assertEqual(sync.stats['ignored'], 1)
+
+    def test_deleted(self):
+        sync = mirror.MirrorSync(None, self._mirror)
+        base.run_until(self._mirror.store([as_json(fixtures.customer)]))
+        base.run_until(sync.apply_event({
+            'type': 'customer.source.deleted',
+            'data': {'object': as_json(fixtures.card_source)}}))
+        self.assertIsNone(base.run_until(self._mirror.retrieve_card('card_aabbcc')))
+        self.assertEqual(sync.stats['deleted'], 1)
+
+    def test_state(self):
+        sync = mirror.MirrorSync(None, self._mirror, kinds=('charge',))
+        base.run_until(sync.apply_event(
+            {'type': 'charge.succeeded', 'data': {'object': as_json(fixtures.charge)}},
+            state={'events': 'evt_1'}))
+        self.assertEqual(base.run_until(self._mirror.get_state('events')), 'evt_1')
+
+        # Ignored events still move the cursor
+        base.run_until(sync.apply_event(
+            {'type': 'customer.created', 'data': {'object': as_json(fixtures.customer)}},
+            state={'events': 'evt_2'}))
+        self.assertEqual(base.run_until(self._mirror.get_state('events')), 'evt_2')
+        self.assertEqual(sync.stats['ignored'], 1)
+
+        # The event and the cursor are one transaction
+        charge = as_json(attr.evolve(fixtures.charge, id='ch_2'))
+        with self.assertRaises(TypeError):
+            base.run_until(sync.apply_event(
+                {'type': 'charge.succeeded', 'data': {'object': charge}},
+                state={'events': object()}))
+        self.assertIsNone(base.run_until(self._mirror.retrieve_charge('ch_2')))
+        self.assertEqual(base.run_until(self._mirror.get_state('events')), 'evt_2')
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
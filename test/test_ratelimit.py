@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import sys
+import time
+import unittest
+import unittest.mock
+
+import aiohttp
+
+import base
+
+import asyncio_stripe.ratelimit as ratelimit
+import asyncio_stripe.stripe as stripe
+
+from test_stripe import mkresp, charge_json
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+    def tearDown(self):
+        self._loop.close()
+
+    def test_acquire_waits_for_refill(self):
+        bucket = ratelimit.TokenBucket(50, burst=2)
+
+        async def take(n):
+            for _ in range(n):
+                await bucket.acquire()
+
+        start = time.monotonic()
+        base.run_until(take(2))
+        self.assertLess(time.monotonic() - start, 0.01)
+
+        start = time.monotonic()
+        base.run_until(take(5))
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_adapts_to_throttling(self):
+        now = [1000.0]
+        with unittest.mock.patch(
+                'asyncio_stripe.ratelimit.time.monotonic',
+                side_effect=lambda: now[0]):
+            bucket = ratelimit.TokenBucket(10, min_rate=2, decrease=0.5, increase=1)
+            bucket.throttled()
+            self.assertEqual(bucket.rate, 5)
+            bucket.throttled()
+            bucket.throttled()
+            self.assertEqual(bucket.rate, 2)
+
+            # Growth depends on time, not on the number of requests
+            for _ in range(100):
+                bucket.succeeded()
+            self.assertEqual(bucket.rate, 2)
+            now[0] += 1.5
+            bucket.succeeded()
+            now[0] += 1.5
+            bucket.succeeded()
+            self.assertEqual(bucket.rate, 5)
+            now[0] += 60
+            bucket.succeeded()
+            self.assertEqual(bucket.rate, 10)
+
+    def test_one_cut_per_epoch(self):
+        bucket = ratelimit.TokenBucket(100, decrease=0.5)
+
+        async def burst():
+            return [await bucket.acquire() for _ in range(5)]
+
+        epochs = base.run_until(burst())
+        self.assertEqual(epochs, [0] * 5)
+
+        # Every request of the burst is throttled, the rate is cut once
+        self.assertEqual([bucket.throttled(e) for e in epochs], [True] + [False] * 4)
+        self.assertEqual(bucket.rate, 50)
+
+        # Requests sent after the cut can cut again
+        epoch = base.run_until(bucket.acquire())
+        self.assertEqual(epoch, 1)
+        self.assertTrue(bucket.throttled(epoch))
+        self.assertEqual(bucket.rate, 25)
+
+    def test_separate_buckets(self):
+        limiter = ratelimit.RateLimiter(read_rate=10, write_rate=20)
+        self.assertIs(limiter.bucket('GET'), limiter.read)
+        self.assertIs(limiter.bucket('POST'), limiter.write)
+        self.assertIs(limiter.bucket('DELETE'), limiter.write)
+        self.assertEqual(limiter.read.rate, 10)
+        self.assertEqual(limiter.write.rate, 20)
+
+    def test_client_throttled(self):
+        session = unittest.mock.MagicMock(spec=aiohttp.ClientSession)
+        limiter = ratelimit.RateLimiter(read_rate=100, write_rate=100)
+        client = stripe.Client(session, 'sekret_key',
+            retry=stripe.RetryPolicy(backoff=0), limiter=limiter)
+        session.request.side_effect = [
+            mkresp({'error': {}}, status=429),
+            mkresp(json.loads(charge_json))]
+
+        base.run_until(client.retrieve_charge('ch_aabbcc'))
+        self.assertGreaterEqual(limiter.read.rate, 50)
+        self.assertLess(limiter.read.rate, 51)
+        self.assertEqual(limiter.write.rate, 100)
+
+    def test_client_concurrent_throttled(self):
+        session = unittest.mock.MagicMock(spec=aiohttp.ClientSession)
+        limiter = ratelimit.RateLimiter(read_rate=100, write_rate=100)
+        client = stripe.Client(session, 'sekret_key',
+            retry=stripe.RetryPolicy(max_retries=0), limiter=limiter,
+            coalesce=False)
+
+        async def throttled(*args, **kwds):
+            # Every request is in flight before the first 429 arrives
+            await asyncio.sleep(0.01)
+            return await mkresp({'error': {}}, status=429)
+        session.request.side_effect = throttled
+
+        async def go():
+            return await asyncio.gather(*(
+                client.retrieve_charge('ch_aabbcc') for _ in range(4)),
+                return_exceptions=True)
+
+        for ret in base.run_until(go()):
+            self.assertIsInstance(ret, stripe.StripeError)
+        self.assertEqual(limiter.read.rate, 50)
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import asyncio
+import datetime
+import json
+import logging
+import sys
+import unittest
+import unittest.mock
+
+import aiohttp
+import attr
+
+import base
+
+import asyncio_stripe.columnar as columnar
+import asyncio_stripe.fixtures as fixtures
+import asyncio_stripe.reporting as reporting
+import asyncio_stripe.stripe as stripe
+
+from test_stripe import mkresp
+
+
+DAY = 86400
+T0 = 1488844800  # 2017-03-07T00:00:00Z
+
+
+def charge_json(**kwds):
+    return json.loads(json.dumps(fixtures.as_response(
+        attr.evolve(fixtures.charge, **kwds))))
+
+
+def refund_json(**kwds):
+    return json.loads(json.dumps(fixtures.as_response(
+        attr.evolve(fixtures.refund, **kwds))))
+
+
+charges = [
+    charge_json(id='ch_1', amount=1000, amount_refunded=250, created=T0 + 10),
+    charge_json(id='ch_2', amount=500, created=T0 + DAY + 10,
+                metadata={'channel': 'web'}),
+    charge_json(id='ch_3', amount=700, currency='eur', created=T0 + 20,
+                status='failed', paid=False, failure_code='card_declined',
+                metadata={'channel': 'web'}),
+    charge_json(id='ch_4', amount=300, currency='eur', created=T0 + 30,
+                status='failed', paid=False, failure_code='card_declined'),
+    charge_json(id='ch_5', amount=200, currency='eur', created=T0 + 40,
+                status='failed', paid=False, failure_code='expired_card'),
+    charge_json(id='ch_6', amount=900, currency='eur', created=T0 + 50,
+                amount_refunded=900, metadata={}),
+]
+
+
+class AsyncList(object):
+    def __init__(self, items):
+        self._items = iter(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._items)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class TestChargeReport(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+    def tearDown(self):
+        self._loop.close()
+
+    def test_currency(self):
+        report = reporting.ChargeReport()
+        base.run_until(report.consume(AsyncList(charges), batch_size=4))
+        self.assertEqual(report.rows, 6)
+
+        usd, eur = report.result()['usd'], report.result()['eur']
+        self.assertEqual(
+            (usd.count, usd.succeeded, usd.failed, usd.amount, usd.amount_refunded),
+            (2, 2, 0, 1500, 250))
+        self.assertEqual(usd.net, 1250)
+        self.assertAlmostEqual(usd.refund_ratio, 250 / 1500)
+        self.assertEqual(usd.failure_codes, {})
+
+        self.assertEqual(
+            (eur.count, eur.succeeded, eur.failed, eur.amount),
+            (4, 1, 3, 900))
+        self.assertEqual(eur.refund_ratio, 1.0)
+        self.assertEqual(eur.failure_codes, {'card_declined': 2, 'expired_card': 1})
+
+    def test_dimensions(self):
+        report = reporting.ChargeReport(by=('day', 'currency'))
+        base.run_until(report.consume(AsyncList(charges)))
+        day = datetime.date(2017, 3, 7)
+        self.assertEqual(
+            {k: v.count for k, v in report.result().items()},
+            {(day, 'usd'): 1, (day, 'eur'): 4,
+             (day + datetime.timedelta(1), 'usd'): 1})
+
+        # Shifted a day back, the first day's charges fall on the 6th
+        report = reporting.ChargeReport(by='day', utc_offset=-60)
+        base.run_until(report.consume(AsyncList(charges)))
+        self.assertEqual(
+            {k: v.count for k, v in report.result().items()},
+            {day - datetime.timedelta(1): 5, day: 1})
+
+        report = reporting.ChargeReport(by='metadata.channel')
+        base.run_until(report.consume(AsyncList(charges)))
+        self.assertEqual(
+            {k: v.count for k, v in report.result().items()},
+            {'web': 2, None: 4})
+
+        with self.assertRaises(ValueError):
+            reporting.ChargeReport(by='bogus')
+
+    def test_models(self):
+        # Models aggregate the same as decoded JSON
+        report = reporting.ChargeReport(by='status')
+        base.run_until(report.consume(AsyncList(
+            [stripe.convert_json_response(c) for c in charges])))
+        self.assertEqual(
+            {k: v.count for k, v in report.result().items()},
+            {'succeeded': 3, 'failed': 3})
+
+    def test_new_batch(self):
+        batch = reporting.ChargeReport(by='metadata.channel').new_batch()
+        self.assertIsInstance(batch, columnar.ChargeBatch)
+        self.assertEqual(
+            sorted(batch.columns),
+            ['amount', 'amount_refunded', 'failure_code', 'id', 'metadata', 'status'])
+
+    def test_client(self):
+        session = unittest.mock.MagicMock(spec=aiohttp.ClientSession)
+        client = stripe.Client(session, 'sekret_key')
+        session.request.side_effect = [
+            mkresp({'object': 'list', 'has_more': True, 'data': charges[:3]}),
+            mkresp({'object': 'list', 'has_more': False, 'data': charges[3:]}),
+        ]
+
+        client._convert = unittest.mock.Mock(side_effect=AssertionError)
+        report = base.run_until(reporting.charge_report(
+            client, batch_size=2, limit=3, created={'gte': T0}))
+
+        self.assertEqual(report.rows, 6)
+        self.assertEqual(report.result()['eur'].failed, 3)
+        calls = session.request.call_args_list
+        self.assertEqual(
+            calls[1][1]['params'],
+            [('limit', '3'), ('created[gte]', str(T0)), ('starting_after', 'ch_3')])
+
+
+class TestRefundReport(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+    def tearDown(self):
+        self._loop.close()
+
+    def test_reasons(self):
+        refunds = [
+            refund_json(id='re_1', amount=100),
+            refund_json(id='re_2', amount=200, reason='fraudulent'),
+            refund_json(id='re_3', amount=300, reason='fraudulent', status='failed'),
+            refund_json(id='re_4', amount=400, currency='eur', reason='duplicate'),
+        ]
+        report = reporting.RefundReport()
+        base.run_until(report.consume(AsyncList(refunds), batch_size=3))
+
+        usd, eur = report.result()['usd'], report.result()['eur']
+        self.assertEqual((usd.count, usd.amount), (3, 300))
+        self.assertEqual(usd.reasons, {'fraudulent': 2})
+        self.assertEqual((eur.count, eur.amount), (1, 400))
+        self.assertEqual(eur.reasons, {'duplicate': 1})
+
+        batch = columnar.RefundBatch()
+        batch.extend(refunds)
+        self.assertEqual(batch[1], stripe.convert_json_response(refunds[1]))
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,8 @@ import logging
 import sys
 import unittest
 import unittest.mock
+import urllib.parse
+import uuid
 
 import aiohttp
 import attr
@@ -12,9 +14,32 @@ import multidict
 
 import base
 
+import asyncio_stripe.cache as cache
+import asyncio_stripe.checkpoint as checkpoint
+import asyncio_stripe.fixtures as fixtures
+import asyncio_stripe.instrument as instrument
 import asyncio_stripe.stripe as stripe
 
 
+def parse_form(data):
+    '''
+    Decode a form encoded request body into a dictionary.
+    '''
+    return dict(urllib.parse.parse_qsl(data.decode('ascii'), keep_blank_values=True))
+
+
+def mkresp(body, status=200, headers=None):
+    '''
+    Make a future resolving to a mocked ClientResponse returning `body`.
+    '''
+    resp = unittest.mock.MagicMock(spec=aiohttp.client_reqrep.ClientResponse)
+    resp.status = status
+    resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
+    resp.headers.update(headers or {})
+    base.mkfuture(json.dumps(body).encode(), resp.read)
+    return base.mkfuture(resp)
+
+
 class TestClient(unittest.TestCase):
     def setUp(self):
         self._loop = asyncio.new_event_loop()
@@ -176,6 +201,51 @@ class TestClient(unittest.TestCase):
         for key in keys:
             self.assertEqual(getattr(r, key), j[key])
 
+    def test_parse_metadata_untouched(self):
+        j = json.loads(charge_json)
+        j['metadata'] = {'object': 'charge'}
+        r = stripe.convert_json_response(j)
+        self.assertEqual(r.metadata, {'object': 'charge'})
+
+    def test_parse_defaults(self):
+        j = json.loads(customer_json)
+        self.assertNotIn('subscriptions', j)
+        r1 = stripe.convert_json_response(j)
+        r2 = stripe.convert_json_response(j)
+        self.assertEqual(r1.subscriptions, [])
+        self.assertIsNot(r1.subscriptions, r2.subscriptions)
+
+    def test_parse_invalid(self):
+        j = json.loads(refund_json)
+        del j['amount']
+        with self.assertRaises(TypeError):
+            stripe.convert_json_response(j)
+
+        j = json.loads(refund_json)
+        j['unknown'] = 1
+        with self.assertRaises(TypeError):
+            stripe.convert_json_response(j)
+
+    def test_parse_lazy(self):
+        j = json.loads(charge_json)
+        r = stripe.convert_lazy_response(j)
+        self.assertIsInstance(r, stripe.LazyModel)
+        self.assertEqual(r.id, j['id'])
+        self.assertEqual(r.amount, j['amount'])
+        self.assertIsNone(r._values)
+
+        self.assertIsInstance(r.source, stripe.LazyModel)
+        self.assertIs(r.source, r.source)
+        self.assertEqual(r.source.last4, j['source']['last4'])
+        self.assertEqual(r.refunds, [])
+        self.assertIsNone(r.transfer)
+
+        self.assertEqual(r, stripe.convert_json_response(j))
+        self.assertEqual(stripe.convert_json_response(j), r)
+        self.assertEqual(r.materialize(), stripe.convert_json_response(j))
+        self.assertEqual(stripe.create_json_request(r),
+            stripe.create_json_request(stripe.convert_json_response(j)))
+
     def test_error_parsing(self):
         error_body = '''
             {
@@ -192,7 +262,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         error = json.loads(error_body)
-        base.mkfuture(error, resp.json)
+        base.mkfuture(json.dumps(error).encode(), resp.read)
 
         with self.assertRaises(stripe.StripeError) as exc:
             base.run_until(self._stripe.create_charge(amount=103, currency='usd', k='1', j=2))
@@ -210,19 +280,41 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         charge = json.loads(charge_json)
-        base.mkfuture(charge, resp.json)
+        base.mkfuture(json.dumps(charge).encode(), resp.read)
 
         r = base.run_until(self._stripe.create_charge(amount=103, currency='usd', k='1', j=2,
             metadata={'md1': 'hi', 'md2': 'other'}, tf=True))
         args, kwds  = self._session.request.call_args
-        self.assertEqual(kwds['params'], {
-            'amount': 103,
-            'currency': 'usd',
-            'k': '1',
-            'j': 2,
-            'metadata[md1]': 'hi',
-            'metadata[md2]': 'other',
-            'tf': 'true'})
+        self.assertEqual(kwds['data'], b'amount=103&currency=usd&k=1&j=2'
+            b'&metadata%5Bmd1%5D=hi&metadata%5Bmd2%5D=other&tf=true')
+
+    def test_encode_params(self):
+        pairs = stripe.encode_params({
+            'amount': 100,
+            'capture': False,
+            'description': None,
+            'shipping': {'name': 'Joe', 'address': {'city': 'Town', 'line1': '1 Main St'}},
+            'items': [{'type': 'sku', 'parent': 'sku_1'}, {'type': 'tax'}],
+            'expand': ['customer', 'source'],
+            'metadata': {},
+        })
+        self.assertEqual(pairs, [
+            ('amount', '100'),
+            ('capture', 'false'),
+            ('description', ''),
+            ('shipping[name]', 'Joe'),
+            ('shipping[address][city]', 'Town'),
+            ('shipping[address][line1]', '1 Main St'),
+            ('items[0][type]', 'sku'),
+            ('items[0][parent]', 'sku_1'),
+            ('items[1][type]', 'tax'),
+            ('expand[]', 'customer'),
+            ('expand[]', 'source'),
+            ('metadata', ''),
+        ])
+        self.assertEqual(
+            stripe.form_encode(pairs[3:5]),
+            b'shipping%5Bname%5D=Joe&shipping%5Baddress%5D%5Bcity%5D=Town')
 
     def test_create_charge(self):
         resp = unittest.mock.MagicMock(spec=aiohttp.client_reqrep.ClientResponse)
@@ -230,7 +322,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         charge = json.loads(charge_json)
-        base.mkfuture(charge, resp.json)
+        base.mkfuture(json.dumps(charge).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -241,10 +333,12 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'POST')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/charges')
-        self.assertEqual(kwds['params'], {'amount': 103, 'currency': 'usd', 'k': '1', 'j': 2})
+        self.assertEqual(parse_form(kwds['data']), {'amount': '103', 'currency': 'usd', 'k': '1', 'j': '2'})
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
-        self.assertEqual(kwds['headers'], expected_headers)
+        headers = dict(kwds['headers'])
+        uuid.UUID(headers.pop('Idempotency-Key'))
+        self.assertEqual(headers, expected_headers)
         self.assertEqual(r, stripe.convert_json_response(charge))
 
     def test_retrieve_charge(self):
@@ -253,7 +347,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         charge = json.loads(charge_json)
-        base.mkfuture(charge, resp.json)
+        base.mkfuture(json.dumps(charge).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -264,7 +358,7 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'GET')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/charges/ch_aabbcc')
-        self.assertEqual(kwds['params'], {})
+        self.assertEqual(kwds['params'], [])
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
         self.assertEqual(kwds['headers'], expected_headers)
@@ -276,7 +370,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         charge = json.loads(charge_json)
-        base.mkfuture(charge, resp.json)
+        base.mkfuture(json.dumps(charge).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -287,10 +381,12 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'POST')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/charges/ch_aabbcc')
-        self.assertEqual(kwds['params'], {'k': '1', 'j': 2})
+        self.assertEqual(parse_form(kwds['data']), {'k': '1', 'j': '2'})
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
-        self.assertEqual(kwds['headers'], expected_headers)
+        headers = dict(kwds['headers'])
+        uuid.UUID(headers.pop('Idempotency-Key'))
+        self.assertEqual(headers, expected_headers)
         self.assertEqual(r, stripe.convert_json_response(charge))
 
     def test_capture_charge(self):
@@ -299,7 +395,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         charge = json.loads(charge_json)
-        base.mkfuture(charge, resp.json)
+        base.mkfuture(json.dumps(charge).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -310,10 +406,12 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'POST')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/charges/ch_aabbcc/capture')
-        self.assertEqual(kwds['params'], {'k': '1', 'j': 2})
+        self.assertEqual(parse_form(kwds['data']), {'k': '1', 'j': '2'})
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
-        self.assertEqual(kwds['headers'], expected_headers)
+        headers = dict(kwds['headers'])
+        uuid.UUID(headers.pop('Idempotency-Key'))
+        self.assertEqual(headers, expected_headers)
         self.assertEqual(r, stripe.convert_json_response(charge))
 
     def test_list_charges(self):
@@ -322,7 +420,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         charge = json.loads(charge_json)
-        base.mkfuture({'object': 'list', 'url': '/v1/charges', 'has_more': False, 'data': [charge]}, resp.json)
+        base.mkfuture(json.dumps({'object': 'list', 'url': '/v1/charges', 'has_more': False, 'data': [charge]}).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -333,7 +431,7 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'GET')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/charges')
-        self.assertEqual(kwds['params'], {'k': '1', 'j': 2})
+        self.assertEqual(kwds['params'], [('k', '1'), ('j', '2')])
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
         self.assertEqual(kwds['headers'], expected_headers)
@@ -345,7 +443,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         customer = json.loads(customer_json)
-        base.mkfuture(customer, resp.json)
+        base.mkfuture(json.dumps(customer).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -356,10 +454,12 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'POST')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/customers')
-        self.assertEqual(kwds['params'], {'k': '1', 'j': 2})
+        self.assertEqual(parse_form(kwds['data']), {'k': '1', 'j': '2'})
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
-        self.assertEqual(kwds['headers'], expected_headers)
+        headers = dict(kwds['headers'])
+        uuid.UUID(headers.pop('Idempotency-Key'))
+        self.assertEqual(headers, expected_headers)
         self.assertEqual(r, stripe.convert_json_response(customer))
 
     def test_retrieve_customer(self):
@@ -368,7 +468,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         customer = json.loads(customer_json)
-        base.mkfuture(customer, resp.json)
+        base.mkfuture(json.dumps(customer).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -379,7 +479,7 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'GET')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/customers/cus_aabbcc')
-        self.assertEqual(kwds['params'], {})
+        self.assertEqual(kwds['params'], [])
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
         self.assertEqual(kwds['headers'], expected_headers)
@@ -391,7 +491,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         customer = json.loads(customer_json)
-        base.mkfuture(customer, resp.json)
+        base.mkfuture(json.dumps(customer).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -402,10 +502,12 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'POST')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/customers/cus_aabbcc')
-        self.assertEqual(kwds['params'], {'k': '1', 'j': 2})
+        self.assertEqual(parse_form(kwds['data']), {'k': '1', 'j': '2'})
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
-        self.assertEqual(kwds['headers'], expected_headers)
+        headers = dict(kwds['headers'])
+        uuid.UUID(headers.pop('Idempotency-Key'))
+        self.assertEqual(headers, expected_headers)
         self.assertEqual(r, stripe.convert_json_response(customer))
 
     def test_delete_customer(self):
@@ -413,7 +515,7 @@ class TestClient(unittest.TestCase):
         resp.status = 200
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
-        base.mkfuture({'deleted': True, 'id': 'cus_aabbcc'}, resp.json)
+        base.mkfuture(json.dumps({'deleted': True, 'id': 'cus_aabbcc'}).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -424,7 +526,7 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'DELETE')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/customers/cus_aabbcc')
-        self.assertEqual(kwds['params'], {})
+        self.assertEqual(kwds['params'], [])
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
         self.assertEqual(kwds['headers'], expected_headers)
@@ -436,7 +538,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         customer = json.loads(customer_json)
-        base.mkfuture({'object': 'list', 'url': '/v1/customers', 'has_more': False, 'data': [customer]}, resp.json)
+        base.mkfuture(json.dumps({'object': 'list', 'url': '/v1/customers', 'has_more': False, 'data': [customer]}).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -447,7 +549,7 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'GET')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/customers')
-        self.assertEqual(kwds['params'], {'k': '1', 'j': 2})
+        self.assertEqual(kwds['params'], [('k', '1'), ('j', '2')])
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
         self.assertEqual(kwds['headers'], expected_headers)
@@ -459,7 +561,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         card = json.loads(card_json)
-        base.mkfuture(card, resp.json)
+        base.mkfuture(json.dumps(card).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -470,10 +572,12 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'POST')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/customers/cus_aabbcc/sources')
-        self.assertEqual(kwds['params'], {'source': 'source_token', 'metadata[k]': '1', 'metadata[j]': 2})
+        self.assertEqual(parse_form(kwds['data']), {'source': 'source_token', 'metadata[k]': '1', 'metadata[j]': '2'})
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
-        self.assertEqual(kwds['headers'], expected_headers)
+        headers = dict(kwds['headers'])
+        uuid.UUID(headers.pop('Idempotency-Key'))
+        self.assertEqual(headers, expected_headers)
         self.assertEqual(r, stripe.convert_json_response(card))
 
     def test_update_card(self):
@@ -482,7 +586,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         card = json.loads(card_json)
-        base.mkfuture(card, resp.json)
+        base.mkfuture(json.dumps(card).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -493,10 +597,12 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'POST')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/customers/cus_aabbcc/sources/card_abc')
-        self.assertEqual(kwds['params'], {'metadata[k]': '1', 'metadata[j]': 2})
+        self.assertEqual(parse_form(kwds['data']), {'metadata[k]': '1', 'metadata[j]': '2'})
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
-        self.assertEqual(kwds['headers'], expected_headers)
+        headers = dict(kwds['headers'])
+        uuid.UUID(headers.pop('Idempotency-Key'))
+        self.assertEqual(headers, expected_headers)
         self.assertEqual(r, stripe.convert_json_response(card))
 
     def test_delete_card(self):
@@ -504,7 +610,7 @@ class TestClient(unittest.TestCase):
         resp.status = 200
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
-        base.mkfuture({'deleted': True, 'id': 'card_aabbcc'}, resp.json)
+        base.mkfuture(json.dumps({'deleted': True, 'id': 'card_aabbcc'}).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -515,7 +621,7 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'DELETE')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/customers/cus_aabbcc/sources/card_aabbcc')
-        self.assertEqual(kwds['params'], {})
+        self.assertEqual(kwds['params'], [])
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
         self.assertEqual(kwds['headers'], expected_headers)
@@ -527,7 +633,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         refund = json.loads(refund_json)
-        base.mkfuture(refund, resp.json)
+        base.mkfuture(json.dumps(refund).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -538,10 +644,12 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'POST')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/refunds')
-        self.assertEqual(kwds['params'], {'charge': 'ch_aabbcc', 'k': '1', 'j': 2})
+        self.assertEqual(parse_form(kwds['data']), {'charge': 'ch_aabbcc', 'k': '1', 'j': '2'})
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
-        self.assertEqual(kwds['headers'], expected_headers)
+        headers = dict(kwds['headers'])
+        uuid.UUID(headers.pop('Idempotency-Key'))
+        self.assertEqual(headers, expected_headers)
         self.assertEqual(r, stripe.convert_json_response(refund))
 
     def test_retrieve_refund(self):
@@ -550,7 +658,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         refund = json.loads(refund_json)
-        base.mkfuture(refund, resp.json)
+        base.mkfuture(json.dumps(refund).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -561,7 +669,7 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'GET')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/refunds/re_aabbcc')
-        self.assertEqual(kwds['params'], {})
+        self.assertEqual(kwds['params'], [])
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
         self.assertEqual(kwds['headers'], expected_headers)
@@ -573,7 +681,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         refund = json.loads(refund_json)
-        base.mkfuture(refund, resp.json)
+        base.mkfuture(json.dumps(refund).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -584,10 +692,12 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'POST')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/refunds/re_aabbcc')
-        self.assertEqual(kwds['params'], {'metadata[k]': '1', 'metadata[j]': 2})
+        self.assertEqual(parse_form(kwds['data']), {'metadata[k]': '1', 'metadata[j]': '2'})
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
-        self.assertEqual(kwds['headers'], expected_headers)
+        headers = dict(kwds['headers'])
+        uuid.UUID(headers.pop('Idempotency-Key'))
+        self.assertEqual(headers, expected_headers)
         self.assertEqual(r, stripe.convert_json_response(refund))
 
     def test_list_refunds(self):
@@ -596,7 +706,7 @@ class TestClient(unittest.TestCase):
         resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
         base.mkfuture(resp, self._session.request)
         refund = json.loads(refund_json)
-        base.mkfuture({'object': 'list', 'url': '/v1/refunds', 'has_more': False, 'data': [refund]}, resp.json)
+        base.mkfuture(json.dumps({'object': 'list', 'url': '/v1/refunds', 'has_more': False, 'data': [refund]}).encode(), resp.read)
 
         expected_headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -607,12 +717,695 @@ class TestClient(unittest.TestCase):
         args, kwds  = self._session.request.call_args
         self.assertEqual(args[0], 'GET')
         self.assertEqual(args[1], 'https://api.stripe.com/v1/refunds')
-        self.assertEqual(kwds['params'], {'k': '1', 'j': 2})
+        self.assertEqual(kwds['params'], [('k', '1'), ('j', '2')])
         self.assertEqual(kwds['auth'].login, 'sekret_key')
         self.assertEqual(kwds['auth'].password, '')
         self.assertEqual(kwds['headers'], expected_headers)
         self.assertEqual(r, [stripe.convert_json_response(refund)])
 
+    def test_iter_charges(self):
+        charge = json.loads(charge_json)
+        pages = [
+            {'object': 'list', 'has_more': True, 'data': [
+                dict(charge, id='ch_1'), dict(charge, id='ch_2')]},
+            {'object': 'list', 'has_more': False, 'data': [
+                dict(charge, id='ch_3')]},
+        ]
+        self._session.request.side_effect = [mkresp(page) for page in pages]
+
+        async def collect():
+            ret = []
+            async for c in self._stripe.iter_charges(limit=2):
+                ret.append(c)
+            return ret
+
+        r = base.run_until(collect())
+        self.assertEqual([c.id for c in r], ['ch_1', 'ch_2', 'ch_3'])
+        self.assertIsInstance(r[0], stripe.Charge)
+
+        calls = self._session.request.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0][1]['params'], [('limit', '2')])
+        self.assertEqual(calls[1][1]['params'], [('limit', '2'), ('starting_after', 'ch_2')])
+
+    def test_retrieve_event(self):
+        event = fixtures.as_response(fixtures.event)
+        self._session.request.return_value = mkresp(event)
+
+        r = base.run_until(self._stripe.retrieve_event('evt_aabbcc'))
+        self.assertEqual(r, fixtures.event)
+        self.assertIsInstance(r.data['object'], stripe.Charge)
+
+        args, kwds = self._session.request.call_args
+        self.assertEqual(args, ('GET', 'https://api.stripe.com/v1/events/evt_aabbcc'))
+
+        self._session.request.return_value = mkresp(fixtures.as_response([fixtures.event]))
+        r = base.run_until(self._stripe.list_events(types=['charge.succeeded']))
+        self.assertEqual(r, [fixtures.event])
+        args, kwds = self._session.request.call_args
+        self.assertEqual(kwds['params'], [('types[]', 'charge.succeeded')])
+
+    def test_tail_events(self):
+        def page(ids, has_more):
+            return mkresp({'object': 'list', 'has_more': has_more, 'data': [
+                fixtures.as_response(attr.evolve(fixtures.event, id=i)) for i in ids]})
+
+        self._session.request.side_effect = [
+            page(['evt_3', 'evt_2'], True),
+            page(['evt_4'], False)]
+        saved = []
+
+        class Recorder(checkpoint.MemoryCheckpoint):
+            async def save(self, value):
+                saved.append(value)
+                await super().save(value)
+
+        cp = Recorder('evt_1')
+
+        async def collect():
+            ret = []
+            async for e in self._stripe.tail_events(cp, batch_size=2, types=['charge.succeeded']):
+                ret.append((e.id, list(saved)))
+            return ret
+
+        r = base.run_until(collect())
+        # Checkpoint saved once each batch is consumed
+        self.assertEqual(r, [('evt_2', []), ('evt_3', []), ('evt_4', ['evt_3'])])
+        self.assertEqual(saved, ['evt_3', 'evt_4'])
+
+        calls = self._session.request.call_args_list
+        self.assertEqual(calls[0][1]['params'], [
+            ('types[]', 'charge.succeeded'), ('limit', '2'), ('ending_before', 'evt_1')])
+        self.assertEqual(calls[1][1]['params'], [
+            ('types[]', 'charge.succeeded'), ('limit', '2'), ('ending_before', 'evt_3')])
+
+        # Without a checkpoint tailing starts at the most recent event
+        self._session.request.side_effect = [
+            page(['evt_9'], True), page([], False), page(['evt_10'], False)]
+        cp = checkpoint.MemoryCheckpoint()
+
+        async def follow():
+            stream = self._stripe.tail_events(cp, follow=True, poll_interval=0)
+            try:
+                async for e in stream:
+                    return e.id
+            finally:
+                await stream.aclose()
+
+        self.assertEqual(base.run_until(follow()), 'evt_10')
+        # The last batch was not known to be processed
+        self.assertEqual(cp.value, 'evt_9')
+        calls = self._session.request.call_args_list
+        self.assertEqual(calls[-3][1]['params'], [('limit', '1')])
+        self.assertEqual(calls[-1][1]['params'], [('limit', '100'), ('ending_before', 'evt_9')])
+
+    def test_backfill_charges(self):
+        charge = json.loads(charge_json)
+
+        def request(method, url, params, **kwds):
+            gte = int(dict(params)['created[gte]'])
+            return mkresp({'object': 'list', 'has_more': False, 'data': [
+                dict(charge, id='ch_%d_b' % (gte,)),
+                dict(charge, id='ch_%d_a' % (gte,))]})
+        self._session.request.side_effect = request
+
+        async def collect():
+            ret = []
+            async for c in self._stripe.backfill_charges(100, 130, window=10, workers=2, limit=100):
+                ret.append(c)
+            return ret
+
+        r = base.run_until(collect())
+        self.assertEqual([c.id for c in r], [
+            'ch_120_b', 'ch_120_a', 'ch_110_b', 'ch_110_a', 'ch_100_b', 'ch_100_a'])
+
+        params = sorted(c[1]['params'] for c in self._session.request.call_args_list)
+        self.assertEqual(params, [
+            [('limit', '100'), ('created[gte]', '100'), ('created[lt]', '110')],
+            [('limit', '100'), ('created[gte]', '110'), ('created[lt]', '120')],
+            [('limit', '100'), ('created[gte]', '120'), ('created[lt]', '130')]])
+
+    def test_backfill_streams(self):
+        charge = json.loads(charge_json)
+        requests = {}
+        release = asyncio.Event()
+
+        async def request(method, url, params, **kwds):
+            params = dict(params)
+            gte = int(params['created[gte]'])
+            n = int(params['starting_after'].rsplit('_', 1)[1]) + 1 if 'starting_after' in params else 0
+            requests[gte] = requests.get(gte, 0) + 1
+            if gte == 120 and n > 0:
+                await release.wait()
+            return await mkresp({'object': 'list', 'has_more': n < 4, 'data': [
+                dict(charge, id='ch_%d_%d' % (gte, n))]})
+        self._session.request.side_effect = request
+
+        async def consume():
+            charges = self._stripe.backfill_charges(100, 130, window=10, workers=3, limit=1)
+            # The first page is yielded before the rest of its window arrives
+            first = await asyncio.wait_for(charges.__anext__(), 1)
+            await asyncio.sleep(0.05)
+            counts = dict(requests)
+            release.set()
+            return first.id, counts, [c.id async for c in charges]
+
+        first, counts, rest = base.run_until(consume())
+        self.assertEqual(first, 'ch_120_0')
+        # Windows not being yielded stop after a page waiting and one fetched
+        self.assertEqual(counts, {120: 2, 110: 2, 100: 2})
+        self.assertEqual(rest, ['ch_120_%d' % (i,) for i in range(1, 5)] +
+                         ['ch_%d_%d' % (gte, i) for gte in (110, 100) for i in range(5)])
+
+    def test_backfill_error(self):
+        charge = json.loads(charge_json)
+
+        def request(method, url, params, **kwds):
+            if dict(params)['created[gte]'] == '110':
+                return mkresp({'error': {'type': 'invalid_request_error'}}, status=400)
+            return mkresp({'object': 'list', 'has_more': False, 'data': [charge]})
+        self._session.request.side_effect = request
+
+        async def collect():
+            ret = []
+            with self.assertRaises(stripe.StripeError):
+                async for c in self._stripe.backfill_charges(100, 130, window=10, workers=2):
+                    ret.append(c)
+            return ret
+
+        self.assertEqual(len(base.run_until(collect())), 1)
+        self.assertEqual(self._stripe._tasks, set())
+
+    def test_backfill_created(self):
+        self._session.request.side_effect = lambda *args, **kwds: mkresp(
+            {'object': 'list', 'has_more': False, 'data': []})
+
+        def windows(**kwds):
+            async def collect():
+                return [c async for c in self._stripe.backfill_charges(100, 130, window=10, **kwds)]
+            self._session.request.reset_mock()
+            base.run_until(collect())
+            return sorted(
+                (int(dict(c[1]['params'])['created[gte]']), int(dict(c[1]['params'])['created[lt]']))
+                for c in self._session.request.call_args_list)
+
+        # created narrows the range rather than being dropped
+        self.assertEqual(windows(created={'gt': 104, 'lte': 117}), [(105, 108), (108, 118)])
+        self.assertEqual(windows(created={'gte': 0, 'lt': 1000}), [(100, 110), (110, 120), (120, 130)])
+        self.assertEqual(windows(created=125), [(125, 126)])
+        self.assertEqual(windows(created={'lt': 100}), [])
+
+        for created in ('125', {'after': 125}, {'gte': '125'}):
+            with self.assertRaises(ValueError):
+                self._stripe.backfill_charges(100, 130, created=created)
+
+    def test_retry(self):
+        self._stripe = stripe.Client(self._session, 'sekret_key',
+            retry=stripe.RetryPolicy(backoff=0))
+        error = {'error': {'type': 'rate_limit_error'}}
+        charge = json.loads(charge_json)
+        self._session.request.side_effect = [
+            mkresp(error, status=429),
+            mkresp(error, status=503),
+            mkresp(charge)]
+
+        r = base.run_until(self._stripe.create_charge(amount=103, currency='usd'))
+        self.assertEqual(r, stripe.convert_json_response(charge))
+
+        calls = self._session.request.call_args_list
+        self.assertEqual(len(calls), 3)
+        keys = set(c[1]['headers']['Idempotency-Key'] for c in calls)
+        self.assertEqual(len(keys), 1)
+
+    def test_idempotency_key(self):
+        self._stripe = stripe.Client(self._session, 'sekret_key',
+            retry=stripe.RetryPolicy(backoff=0))
+        self._session.request.side_effect = [
+            mkresp({'error': {'type': 'api_error'}}, status=503),
+            mkresp(json.loads(charge_json))]
+
+        base.run_until(self._stripe.create_charge(
+            amount=103, currency='usd', idempotency_key='order_1234'))
+
+        calls = self._session.request.call_args_list
+        self.assertEqual(
+            [c[1]['headers']['Idempotency-Key'] for c in calls],
+            ['order_1234', 'order_1234'])
+        self.assertNotIn(b'idempotency', calls[0][1]['data'])
+
+    def test_retry_after_too_long(self):
+        self._stripe = stripe.Client(self._session, 'sekret_key',
+            retry=stripe.RetryPolicy(backoff=0, max_retry_after=10))
+        self._session.request.side_effect = [
+            mkresp({'error': {'type': 'rate_limit_error'}}, status=429,
+                   headers={'Retry-After': '30'})]
+
+        with self.assertRaises(stripe.StripeError) as exc:
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc'))
+        self.assertEqual(exc.exception.http_code, 429)
+        self.assertEqual(self._session.request.call_count, 1)
+
+    def test_retry_exhausted(self):
+        self._stripe = stripe.Client(self._session, 'sekret_key',
+            retry=stripe.RetryPolicy(max_retries=1, backoff=0))
+        error = {'error': {'type': 'api_error'}}
+        self._session.request.side_effect = [
+            mkresp(error, status=502),
+            mkresp(error, status=502)]
+
+        with self.assertRaises(stripe.StripeError) as exc:
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc'))
+        self.assertEqual(exc.exception.http_code, 502)
+        self.assertEqual(self._session.request.call_count, 2)
+
+    def test_retry_policy(self):
+        policy = stripe.RetryPolicy(max_retries=2, backoff=1, jitter=0)
+        self.assertTrue(policy.should_retry(0, 'POST', 429, {}))
+        self.assertTrue(policy.should_retry(0, 'GET', 500, {}))
+        self.assertFalse(policy.should_retry(0, 'POST', 500, {}))
+        self.assertFalse(policy.should_retry(0, 'GET', 402, {}))
+        self.assertFalse(policy.should_retry(2, 'GET', 429, {}))
+        self.assertTrue(policy.should_retry(0, 'POST', None))
+        self.assertTrue(policy.should_retry(0, 'POST', 402, {'Stripe-Should-Retry': 'true'}))
+        self.assertFalse(policy.should_retry(0, 'GET', 503, {'Stripe-Should-Retry': 'false'}))
+
+        self.assertEqual(policy.delay(0), 1)
+        self.assertEqual(policy.delay(2), 4)
+        self.assertEqual(policy.delay(10), 8)
+        self.assertEqual(policy.delay(0, {'Retry-After': '5'}), 5)
+        self.assertFalse(policy.should_retry(0, 'GET', 503, {'Retry-After': '61'}))
+        self.assertTrue(policy.should_retry(0, 'GET', 503, {'Retry-After': 'soon'}))
+
+    def test_map_concurrent(self):
+        charge = json.loads(charge_json)
+        self._session.request.side_effect = [
+            mkresp(dict(charge, id='ch_1')),
+            mkresp({'error': {'type': 'invalid_request_error'}}, status=404)]
+
+        async def collect():
+            ret = []
+            async for r in self._stripe.map_concurrent(
+                    self._stripe.retrieve_charge, ['ch_1', 'ch_2'], concurrency=1):
+                ret.append(r)
+            return ret
+
+        r = base.run_until(collect())
+        self.assertEqual(r[0].value.id, 'ch_1')
+        self.assertIsInstance(r[1].exception, stripe.StripeError)
+        self.assertEqual(r[1].index, 1)
+
+    def test_coalesce_gets(self):
+        charge = json.loads(charge_json)
+        self._session.request.side_effect = [
+            mkresp(dict(charge, id='ch_1')),
+            mkresp(dict(charge, id='ch_2'))]
+
+        async def fetch():
+            return await asyncio.gather(
+                self._stripe.retrieve_charge('ch_1'),
+                self._stripe.retrieve_charge('ch_1'),
+                self._stripe.retrieve_charge('ch_2'))
+
+        r = base.run_until(fetch())
+        self.assertEqual([c.id for c in r], ['ch_1', 'ch_1', 'ch_2'])
+        self.assertEqual(self._session.request.call_count, 2)
+        self.assertEqual(self._stripe._inflight, {})
+
+    def test_coalesce_deadline(self):
+        completed = []
+
+        class Recorder(instrument.Hooks):
+            def on_complete(self, event):
+                completed.append(event)
+
+        self._stripe = stripe.Client(self._session, 'sekret_key', hooks=[Recorder()],
+            retry=stripe.RetryPolicy(backoff=0.05, jitter=0))
+        charge = json.loads(charge_json)
+
+        async def throttled(*args, **kwds):
+            await asyncio.sleep(0.01)
+            return await mkresp({'error': {}}, status=429)
+        self._session.request.side_effect = [throttled(), mkresp(charge)]
+
+        async def join():
+            await asyncio.sleep(0.001)
+            self.assertEqual(len(self._stripe._inflight), 1)
+            return await self._stripe.retrieve_charge('ch_1')
+
+        async def fetch():
+            return await asyncio.gather(
+                self._stripe.retrieve_charge('ch_1', timeout=0.03),
+                join(),
+                return_exceptions=True)
+
+        r = base.run_until(fetch())
+        # The 429 is retried for the caller without a timeout even though
+        # the retry starts after the first caller's deadline.
+        self.assertIsInstance(r[0], stripe.StripeTimeout)
+        self.assertEqual(r[1].id, charge['id'])
+        self.assertEqual(self._session.request.call_count, 2)
+        # Only the caller that started the request reports it, and it gave up
+        self.assertEqual(completed, [])
+
+    def test_coalesce_not_posts(self):
+        charge = json.loads(charge_json)
+        self._session.request.side_effect = [mkresp(charge), mkresp(charge)]
+
+        async def create():
+            return await asyncio.gather(
+                self._stripe.create_charge(amount=100, currency='usd'),
+                self._stripe.create_charge(amount=100, currency='usd'))
+
+        base.run_until(create())
+        self.assertEqual(self._session.request.call_count, 2)
+
+    def test_cache(self):
+        self._stripe = stripe.Client(self._session, 'sekret_key',
+            cache=cache.ResponseCache())
+        customer = json.loads(customer_json)
+        card = json.loads(card_json)
+        self._session.request.side_effect = [
+            mkresp(customer),
+            mkresp(dict(customer, email='new@invalid')),
+            mkresp(card),
+            mkresp(customer)]
+
+        r = base.run_until(self._stripe.retrieve_customer(customer['id']))
+        self.assertIs(base.run_until(self._stripe.retrieve_customer(customer['id'])), r)
+        self.assertEqual(self._session.request.call_count, 1)
+
+        # Updates refresh the cached object
+        base.run_until(self._stripe.update_customer(customer['id'], email='new@invalid'))
+        r = base.run_until(self._stripe.retrieve_customer(customer['id']))
+        self.assertEqual(r.email, 'new@invalid')
+        self.assertEqual(self._session.request.call_count, 2)
+
+        # New cards invalidate the customer
+        base.run_until(self._stripe.create_card(customer['id'], 'tok_aabbcc'))
+        base.run_until(self._stripe.retrieve_customer(customer['id']))
+        self.assertEqual(self._session.request.call_count, 4)
+
+    def test_lazy_client(self):
+        self._stripe = stripe.Client(self._session, 'sekret_key', lazy=True)
+        charge = json.loads(charge_json)
+        self._session.request.side_effect = [
+            mkresp({'object': 'list', 'has_more': False, 'data': [charge]})]
+
+        r = base.run_until(self._stripe.list_charges())
+        self.assertIsInstance(r[0], stripe.LazyModel)
+        self.assertEqual(r, [stripe.convert_json_response(charge)])
+
+    def test_loads(self):
+        loads = unittest.mock.Mock(side_effect=stripe.json_loads)
+        self._stripe = stripe.Client(self._session, 'sekret_key', loads=loads)
+        refund = json.loads(refund_json)
+        self._session.request.side_effect = [mkresp(refund)]
+
+        r = base.run_until(self._stripe.retrieve_refund(refund['id']))
+        self.assertEqual(r, stripe.convert_json_response(refund))
+        loads.assert_called_once_with(json.dumps(refund).encode())
+
+    def test_invalid_json(self):
+        resp = unittest.mock.MagicMock(spec=aiohttp.client_reqrep.ClientResponse)
+        resp.status = 200
+        resp.headers = multidict.CIMultiDict({'content-type': 'application/json'})
+        base.mkfuture(resp, self._session.request)
+        base.mkfuture(b'{"object": ', resp.read)
+
+        with self.assertRaises(stripe.ParseError):
+            base.run_until(self._stripe.retrieve_refund('re_aabbcc'))
+
+    def test_owned_session(self):
+        client = stripe.Client(None, 'sekret_key',
+            pool=stripe.PoolConfig(limit=10, limit_per_host=5))
+
+        async def run():
+            async with client:
+                session = client._session
+                self.assertIsInstance(session, aiohttp.ClientSession)
+                self.assertEqual(session.connector.limit_per_host, 5)
+                stats = client.pool_stats()
+            return session, stats
+
+        session, stats = base.run_until(run())
+        self.assertTrue(session.closed)
+        self.assertIsNone(client._session)
+        self.assertEqual(stats, {
+            'limit': 10, 'limit_per_host': 5, 'open': 0, 'in_use': 0, 'idle': 0, 'waiting': 0})
+
+    def test_borrowed_session(self):
+        base.run_until(self._stripe.close())
+        self.assertIs(self._stripe._session, self._session)
+        self._session.close.assert_not_called()
+
+    def test_closed(self):
+        client = stripe.Client(None, 'sekret_key')
+        base.run_until(client.close())
+        with self.assertRaises(RuntimeError):
+            base.run_until(client.retrieve_charge('ch_aabbcc'))
+        # No session is created behind the closed client's back
+        self.assertIsNone(client._session)
+
+    def test_close_cancels_prefetch(self):
+        charge = json.loads(charge_json)
+
+        async def slow(*args, **kwds):
+            await asyncio.sleep(10)
+        self._session.request.side_effect = [
+            mkresp({'object': 'list', 'has_more': True, 'data': [charge]}),
+            slow()]
+
+        async def go():
+            pager = self._stripe.iter_charges()
+            self.assertEqual((await pager.__anext__()).id, charge['id'])
+            self.assertEqual(len(self._stripe._tasks), 1)
+            # Let the prefetch reach the session
+            await asyncio.sleep(0.01)
+            await self._stripe.close()
+            self.assertEqual(len(self._stripe._tasks), 0)
+            with self.assertRaises(RuntimeError):
+                await pager.__anext__()
+
+        base.run_until(go())
+        self.assertEqual(self._session.request.call_count, 2)
+
+    def test_timeout(self):
+        async def slow(*args, **kwds):
+            await asyncio.sleep(1)
+        self._session.request.side_effect = slow
+
+        with self.assertRaises(stripe.StripeTimeout):
+            base.run_until(self._stripe.with_timeout(0.01).retrieve_charge('ch_aabbcc'))
+        self.assertIsNone(self._stripe._timeout)
+
+    def test_timeout_per_call(self):
+        async def slow(*args, **kwds):
+            await asyncio.sleep(1)
+        self._session.request.side_effect = slow
+
+        with self.assertRaises(stripe.StripeTimeout):
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc', timeout=0.01))
+        with self.assertRaises(stripe.StripeTimeout):
+            base.run_until(self._stripe.list_charges(limit=1, timeout=0.01))
+
+        # The call's timeout replaces the client's, and is not sent to Stripe
+        self._stripe = self._stripe.with_timeout(0.01)
+        self._session.request.side_effect = [mkresp(json.loads(charge_json))]
+        base.run_until(self._stripe.create_charge(999, 'usd', timeout=5))
+        args, kwds = self._session.request.call_args
+        self.assertEqual(kwds['data'], b'amount=999&currency=usd')
+
+    def test_with_timeout_closed(self):
+        charge = json.loads(charge_json)
+
+        async def slow(*args, **kwds):
+            await asyncio.sleep(10)
+        self._session.request.side_effect = [
+            mkresp({'object': 'list', 'has_more': True, 'data': [charge]}),
+            slow()]
+
+        async def go():
+            client = self._stripe.with_timeout(5)
+            pager = client.iter_charges()
+            await pager.__anext__()
+            await asyncio.sleep(0.01)
+
+            # Closing the derived client leaves the original running
+            self.assertIs(client._tasks, self._stripe._tasks)
+            await client.close()
+            self.assertTrue(self._stripe._tasks)
+
+            await self._stripe.close()
+            self.assertEqual(len(client._tasks), 0)
+            with self.assertRaises(RuntimeError):
+                await pager.__anext__()
+            with self.assertRaises(RuntimeError):
+                await client.retrieve_charge('ch_aabbcc')
+
+        base.run_until(go())
+        self.assertEqual(self._session.request.call_count, 2)
+
+    def test_timeout_skips_retry(self):
+        self._stripe = stripe.Client(self._session, 'sekret_key',
+            retry=stripe.RetryPolicy(backoff=10, jitter=0), timeout=1)
+        self._session.request.side_effect = [mkresp({'error': {}}, status=503)]
+
+        with self.assertRaises(stripe.StripeError) as exc:
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc'))
+        self.assertEqual(exc.exception.http_code, 503)
+        self.assertEqual(self._session.request.call_count, 1)
+
+    def test_expand(self):
+        charge = json.loads(charge_json)
+        customer = json.loads(customer_json)
+        self._session.request.side_effect = [
+            mkresp(dict(charge, customer=customer)),
+            mkresp({'object': 'list', 'has_more': False, 'data': [dict(charge, customer=customer)]})]
+
+        r = base.run_until(self._stripe.retrieve_charge('ch_aabbcc', expand=['customer']))
+        self.assertEqual(r.customer, stripe.convert_json_response(customer))
+        args, kwds = self._session.request.call_args
+        self.assertEqual(kwds['params'], [('expand[]', 'customer')])
+
+        r = base.run_until(self._stripe.list_charges(limit=1, expand='customer'))
+        self.assertIsInstance(r[0].customer, stripe.Customer)
+        args, kwds = self._session.request.call_args
+        self.assertEqual(kwds['params'], [('limit', '1'), ('expand[]', 'data.customer')])
+
+    def test_expand_invalid(self):
+        with self.assertRaises(ValueError):
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc', expand=['outcome']))
+        with self.assertRaises(ValueError):
+            self._stripe.iter_refunds(expand=['data.status'])
+        self._session.request.assert_not_called()
+
+    def test_resolve(self):
+        self._stripe = stripe.Client(self._session, 'sekret_key',
+            cache=cache.ResponseCache())
+        charge = json.loads(charge_json)
+        customer = json.loads(customer_json)
+        charges = stripe.convert_json_response([
+            dict(charge, id='ch_1', customer='cus_1'),
+            dict(charge, id='ch_2', customer='cus_2'),
+            dict(charge, id='ch_3', customer='cus_1'),
+            dict(charge, id='ch_4', customer=None)])
+        self._stripe._cache.put('customer', stripe.convert_json_response(dict(customer, id='cus_2')))
+
+        def request(method, url, **kwds):
+            self.assertEqual(url, 'https://api.stripe.com/v1/customers/cus_1')
+            return mkresp(dict(customer, id='cus_1'))
+        self._session.request.side_effect = request
+
+        r = base.run_until(self._stripe.resolve(charges, fields=['customer']))
+        self.assertEqual(self._session.request.call_count, 1)
+        self.assertEqual([c.id for c in r], ['ch_1', 'ch_2', 'ch_3', 'ch_4'])
+        self.assertEqual([c.customer and c.customer.id for c in r], ['cus_1', 'cus_2', 'cus_1', None])
+        self.assertIs(r[0].customer, r[2].customer)
+        self.assertIs(r[3], charges[3])
+        self.assertEqual(r[0].invoice, charges[0].invoice)
+
+    def test_hooks(self):
+        events = []
+
+        class Recorder(instrument.Hooks):
+            def on_request_start(self, event):
+                events.append(('start', event))
+
+            def on_response(self, event):
+                events.append(('response', event))
+
+            def on_retry(self, event):
+                events.append(('retry', event))
+
+            def on_error(self, event):
+                events.append(('error', event))
+
+        self._stripe = stripe.Client(self._session, 'sekret_key',
+            retry=stripe.RetryPolicy(max_retries=1, backoff=0), hooks=[Recorder()])
+        self._session.request.side_effect = [
+            mkresp({'error': {}}, status=503, headers={'Request-Id': 'req_1'}),
+            mkresp({'error': {}}, status=503, headers={'Request-Id': 'req_2'})]
+
+        with self.assertRaises(stripe.StripeError):
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc'))
+
+        self.assertEqual(
+            [name for name, _ in events],
+            ['start', 'response', 'retry', 'start', 'response', 'error'])
+        response = events[1][1]
+        self.assertEqual(response.method, 'GET')
+        self.assertEqual(response.endpoint, '/charges/{id}')
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.request_id, 'req_1')
+        self.assertEqual(response.response_size, len(b'{"error": {}}'))
+        self.assertGreaterEqual(response.latency, 0)
+        self.assertEqual(events[4][1].attempt, 1)
+        self.assertIsInstance(events[5][1].error, stripe.StripeError)
+
+    def test_expand_without_model(self):
+        charge = json.loads(charge_json)
+        txn = {'object': 'balance_transaction', 'id': 'txn_aabbcc', 'amount': 999}
+        self._session.request.side_effect = [
+            mkresp(dict(charge, balance_transaction=txn))]
+
+        # Objects without a model are left as decoded
+        r = base.run_until(self._stripe.retrieve_charge(
+            'ch_aabbcc', expand=['balance_transaction']))
+        self.assertIsInstance(r, stripe.Charge)
+        self.assertEqual(r.balance_transaction, txn)
+
+    def test_socket_timeout_not_deadline(self):
+        errors = []
+
+        class Recorder(instrument.Hooks):
+            def on_error(self, event):
+                errors.append(event.error)
+
+        self._stripe = stripe.Client(self._session, 'sekret_key', timeout=5,
+            retry=stripe.RetryPolicy(max_retries=0), hooks=[Recorder()])
+        self._session.request.side_effect = aiohttp.ServerTimeoutError('read timeout')
+
+        # A socket timeout is reported as is, not as the call's deadline
+        with self.assertRaises(aiohttp.ServerTimeoutError):
+            base.run_until(self._stripe.retrieve_charge('ch_aabbcc'))
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], aiohttp.ServerTimeoutError)
+
+        async def slow(*args, **kwds):
+            await asyncio.sleep(1)
+        self._session.request.side_effect = slow
+        with self.assertRaises(stripe.StripeTimeout):
+            base.run_until(self._stripe.with_timeout(0.01).retrieve_charge('ch_aabbcc'))
+        self.assertEqual(len(errors), 2)
+        self.assertIsInstance(errors[1], stripe.StripeTimeout)
+
+    def test_hooks_phases(self):
+        completed = []
+
+        class Recorder(instrument.Hooks):
+            def on_complete(self, event):
+                completed.append(event)
+
+        self._stripe = stripe.Client(self._session, 'sekret_key', hooks=[Recorder()])
+        self._session.request.return_value = mkresp(json.loads(charge_json))
+
+        base.run_until(self._stripe.retrieve_charge('ch_19t4yv2eZvKYlo2CpTQShodI'))
+
+        args, kwds = self._session.request.call_args
+        self.assertIsInstance(kwds['trace_request_ctx'], instrument.CallTrace)
+        self.assertEqual(len(completed), 1)
+        self.assertEqual(completed[0].status, 200)
+        self.assertEqual(
+            set(completed[0].phases), {'body_read', 'json_decode', 'model_build'})
+        self.assertTrue(all(t >= 0 for t in completed[0].phases.values()))
+
+        # No tracing without hooks
+        self._stripe = stripe.Client(self._session, 'sekret_key')
+        self._session.request.return_value = mkresp(json.loads(charge_json))
+        base.run_until(self._stripe.retrieve_charge('ch_19t4yv2eZvKYlo2CpTQShodI'))
+        args, kwds = self._session.request.call_args
+        self.assertNotIn('trace_request_ctx', kwds)
+
 
 # Test data scraped from API documentation
 charge_json = '''
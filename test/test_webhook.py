@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import sys
+import time
+import unittest
+
+import aiohttp
+from aiohttp import web
+
+import base
+
+import asyncio_stripe.dedup as dedup
+import asyncio_stripe.fixtures as fixtures
+import asyncio_stripe.stripe as stripe
+import asyncio_stripe.webhook as webhook
+
+
+secret = 'whsec_test'
+payload = json.dumps(fixtures.as_response(fixtures.event)).encode()
+
+
+class TestSignature(unittest.TestCase):
+    def test_roundtrip(self):
+        header = webhook.sign(payload, secret, timestamp=1000)
+        self.assertTrue(header.startswith('t=1000,v1='))
+        self.assertEqual(
+            webhook.verify_signature(payload, header, secret, now=1010), 1000)
+
+    def test_rejected(self):
+        header = webhook.sign(payload, secret, timestamp=1000)
+        for body, hdr, now in (
+                (payload + b' ', header, 1000),
+                (payload, header, 2000),
+                (payload, webhook.sign(payload, 'whsec_other', 1000), 1000),
+                (payload, 't=1000', 1000),
+                (payload, 'v1=abc', 1000),
+                (payload, 't=abc,v1=abc', 1000),
+                (payload, None, 1000)):
+            with self.assertRaises(webhook.SignatureError):
+                webhook.verify_signature(body, hdr, secret, now=now)
+
+        # Disabled tolerance
+        self.assertEqual(webhook.verify_signature(
+            payload, header, secret, tolerance=None, now=2000), 1000)
+
+    def test_multiple(self):
+        ts = int(time.time())
+        header = 't=%d,v1=%s,v1=%s,v0=abc' % (
+            ts,
+            webhook.compute_signature(payload, 'whsec_old', ts),
+            webhook.compute_signature(payload, 'whsec_new', ts))
+        webhook.verify_signature(payload, header, 'whsec_new')
+        webhook.verify_signature(payload, header, ['whsec_x', 'whsec_old'])
+        with self.assertRaises(webhook.SignatureError):
+            webhook.verify_signature(payload, header, ['whsec_x'])
+
+    def test_construct_event(self):
+        event = webhook.construct_event(
+            payload, webhook.sign(payload, secret), secret)
+        self.assertEqual(event, fixtures.event)
+        self.assertIsInstance(event.data['object'], stripe.Charge)
+
+        for body in (b'{', json.dumps(fixtures.as_response(fixtures.charge)).encode()):
+            with self.assertRaises(stripe.ParseError):
+                webhook.construct_event(body, webhook.sign(body, secret), secret)
+
+
+class TestReceiver(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = None
+
+    def tearDown(self):
+        if self._runner is not None:
+            base.run_until(self._runner.cleanup())
+        self._loop.close()
+
+    def serve(self, receiver):
+        async def go():
+            app = web.Application()
+            receiver.attach(app, '/hook')
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            await site.start()
+            return 'http://127.0.0.1:%d/hook' % (self._runner.addresses[0][1],)
+        return base.run_until(go())
+
+    async def post(self, url, body, header):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                    url, data=body, headers={'Stripe-Signature': header}) as r:
+                return r.status
+
+    def test_delivery(self):
+        seen = []
+        release = asyncio.Event()
+
+        async def handler(event):
+            await release.wait()
+            seen.append(event)
+            if len(seen) == 2:
+                raise RuntimeError()
+
+        receiver = webhook.webhook_handler(secret, handler, workers=1, queue_size=1)
+        url = self.serve(receiver)
+
+        async def go():
+            statuses = []
+            for _ in range(3):
+                statuses.append(await self.post(url, payload, webhook.sign(payload, secret)))
+                await asyncio.sleep(0)
+            statuses.append(await self.post(url, payload, 't=1,v1=bad'))
+            release.set()
+            await receiver.stop()
+            return statuses
+
+        # First event is taken by the worker, the second waits in the queue
+        # and the third does not fit.
+        self.assertEqual(base.run_until(go()), [200, 200, 503, 400])
+        self.assertEqual(seen, [fixtures.event, fixtures.event])
+        self.assertEqual(receiver.stats['accepted'], 2)
+        self.assertEqual(receiver.stats['overflow'], 1)
+        self.assertEqual(receiver.stats['rejected'], 1)
+        self.assertEqual(receiver.stats['handled'], 1)
+        self.assertEqual(receiver.stats['failed'], 1)
+        self.assertEqual(receiver.pending(), 0)
+
+    def test_dedup(self):
+        seen = []
+
+        async def handler(event):
+            seen.append(event.id)
+            if len(seen) == 1:
+                raise RuntimeError()
+
+        store = dedup.MemoryDedupStore()
+        receiver = webhook.webhook_handler(secret, handler, dedup=store)
+        url = self.serve(receiver)
+
+        async def go():
+            statuses = []
+            for _ in range(3):
+                statuses.append(await self.post(url, payload, webhook.sign(payload, secret)))
+                # Let the worker finish with the event
+                await asyncio.sleep(0.01)
+            await receiver.stop()
+            return statuses
+
+        # The first delivery fails and is released, the second is handled
+        # and the third skipped.
+        self.assertEqual(base.run_until(go()), [200, 200, 200])
+        self.assertEqual(seen, ['evt_aabbcc', 'evt_aabbcc'])
+        self.assertEqual(receiver.stats['duplicate'], 1)
+        self.assertEqual(receiver.stats['handled'], 1)
+
+    def test_ack_handled(self):
+        seen = []
+
+        async def handler(event):
+            seen.append(event.id)
+            if len(seen) == 1:
+                raise RuntimeError()
+
+        store = dedup.MemoryDedupStore()
+        receiver = webhook.webhook_handler(
+            secret, handler, dedup=store, ack='handled')
+        url = self.serve(receiver)
+
+        async def go():
+            statuses = []
+            for _ in range(3):
+                statuses.append(await self.post(url, payload, webhook.sign(payload, secret)))
+            return statuses
+
+        # The failed event is answered with a 500 and released, so Stripe's
+        # redelivery is handled and the one after that skipped.
+        self.assertEqual(base.run_until(go()), [500, 200, 200])
+        self.assertEqual(seen, ['evt_aabbcc', 'evt_aabbcc'])
+        self.assertEqual(receiver.stats['failed'], 1)
+        self.assertEqual(receiver.stats['handled'], 1)
+        self.assertEqual(receiver.stats['duplicate'], 1)
+        self.assertEqual(receiver.pending(), 0)
+
+        with self.assertRaises(ValueError):
+            webhook.webhook_handler(secret, handler, ack='never')
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG if '-v' in sys.argv else logging.CRITICAL + 1)
+    unittest.main()
+
+if __name__ == '__main__':
+    main()